@@ -0,0 +1,27 @@
+from django.apps import AppConfig
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+
+
+class OrdersConfig(AppConfig):
+    name = 'apps.orders'
+    default_auto_field = 'django.db.models.BigAutoField'
+
+    def ready(self):
+        from .catalog import invalidate_catalog
+        from .models import LabComment, LabOrder, LabTest, TestStatus
+        from . import tracking
+
+        post_save.connect(invalidate_catalog, sender=LabTest, dispatch_uid='orders.catalog.save')
+        post_delete.connect(invalidate_catalog, sender=LabTest, dispatch_uid='orders.catalog.delete')
+
+        # Rollup and change feed upkeep for order writes that bypass the API views
+        pre_save.connect(tracking.remember_order, sender=LabOrder, dispatch_uid='orders.rollup.pre_save')
+        post_save.connect(tracking.count_order, sender=LabOrder, dispatch_uid='orders.rollup.save')
+        pre_delete.connect(tracking.remember_tests, sender=LabOrder, dispatch_uid='orders.rollup.pre_delete')
+        post_delete.connect(tracking.uncount_order, sender=LabOrder, dispatch_uid='orders.rollup.delete')
+        m2m_changed.connect(tracking.count_tests, sender=LabOrder.tests.through, dispatch_uid='orders.rollup.tests')
+        for model in (TestStatus, LabComment):
+            name = model._meta.model_name
+            pre_save.connect(tracking.remember_part_order, sender=model, dispatch_uid=f'orders.changes.{name}.pre_save')
+            post_save.connect(tracking.record_part_change, sender=model, dispatch_uid=f'orders.changes.{name}.save')
+            post_delete.connect(tracking.record_part_change, sender=model, dispatch_uid=f'orders.changes.{name}.delete')
@@ -0,0 +1,147 @@
+"""
+Process-wide cache of the LabTest catalog.
+
+The catalog is read on every order form load and every order serialization,
+but changes about once a month. `test_catalog.snapshot()` returns an immutable
+CatalogSnapshot (id -> name, privilege, vac_col, comp, section, plus every
+panel's expansion into its component tests) stamped with the catalog version:
+the row count and newest `updated_at` of LabTest, the same validator the
+conditional GET code uses. A snapshot is trusted for
+LAB_TEST_CATALOG_RECHECK_SECONDS. After that, the next caller re-reads the
+version with one aggregate query, and reloads the rows only if the version moved.
+
+LabTest saves and deletes in this process invalidate the snapshot straight
+away and again when they commit; other processes notice at their next
+recheck. Bulk writes that skip signals (bulk_create, update()) must set
+`updated_at` and call `test_catalog.invalidate()` themselves.
+"""
+import threading
+import time
+from django.conf import settings
+from django.db import transaction
+from .conditional import queryset_version
+from .models import LabTest
+
+DEFAULT_RECHECK_SECONDS = 5
+# Value order of each catalog row; these are attnames, as Model.from_db expects
+CATALOG_FIELDS = ('id', 'name', 'privilege', 'vac_col', 'comp_id', 'section')
+
+
+class CatalogSnapshot:
+    """One version of the catalog. Never mutated, so it can be shared between threads"""
+
+    def __init__(self, version, last_modified, rows):
+        self.version = version
+        self.last_modified = last_modified
+        self.rows = rows
+        self.by_id = {row[0]: row for row in rows}
+        self.components = expand_panels(rows)
+        self._serialized = None
+
+    def __contains__(self, test_id):
+        return test_id in self.by_id
+
+    def name(self, test_id):
+        row = self.by_id.get(test_id)
+        return row[1] if row else None
+
+    def instances(self, test_ids):
+        """Map id -> fresh LabTest for those of `test_ids` in the catalog, without a query"""
+        return {
+            test_id: LabTest.from_db('default', CATALOG_FIELDS, self.by_id[test_id])
+            for test_id in test_ids if test_id in self.by_id
+        }
+
+    def expand(self, test_ids):
+        """`test_ids` with every panel replaced by its component tests, in order and without duplicates"""
+        expanded = {}
+        for test_id in test_ids:
+            for component_id in self.components.get(test_id) or (test_id,):
+                expanded[component_id] = None
+        return list(expanded)
+
+    def _serialize(self):
+        if self._serialized is None:
+            from .serializers import LabTestSerializer
+
+            tests = [LabTest.from_db('default', CATALOG_FIELDS, row) for row in self.rows]
+            self._serialized = {
+                test.pk: (test.privilege, data)
+                for test, data in zip(tests, LabTestSerializer(tests, many=True).data)
+            }
+        return self._serialized
+
+    def serialized(self, privileges=None):
+        """LabTestSerializer output for the catalog, built once per snapshot"""
+        return [data for privilege, data in self._serialize().values() if not privileges or privilege in privileges]
+
+    def serialized_by_id(self):
+        return {test_id: data for test_id, (_, data) in self._serialize().items()}
+
+    def panels(self, panel_ids=None):
+        """Serialized panels, each with the fully expanded list of its component tests"""
+        serialized = self._serialize()
+        return [
+            dict(serialized[panel_id][1], components=[serialized[test_id][1] for test_id in component_ids])
+            for panel_id, component_ids in self.components.items()
+            if panel_id in serialized and (not panel_ids or panel_id in panel_ids)
+        ]
+
+
+def expand_panels(rows):
+    """
+    Map each panel id to the ids of the tests it expands to, following `comp` through
+    nested panels down to tests that have no components of their own. Cycles in the
+    data are cut where they close rather than looping.
+    """
+    children = {}
+    for row in rows:
+        if row[4] is not None:
+            children.setdefault(row[4], []).append(row[0])
+
+    def leaves(test_id, path):
+        for child_id in children.get(test_id, ()):
+            if child_id in path:
+                continue
+            if child_id in children:
+                yield from leaves(child_id, path | {child_id})
+            else:
+                yield child_id
+
+    return {panel_id: tuple(dict.fromkeys(leaves(panel_id, {panel_id}))) for panel_id in sorted(children)}
+
+
+class TestCatalog:
+    def __init__(self):
+        self._snapshot = None
+        self._fresh_until = 0
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() < self._fresh_until:
+            return snapshot
+        with self._lock:
+            if self._snapshot is None or time.monotonic() >= self._fresh_until:
+                # Version first: a change landing before the rows are read only makes the next check reload
+                version, last_modified = queryset_version(LabTest.objects.all())
+                if self._snapshot is None or self._snapshot.version != version:
+                    rows = list(LabTest.objects.order_by('id').values_list(*CATALOG_FIELDS))
+                    self._snapshot = CatalogSnapshot(version, last_modified, rows)
+                recheck = getattr(settings, 'LAB_TEST_CATALOG_RECHECK_SECONDS', DEFAULT_RECHECK_SECONDS)
+                self._fresh_until = time.monotonic() + recheck
+            return self._snapshot
+
+    def invalidate(self):
+        """Make the next snapshot() re-read the version"""
+        self._fresh_until = 0
+
+
+test_catalog = TestCatalog()
+
+
+def invalidate_catalog(sender, **kwargs):
+    """post_save / post_delete receiver for LabTest"""
+    test_catalog.invalidate()
+    # Again after the commit, in case another request re-cached the old rows in the meantime
+    transaction.on_commit(test_catalog.invalidate)
@@ -0,0 +1,55 @@
+"""
+Change feed for polling clients.
+
+Every path that creates or modifies an order calls `record_changes` inside its
+own transaction, appending one OrderChange row per order. Clients keep the
+highest id they have seen as a cursor and ask for `/api/orders/changes/?since=<cursor>`,
+getting back only the ids (or payloads) of orders changed after it. Writes
+made outside the API views are recorded by the signal receivers in tracking.py.
+
+Auto-increment ids are handed out when a row is inserted, not when its
+transaction commits, so a slow transaction can commit a lower id after a reader
+has already moved past it. The feed therefore only serves changes older than
+ORDER_CHANGE_FEED_SETTLE_SECONDS, which is far longer than any order transaction.
+"""
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from .models import OrderChange
+from .live import publish_changes
+
+DEFAULT_SETTLE_SECONDS = 2
+MAX_CHANGES = 1000
+
+
+def record_changes(orders, kind):
+    """Append a `kind` change for each of `orders` with one insert, and push it to live clients"""
+    changes = OrderChange.objects.bulk_create([OrderChange(order_id=order.order_id, kind=kind) for order in orders])
+    publish_changes(changes)
+
+
+def latest_cursor():
+    return OrderChange.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def changes_since(cursor, limit=MAX_CHANGES):
+    """
+    Orders changed after `cursor`, as (new cursor, has_more, [{'order_id', 'kinds'}]).
+    Each order is listed once, in the order of its latest change.
+    """
+    settle = getattr(settings, 'ORDER_CHANGE_FEED_SETTLE_SECONDS', DEFAULT_SETTLE_SECONDS)
+    rows = list(OrderChange.objects
+                .filter(id__gt=cursor, created_at__lte=timezone.now() - timedelta(seconds=settle))
+                .order_by('id')
+                .values_list('id', 'order_id', 'kind')[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    changed = {}
+    for _, order_id, kind in rows:
+        kinds = changed.pop(order_id, [])
+        if kind not in kinds:
+            kinds.append(kind)
+        changed[order_id] = kinds
+    new_cursor = rows[-1][0] if rows else cursor
+    return new_cursor, has_more, [{'order_id': order_id, 'kinds': kinds} for order_id, kinds in changed.items()]
@@ -0,0 +1,75 @@
+"""
+Conditional GET (ETag / Last-Modified) for the read endpoints.
+
+Before anything is serialized, a view asks for a cheap version of what it is
+about to return: the latest change feed entry for orders, or the row count and
+newest `updated_at` of a queryset for tests and comments. The ETag hashes that
+version with the full request path, so every filter and page has its own tag.
+A client sending a matching If-None-Match (or an If-Modified-Since no older
+than the version) gets a 304 after that single query.
+
+The version is read before the body is built, so a change that lands in between
+makes the next poll fetch again; it can never make a client keep stale data.
+"""
+import hashlib
+from calendar import timegm
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from .models import OrderChange
+
+
+def queryset_version(queryset, field='updated_at'):
+    """(version, last modified) for `queryset`, from its row count and newest `field` value"""
+    aggregate = queryset.order_by().aggregate(count=Count('pk'), latest=Max(field))
+    latest = aggregate['latest']
+    return f"{aggregate['count']}:{latest.timestamp() if latest else 0}", latest
+
+
+def order_version(order_id=None):
+    """(version, last modified) from the newest change feed entry, for one order or all of them"""
+    changes = OrderChange.objects.all()
+    if order_id is not None:
+        changes = changes.filter(order_id=order_id)
+    return changes.order_by('-id').values_list('id', 'created_at').first()
+
+
+class ConditionalGetMixin:
+    """
+    Viewset mixin answering conditional GETs on list and retrieve without serializing.
+    Subclasses return (version, last modified) from get_version(), or None to skip the check.
+    """
+
+    def get_version(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        if self.action == 'retrieve':
+            lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+            queryset = queryset.filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        return queryset_version(queryset)
+
+    def conditional_response(self, request, render):
+        """Return a 304 if the client's copy is current, otherwise render() with validators attached"""
+        version = self.get_version() if request.method in ('GET', 'HEAD') else None
+        if version is None:
+            return render()
+        version, last_modified = version
+        path = f'{version}|{request.get_full_path()}|{request.accepted_media_type}'
+        etag = quote_etag(hashlib.md5(path.encode()).hexdigest())
+        last_modified = timegm(last_modified.utctimetuple()) if last_modified else None
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = render()
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if last_modified:
+                response['Last-Modified'] = http_date(last_modified)
+            # Let browsers keep the body but revalidate on every poll
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(request, lambda: super(ConditionalGetMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(request, lambda: super(ConditionalGetMixin, self).retrieve(request, *args, **kwargs))
@@ -0,0 +1,90 @@
+"""
+Streaming export of lab orders as NDJSON or CSV.
+
+Orders are read as plain value rows through QuerySet.iterator(), which uses a
+server-side cursor on PostgreSQL, and are handled `chunk_size` at a time: each
+chunk fetches the test names for its orders with one query and is encoded
+before the next chunk is read. Memory therefore stays flat however many orders
+match, and the first bytes go out as soon as the first chunk is ready.
+"""
+import csv
+import json
+import zlib
+from django.core.serializers.json import DjangoJSONEncoder
+from .models import LabOrder
+
+EXPORT_FIELDS = (
+    'order_id', 'patient_name', 'ip_number', 'age', 'ageunit', 'sex', 'department', 'unit',
+    'ipop', 'status', 'all_tests_status', 'created_at', 'username', 'role', 'clinical_history',
+)
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+}
+CHUNK_SIZE = 2000
+
+
+def iter_order_rows(queryset, chunk_size=CHUNK_SIZE):
+    """Yield one dict per order in `queryset`, with a `tests` list of test names"""
+    OrderTests = LabOrder.tests.through
+    rows = queryset.order_by('id').values('id', *EXPORT_FIELDS).iterator(chunk_size=chunk_size)
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield from _with_tests(chunk, OrderTests)
+            chunk = []
+    if chunk:
+        yield from _with_tests(chunk, OrderTests)
+
+
+def _with_tests(chunk, OrderTests):
+    tests = {}
+    links = (OrderTests.objects
+             .filter(laborder_id__in=[row['id'] for row in chunk])
+             .order_by('labtest_id')
+             .values_list('laborder_id', 'labtest__name'))
+    for order_pk, name in links:
+        tests.setdefault(order_pk, []).append(name)
+    for row in chunk:
+        row['tests'] = tests.get(row.pop('id'), [])
+        yield row
+
+
+class _Echo:
+    """File-like object whose write() hands the line back, so csv.writer can encode one row at a time"""
+
+    def write(self, value):
+        return value
+
+
+def encode_ndjson(rows):
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    for row in rows:
+        yield encoder.encode(row) + '\n'
+
+
+def encode_csv(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_FIELDS + ('tests',))
+    for row in rows:
+        values = [row[field] for field in EXPORT_FIELDS]
+        values[EXPORT_FIELDS.index('created_at')] = row['created_at'].isoformat()
+        yield writer.writerow(values + ['; '.join(row['tests'])])
+
+
+def gzip_stream(chunks, level=6):
+    """Compress an iterable of strings into a gzip stream without buffering it whole"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_orders(queryset, output_format='ndjson', gzip=False, chunk_size=CHUNK_SIZE):
+    """Iterable of encoded chunks (str, or bytes when gzipped) for every order in `queryset`"""
+    encode = encode_csv if output_format == 'csv' else encode_ndjson
+    chunks = encode(iter_order_rows(queryset, chunk_size=chunk_size))
+    return gzip_stream(chunks) if gzip else chunks
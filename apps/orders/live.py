@@ -0,0 +1,278 @@
+"""
+Live order events pushed to dashboards over Server-Sent Events.
+
+Write paths already call `changes.record_changes`, which hands order-created
+and status-changed changes to `publish_changes`. Once the transaction commits,
+the affected orders are read back with one query and an event per order goes to
+the configured backend:
+
+- LocalEventBackend delivers straight to this process's hub. Only enough when
+  the same single process serves both the writes and the streams.
+- PostgresEventBackend sends each event with NOTIFY. Every worker runs one
+  listener thread on its own connection and feeds what it hears into its hub,
+  so a client connected to any worker sees changes made on all of them,
+  including writes served by the WSGI process.
+
+Each connected client is a Subscription on the hub: an asyncio queue plus its
+department/section filters. An idle client costs one parked coroutine and no
+queries; the database is only touched when an order actually changes.
+
+Select the backend with ORDER_EVENT_BACKEND (a dotted path). Without it,
+PostgresEventBackend is used on PostgreSQL and LocalEventBackend elsewhere.
+"""
+import asyncio
+import json
+import logging
+import select
+import threading
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.utils.module_loading import import_string
+from .models import LabOrder
+
+logger = logging.getLogger(__name__)
+
+# OrderChange kinds that are pushed, and the event name they go out as
+EVENT_KINDS = {
+    'created': 'order.created',
+    'status': 'order.status',
+    'test_status': 'order.status',
+}
+LOCAL_BACKEND = 'apps.orders.live.LocalEventBackend'
+POSTGRES_BACKEND = 'apps.orders.live.PostgresEventBackend'
+NOTIFY_CHANNEL = 'lab_order_events'
+# Events buffered per client before it is treated as stalled and disconnected
+QUEUE_SIZE = 256
+# Seconds before a stream is closed and the client made to reconnect
+STREAM_MAX_AGE = 300
+# Listener reconnect backoff bounds, in seconds
+RECONNECT_DELAY = 1
+MAX_RECONNECT_DELAY = 60
+
+
+class Subscription:
+    """One connected client: a queue of matching events, filled from any thread"""
+
+    def __init__(self, hub, loop, departments=None, sections=None):
+        self.hub = hub
+        self.loop = loop
+        self.departments = set(departments or ())
+        self.sections = set(sections or ())
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.overflowed = False
+
+    def matches(self, event):
+        data = event['data']
+        if self.departments and data['department'] not in self.departments:
+            return False
+        if self.sections and not self.sections.intersection(data['sections']):
+            return False
+        return True
+
+    def offer(self, event):
+        """Queue `event` for this client; called on the subscriber's event loop"""
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # A client this far behind gets disconnected and catches up through the change feed
+            self.overflowed = True
+            self.hub.unsubscribe(self)
+
+    async def get(self, timeout):
+        """Next event, None once the subscription has overflowed, or raises asyncio.TimeoutError"""
+        if self.overflowed:
+            return None
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class OrderEventHub:
+    """In-process fan-out of order events to the subscriptions that want them"""
+
+    def __init__(self):
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, departments=None, sections=None):
+        subscription = Subscription(self, asyncio.get_running_loop(), departments, sections)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscriptions)
+
+    def dispatch(self, event):
+        """Deliver `event` to matching subscribers; safe to call from any thread"""
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            if subscription.matches(event):
+                try:
+                    subscription.loop.call_soon_threadsafe(subscription.offer, event)
+                except RuntimeError:
+                    # The client's event loop has shut down
+                    self.unsubscribe(subscription)
+
+
+hub = OrderEventHub()
+
+
+class LocalEventBackend:
+    """Delivers events to this process only"""
+
+    def __init__(self, hub):
+        self.hub = hub
+
+    def has_listeners(self):
+        return self.hub.subscriber_count > 0
+
+    def publish(self, events):
+        for event in events:
+            self.hub.dispatch(event)
+
+    def start(self):
+        pass
+
+
+class PostgresEventBackend:
+    """Shares events between workers with PostgreSQL LISTEN/NOTIFY"""
+
+    def __init__(self, hub, channel=NOTIFY_CHANNEL):
+        self.hub = hub
+        self.channel = channel
+        self._listener = None
+        self._start_lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def has_listeners(self):
+        # Clients may be connected to other workers
+        return True
+
+    def publish(self, events):
+        with connection.cursor() as cursor:
+            for event in events:
+                cursor.execute('SELECT pg_notify(%s, %s)', [self.channel, json.dumps(event, separators=(',', ':'))])
+
+    def start(self):
+        with self._start_lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(target=self._listen, name='order-events', daemon=True)
+                self._listener.start()
+
+    def stop(self):
+        """Ask the listener thread to close its connection and exit"""
+        self._stopping.set()
+
+    def _listen(self):
+        default = connections['default']
+        delay = RECONNECT_DELAY
+        while not self._stopping.is_set():
+            conn = None
+            try:
+                conn = default.get_new_connection(default.get_connection_params())
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(f'LISTEN {default.ops.quote_name(self.channel)}')
+                delay = RECONNECT_DELAY
+                while not self._stopping.is_set():
+                    if select.select([conn], [], [], 5) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        self.hub.dispatch(json.loads(notify.payload))
+            except Exception:
+                logger.warning('Order event listener lost its connection, reconnecting in %ds', delay, exc_info=True)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            if self._stopping.wait(delay):
+                break
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        default = POSTGRES_BACKEND if connection.vendor == 'postgresql' else LOCAL_BACKEND
+        _backend = import_string(getattr(settings, 'ORDER_EVENT_BACKEND', None) or default)(hub)
+    return _backend
+
+
+def publish_changes(changes):
+    """Push events for OrderChange rows once the surrounding transaction commits"""
+    changes = [change for change in changes if change.kind in EVENT_KINDS]
+    if changes and get_backend().has_listeners():
+        transaction.on_commit(lambda: _publish(changes))
+
+
+def _publish(changes):
+    orders = {}
+    rows = (LabOrder.objects
+            .filter(order_id__in={change.order_id for change in changes})
+            .values_list('order_id', 'department', 'unit', 'ipop', 'status', 'tests__section'))
+    for order_id, department, unit, ipop, status, section in rows:
+        order = orders.setdefault(order_id, {
+            'order_id': order_id, 'department': department, 'unit': unit,
+            'ipop': ipop, 'status': status, 'sections': [],
+        })
+        if section and section not in order['sections']:
+            order['sections'].append(section)
+
+    events = [
+        {'id': change.id, 'event': EVENT_KINDS[change.kind], 'data': orders[change.order_id]}
+        for change in changes if change.order_id in orders
+    ]
+    try:
+        get_backend().publish(events)
+    except Exception:
+        # The write has already committed; a missed push is recovered through the change feed
+        logger.exception('Could not publish %d order events', len(events))
+
+
+def format_event(event):
+    lines = []
+    if event.get('id'):
+        lines.append(f"id: {event['id']}")
+    lines.append(f"event: {event['event']}")
+    lines.append(f"data: {json.dumps(event['data'], separators=(',', ':'))}")
+    return '\n'.join(lines) + '\n\n'
+
+
+async def event_stream(subscription, heartbeat=15, max_age=STREAM_MAX_AGE):
+    """
+    SSE body for `subscription`, with a comment line every `heartbeat` seconds to keep
+    proxies open. The stream ends after `max_age` seconds and the browser reconnects,
+    which bounds how long a subscription can outlive a client that vanished silently.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + max_age
+    try:
+        yield 'retry: 3000\n\n'
+        while loop.time() < deadline:
+            try:
+                event = await subscription.get(min(heartbeat, max(deadline - loop.time(), 0)))
+            except asyncio.TimeoutError:
+                yield ': ping\n\n'
+                continue
+            if event is None:
+                return
+            yield format_event(event)
+    finally:
+        subscription.close()
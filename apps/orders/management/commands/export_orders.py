@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from apps.orders.export import CHUNK_SIZE, EXPORT_FORMATS, export_orders
+from apps.orders.models import LabOrder
+from apps.orders.search import SEARCH_PARAMS, filter_orders
+
+class Command(BaseCommand):
+    help = 'Export lab orders as NDJSON or CSV, accepting the same filters as the search endpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', '-o', type=str, help='File to write to (defaults to stdout)')
+        parser.add_argument('--output-format', choices=list(EXPORT_FORMATS), default='ndjson')
+        parser.add_argument('--gzip', action='store_true', help='Compress the output with gzip')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Orders read per database round trip')
+        for param in SEARCH_PARAMS:
+            parser.add_argument(f"--{param.replace('_', '-')}", dest=param, type=str, default='',
+                                help=f'Search filter {param}')
+
+    def handle(self, *args, **options):
+        if options['gzip'] and not options['output']:
+            raise CommandError('--gzip needs --output')
+
+        filters = {param: options[param] for param in SEARCH_PARAMS}
+        queryset = filter_orders(LabOrder.objects.all(), filters)
+        chunks = export_orders(queryset, options['output_format'], options['gzip'], options['chunk_size'])
+
+        if not options['output']:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+        if options['gzip']:
+            output = open(options['output'], 'wb')
+        else:
+            output = open(options['output'], 'w', encoding='utf-8', newline='')
+        with output:
+            for chunk in chunks:
+                output.write(chunk)
+        self.stdout.write(self.style.SUCCESS(f"Exported orders to {options['output']}"))
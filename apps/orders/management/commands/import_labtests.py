@@ -1,45 +1,134 @@
 import csv
-from django.core.management.base import BaseCommand
-from django.db import connection
+from graphlib import CycleError, TopologicalSorter
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils import timezone
+from apps.orders.catalog import test_catalog
 from apps.orders.models import LabTest
 
+REQUIRED_COLUMNS = {'id', 'name', 'privilege', 'vac_col', 'comp', 'section'}
+# Compared against the database to decide what changed, in report order
+COMPARED_FIELDS = ('name', 'privilege', 'vac_col', 'section', 'comp_id')
+
 class Command(BaseCommand):
-    help = 'Import LabTests from a CSV file'
+    help = (
+        'Import LabTests from a CSV file, creating new tests and updating existing ones in one transaction. '
+        'A blank comp cell keeps an existing test\'s current comp, so partial files never detach panel components.'
+    )
 
     def add_arguments(self, parser):
         parser.add_argument('csv_file', type=str, help='The path to the CSV file to be imported')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would change without writing anything')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows written per statement')
+
+    def handle(self, *args, **options):
+        rows = self.read_rows(options['csv_file'])
+        existing = {
+            values[0]: dict(zip(COMPARED_FIELDS, values[1:]))
+            for values in LabTest.objects.values_list('id', *COMPARED_FIELDS)
+        }
+        for test_id, values in rows.items():
+            if values['comp_id'] is None and test_id in existing:
+                # A blank cell means "unchanged", not "no comp"
+                values['comp_id'] = existing[test_id]['comp_id']
+        ordered = self.resolve_order(rows, existing)
+
+        created, updated = [], []
+        for test_id in ordered:
+            row = rows[test_id]
+            current = existing.get(test_id)
+            if current is None:
+                created.append(test_id)
+            elif any(current[field] != row[field] for field in COMPARED_FIELDS):
+                updated.append(test_id)
+
+        dry_run = options['dry_run']
+        if dry_run or options['verbosity'] > 1:
+            self.report(rows, existing, created, updated)
+        summary = f'{len(created)} new, {len(updated)} updated, {len(rows) - len(created) - len(updated)} unchanged'
+        if dry_run:
+            self.stdout.write(f'Dry run: {summary}. Nothing was written.')
+            return
+
+        # Parents first, so every comp reference points at a row that is already in place
+        now = timezone.now()
+        to_write = set(created) | set(updated)
+        changed = [LabTest(id=test_id, updated_at=now, **rows[test_id]) for test_id in ordered if test_id in to_write]
+        with transaction.atomic():
+            LabTest.objects.bulk_create(
+                changed,
+                batch_size=options['batch_size'],
+                update_conflicts=True,
+                unique_fields=['id'],
+                update_fields=['name', 'privilege', 'vac_col', 'section', 'comp', 'updated_at'],
+            )
+            if created:
+                # Explicit ids don't advance the id sequence; move it past them for later inserts
+                with connection.cursor() as cursor:
+                    for sql in connection.ops.sequence_reset_sql(no_style(), [LabTest]):
+                        cursor.execute(sql)
+            transaction.on_commit(test_catalog.invalidate)
 
-    def handle(self, *args, **kwargs):
-        csv_file = kwargs['csv_file']
+        self.stdout.write(self.style.SUCCESS(f'Successfully imported LabTests from CSV: {summary}'))
+
+    def read_rows(self, csv_file):
+        """Parse and validate the whole file; map id -> field values, or raise with every problem found"""
         with open(csv_file, newline='') as file:
             reader = csv.DictReader(file)
-            required_columns = {'id', 'name', 'privilege', 'vac_col', 'comp', 'section'}
-            if not required_columns.issubset(reader.fieldnames):
-                missing_columns = required_columns - set(reader.fieldnames)
-                self.stderr.write(self.style.ERROR(f'Missing columns in CSV file: {missing_columns}'))
-                return
-            for row in reader:
-                lab_test, created = LabTest.objects.update_or_create(
-                    id=row['id'],
-                    defaults={
+            missing_columns = REQUIRED_COLUMNS - set(reader.fieldnames or ())
+            if missing_columns:
+                raise CommandError(f'Missing columns in CSV file: {missing_columns}')
+
+            rows = {}
+            errors = []
+            for line, row in enumerate(reader, start=2):
+                try:
+                    test_id = int(row['id'])
+                    values = {
                         'name': row['name'],
-                        'privilege': row['privilege'],
+                        'privilege': int(row['privilege']),
                         'vac_col': row['vac_col'],
-                        'section': row['section']
+                        'section': row['section'],
+                        'comp_id': int(row['comp']) if row['comp'].strip() else None,
                     }
-                )
-
-            file.seek(0)
-            next(reader)  # Skip the header row
-
-            for row in reader:
-                if row['comp']:
-                    try:
-                        comp_test = LabTest.objects.get(id=row['comp'])
-                        lab_test = LabTest.objects.get(id=row['id'])
-                        lab_test.comp = comp_test
-                        lab_test.save()
-                    except LabTest.DoesNotExist:
-                        self.stderr.write(self.style.ERROR(f'LabTest with id {row["comp"]} does not exist.'))
-                        return
-        self.stdout.write(self.style.SUCCESS('Successfully imported LabTests from CSV'))
\ No newline at end of file
+                except ValueError as e:
+                    errors.append(f'line {line}: {e}')
+                    continue
+                if test_id in rows:
+                    errors.append(f'line {line}: duplicate id {test_id}')
+                rows[test_id] = values
+        if errors:
+            raise CommandError('Invalid rows, nothing was imported:\n' + '\n'.join(errors))
+        return rows
+
+    def resolve_order(self, rows, existing):
+        """Ids of `rows` with every test after the test its comp points to"""
+        missing = sorted(
+            f'{test_id} -> {values["comp_id"]}' for test_id, values in rows.items()
+            if values['comp_id'] is not None
+            and values['comp_id'] not in rows and values['comp_id'] not in existing
+        )
+        if missing:
+            raise CommandError('comp references to tests that do not exist, nothing was imported: ' + ', '.join(missing))
+
+        graph = TopologicalSorter()
+        for test_id, values in rows.items():
+            if values['comp_id'] in rows:
+                graph.add(test_id, values['comp_id'])
+            else:
+                graph.add(test_id)
+        try:
+            return list(graph.static_order())
+        except CycleError as e:
+            raise CommandError(f'comp references form a cycle, nothing was imported: {e.args[1]}')
+
+    def report(self, rows, existing, created, updated):
+        for test_id in created:
+            self.stdout.write(f'+ {test_id} {rows[test_id]["name"]}')
+        for test_id in updated:
+            changes = ', '.join(
+                f'{field.removesuffix("_id")}: {existing[test_id][field]!r} -> {rows[test_id][field]!r}'
+                for field in COMPARED_FIELDS if existing[test_id][field] != rows[test_id][field]
+            )
+            self.stdout.write(f'~ {test_id} {rows[test_id]["name"]}: {changes}')
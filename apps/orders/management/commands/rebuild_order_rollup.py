@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from apps.orders.models import OrderDailyStat, TestDailyStat
+from apps.orders.rollup import rebuild_rollup
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily order rollup tables behind the stats endpoint from the orders table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows inserted per statement')
+
+    def handle(self, *args, **options):
+        rebuild_rollup(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt order rollup: {OrderDailyStat.objects.count()} order rows, '
+            f'{TestDailyStat.objects.count()} test rows'
+        ))
@@ -1,5 +1,21 @@
 from django.db import migrations
 
+def create_pattern_index(apps, schema_editor):
+    # text_pattern_ops is PostgreSQL-only; SQLite (the test database) skips it
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('''
+    CREATE INDEX IF NOT EXISTS orders_laborder_order_id_pattern_idx 
+    ON orders_laborder (order_id text_pattern_ops);
+    ''')
+
+def drop_pattern_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('''
+    DROP INDEX IF EXISTS orders_laborder_order_id_pattern_idx;
+    ''')
+
 class Migration(migrations.Migration):
 
     dependencies = [
@@ -7,13 +23,5 @@ class Migration(migrations.Migration):
     ]
 
     operations = [
-        migrations.RunSQL(
-            sql='''
-            CREATE INDEX IF NOT EXISTS orders_laborder_order_id_pattern_idx 
-            ON orders_laborder (order_id text_pattern_ops);
-            ''',
-            reverse_sql='''
-            DROP INDEX IF EXISTS orders_laborder_order_id_pattern_idx;
-            '''
-        )
-    ]
\ No newline at end of file
+        migrations.RunPython(create_pattern_index, drop_pattern_index)
+    ]
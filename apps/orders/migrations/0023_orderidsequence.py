@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0022_laborder_all_tests_status_laborder_ipop_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderIdSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.CharField(max_length=2, unique=True)),
+                ('last_value', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Order ID Sequence',
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+from django.db import migrations
+
+# (index name, table, indexed expression)
+# The UPPER(col::text) expressions match what Django emits for icontains on
+# PostgreSQL; the plain patient_name index serves trigram similarity (%).
+TRIGRAM_INDEXES = [
+    ('orders_laborder_patient_name_upper_trgm', 'orders_laborder', 'UPPER(patient_name::text)'),
+    ('orders_laborder_patient_name_trgm', 'orders_laborder', 'patient_name'),
+    ('orders_laborder_ip_number_upper_trgm', 'orders_laborder', 'UPPER(ip_number::text)'),
+    ('orders_laborder_order_id_upper_trgm', 'orders_laborder', 'UPPER(order_id::text)'),
+    ('orders_laborder_username_upper_trgm', 'orders_laborder', 'UPPER(username::text)'),
+    ('orders_labtest_name_upper_trgm', 'orders_labtest', 'UPPER(name::text)'),
+]
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, table, expression in TRIGRAM_INDEXES:
+        # CONCURRENTLY keeps the orders table writable while the index builds
+        schema_editor.execute(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} USING gin ({expression} gin_trgm_ops)'
+        )
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _, _ in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('orders', '0023_orderidsequence'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0024_trigram_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='laborder',
+            index=models.Index(fields=['created_at', 'id'], name='orders_laborder_created_id_idx'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_rollup(apps, schema_editor):
+    # Count the orders that already exist; new ones are counted as they are written
+    from apps.orders.rollup import rebuild_rollup
+
+    rebuild_rollup(
+        apps.get_model('orders', 'LabOrder'),
+        apps.get_model('orders', 'OrderDailyStat'),
+        apps.get_model('orders', 'TestDailyStat'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0025_laborder_created_id_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderDailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('department', models.CharField(max_length=255)),
+                ('unit', models.CharField(max_length=255)),
+                ('ipop', models.CharField(max_length=2)),
+                ('status', models.CharField(max_length=50)),
+                ('total', models.IntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('day', 'department', 'unit', 'ipop', 'status')},
+            },
+        ),
+        migrations.CreateModel(
+            name='TestDailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('department', models.CharField(max_length=255)),
+                ('unit', models.CharField(max_length=255)),
+                ('ipop', models.CharField(max_length=2)),
+                ('status', models.CharField(max_length=50)),
+                ('total', models.IntegerField(default=0)),
+                ('test', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='orders.labtest')),
+            ],
+            options={
+                'unique_together': {('day', 'department', 'unit', 'ipop', 'status', 'test')},
+            },
+        ),
+        migrations.RunPython(backfill_rollup, migrations.RunPython.noop),
+    ]
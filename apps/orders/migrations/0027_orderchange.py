@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:54
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0026_daily_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order_id', models.CharField(max_length=20)),
+                ('kind', models.CharField(choices=[('created', 'Created'), ('updated', 'Updated'), ('status', 'Status Changed'), ('test_status', 'Test Status Changed'), ('comment', 'Comment Added'), ('deleted', 'Deleted')], max_length=20)),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0027_orderchange'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='labcomment',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='labtest',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='orderchange',
+            index=models.Index(fields=['order_id', 'id'], name='orders_orderchange_order_idx'),
+        ),
+    ]
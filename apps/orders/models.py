@@ -1,8 +1,66 @@
 import uuid
-from django.db import models, transaction
-from django.db.models import Max
+from django.db import models, transaction, IntegrityError
+from django.db.models import Max, F
 from django.utils import timezone
 
+
+def format_order_id(year, number):
+    """Build an order ID such as OR25-000123 (6-digit padding allows 999999 orders per year)"""
+    return f'OR{year}-{number:06d}'
+
+
+class OrderIdSequence(models.Model):
+    """Per-year counter that hands out the numeric part of LabOrder.order_id"""
+    year = models.CharField(max_length=2, unique=True)
+    last_value = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Order ID Sequence'
+
+    @classmethod
+    def reserve(cls, count=1, year=None):
+        """
+        Reserve `count` consecutive order IDs for `year` (defaults to the current year)
+        and return them in order.
+
+        The counter row is incremented before it is read, so the UPDATE takes the row
+        lock and concurrent callers queue behind it instead of racing for the same
+        number. Each year gets its own row, which makes the rollover to a new year
+        start again from 000001.
+        """
+        if count < 1:
+            raise ValueError('count must be at least 1')
+        year = year or timezone.now().strftime('%y')
+
+        with transaction.atomic():
+            updated = cls.objects.filter(year=year).update(last_value=F('last_value') + count)
+            if not updated:
+                try:
+                    with transaction.atomic():
+                        cls.objects.create(year=year, last_value=cls._highest_issued(year) + count)
+                except IntegrityError:
+                    # Another request created this year's counter first
+                    cls.objects.filter(year=year).update(last_value=F('last_value') + count)
+            last_value = cls.objects.filter(year=year).values_list('last_value', flat=True).get()
+
+        first_value = last_value - count + 1
+        return [format_order_id(year, number) for number in range(first_value, last_value + 1)]
+
+    @staticmethod
+    def _highest_issued(year):
+        """Highest number already used for `year`, so a new counter continues existing numbering"""
+        prefix = f'OR{year}'
+        highest = 0
+        for order_id in LabOrder.objects.filter(order_id__startswith=prefix).values_list('order_id', flat=True).iterator():
+            number = order_id[len(prefix):].lstrip('-')
+            if number.isdigit():
+                highest = max(highest, int(number))
+        return highest
+
+    def __str__(self):
+        return f"OR{self.year}: {self.last_value}"
+
+
 class LabOrder(models.Model):
     order_id = models.CharField(max_length=20, unique=True, editable=False, db_index=True)
     patient_name = models.CharField(max_length=255, default='NA', db_index=True)
@@ -30,48 +88,19 @@ class LabOrder(models.Model):
     role = models.CharField(max_length=255, default='')
     lab_note = models.TextField(blank=True, default='')  # Keep for backward compatibility, will remove in next migration
 
+    class Meta:
+        indexes = [
+            # Serves keyset pagination on the default (created_at, id) ordering
+            models.Index(fields=['created_at', 'id'], name='orders_laborder_created_id_idx'),
+        ]
+
     def save(self, *args, **kwargs):
         if not self.order_id:
-            max_attempts = 10
-            attempt = 0
-            while attempt < max_attempts:
-                try:
-                    with transaction.atomic():
-                        current_year = timezone.now().strftime('%y')
-                        year_prefix = f'OR{current_year}'
-                        
-                        # Get the maximum number used this year with proper parsing
-                        last_order = (LabOrder.objects
-                                    .filter(order_id__startswith=year_prefix)
-                                    .order_by('-order_id')
-                                    .first())
-                        
-                        if last_order:
-                            try:
-                                # Extract the numerical part after OR{year}-
-                                last_number = int(last_order.order_id[7:])
-                                new_number = last_number + 1
-                            except (ValueError, IndexError):
-                                new_number = 1
-                        else:
-                            new_number = 1
-                        
-                        # Use 6-digit zero-padding for the sequential number (allows up to 999999 orders per year)
-                        new_order_id = f'OR{current_year}-{new_number:06d}'  # Pad with zeros for consistent length
-                        
-                        # Double-check if this ID already exists
-                        if not LabOrder.objects.filter(order_id=new_order_id).exists():
-                            self.order_id = new_order_id
-                            super().save(*args, **kwargs)
-                            return
-                    
-                    attempt += 1
-                except Exception as e:
-                    attempt += 1
-                    if attempt >= max_attempts:
-                        raise Exception(f"Failed to generate unique order_id after {max_attempts} attempts") from e
-            
-            raise Exception("Could not generate a unique order ID")
+            # Allocate the ID and insert in one transaction so a failed insert
+            # hands the number back to the counter instead of leaving a gap
+            with transaction.atomic():
+                self.order_id = OrderIdSequence.reserve()[0]
+                super().save(*args, **kwargs)
         else:
             super().save(*args, **kwargs)
 
@@ -85,6 +114,7 @@ class LabComment(models.Model):
     username = models.CharField(max_length=255)
     role = models.CharField(max_length=255)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ['-created_at']
@@ -112,6 +142,34 @@ class TestStatus(models.Model):
         unique_together = ('order', 'test')
         verbose_name_plural = 'Test Statuses'
 
+    @classmethod
+    def upsert(cls, order_tests, status):
+        """
+        Set `status` on every (order, test) pair and return only the rows whose status
+        changed. One SELECT reads the current statuses, then the changed and new rows
+        are written with one INSERT ... ON CONFLICT DO UPDATE on the (order, test) key.
+        """
+        rows = {
+            (order.pk, test.pk): cls(order=order, test=test, status=status)
+            for order, test in order_tests
+        }
+        if not rows:
+            return []
+        current = cls.objects.filter(
+            order_id__in={order_id for order_id, _ in rows},
+            test_id__in={test_id for _, test_id in rows},
+        ).values_list('order_id', 'test_id', 'status')
+        unchanged = {(order_id, test_id) for order_id, test_id, old in current if old == status}
+        rows = [row for key, row in rows.items() if key not in unchanged]
+        if rows:
+            cls.objects.bulk_create(
+                rows,
+                update_conflicts=True,
+                unique_fields=['order', 'test'],
+                update_fields=['status', 'updated_at']
+            )
+        return rows
+
     def __str__(self):
         return f"{self.test.name} - {self.status}"
 
@@ -121,10 +179,66 @@ class LabTest(models.Model):
     vac_col = models.CharField(max_length=255, default='')
     comp = models.ForeignKey('LabTest', on_delete=models.CASCADE, related_name='related_tests', null=True, blank=True)
     section = models.CharField(max_length=255, default='')
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
 
+class OrderChange(models.Model):
+    """Append-only log of order changes; the auto-increment id is the change feed cursor"""
+    KIND_CHOICES = [
+        ('created', 'Created'),
+        ('updated', 'Updated'),
+        ('status', 'Status Changed'),
+        ('test_status', 'Test Status Changed'),
+        ('comment', 'Comment Added'),
+        ('deleted', 'Deleted'),
+    ]
+    # The public order_id rather than a foreign key, so deletions stay in the log
+    order_id = models.CharField(max_length=20)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        indexes = [
+            # Newest change of one order, for its ETag
+            models.Index(fields=['order_id', 'id'], name='orders_orderchange_order_idx'),
+        ]
+
+    def __str__(self):
+        return f"#{self.pk} {self.order_id} {self.kind}"
+
+class OrderDailyStat(models.Model):
+    """Number of orders per creation day and breakdown, kept current by apps.orders.rollup"""
+    day = models.DateField()
+    department = models.CharField(max_length=255)
+    unit = models.CharField(max_length=255)
+    ipop = models.CharField(max_length=2)
+    status = models.CharField(max_length=50)
+    total = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('day', 'department', 'unit', 'ipop', 'status')
+
+    def __str__(self):
+        return f"{self.day} {self.department}/{self.unit} {self.ipop} {self.status}: {self.total}"
+
+class TestDailyStat(models.Model):
+    """Number of ordered tests per creation day, breakdown and test, kept current by apps.orders.rollup"""
+    day = models.DateField()
+    department = models.CharField(max_length=255)
+    unit = models.CharField(max_length=255)
+    ipop = models.CharField(max_length=2)
+    status = models.CharField(max_length=50)
+    test = models.ForeignKey('LabTest', on_delete=models.CASCADE, related_name='daily_stats')
+    total = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('day', 'department', 'unit', 'ipop', 'status', 'test')
+
+    def __str__(self):
+        return f"{self.day} {self.department}/{self.unit} {self.ipop} {self.status} test {self.test_id}: {self.total}"
+
 class Privilege(models.Model):
     name = models.PositiveIntegerField(unique=True)
 
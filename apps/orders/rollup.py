@@ -0,0 +1,163 @@
+"""
+Daily rollup of order counts behind the /orders/stats/ endpoint.
+
+OrderDailyStat holds one row per (creation day, department, unit, ipop, status)
+and TestDailyStat adds the test to that key. Order create, status change, test
+change and delete paths describe what they did with a RollupDelta, which folds
+the changes into net +/- counts per key and writes each table with a single
+INSERT ... ON CONFLICT DO UPDATE statement (supported by both PostgreSQL and
+SQLite). Writes made outside those paths are counted by the receivers in
+tracking.py. `manage.py rebuild_order_rollup` recomputes both tables from
+scratch, for writes that send no signals (QuerySet.update(), raw SQL).
+"""
+from collections import Counter
+from django.db import connections, router, transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from .models import OrderDailyStat, TestDailyStat
+from .stats import stats_payload
+
+ORDER_KEY_FIELDS = ('day', 'department', 'unit', 'ipop', 'status')
+TEST_KEY_FIELDS = ORDER_KEY_FIELDS + ('test',)
+# LabOrder fields the keys are made of
+ROLLUP_ORDER_FIELDS = ('created_at', 'department', 'unit', 'ipop', 'status')
+
+
+class RollupDelta:
+    """Accumulates count changes for a set of orders and writes them in one go"""
+
+    def __init__(self):
+        self.orders = Counter()
+        self.tests = Counter()
+
+    @staticmethod
+    def key(order, status=None):
+        return (
+            timezone.localdate(order.created_at),
+            order.department,
+            order.unit,
+            order.ipop,
+            status or order.status,
+        )
+
+    def add(self, order, test_ids, status=None, sign=1):
+        """Count `order` (and each of `test_ids`) under `status`, or remove it with sign=-1"""
+        self.orders[self.key(order, status)] += sign
+        self.add_tests(order, test_ids, sign, status)
+
+    def add_tests(self, order, test_ids, sign=1, status=None):
+        """Count (or with sign=-1 uncount) `test_ids` on `order` without counting the order itself"""
+        key = self.key(order, status)
+        for test_id in test_ids:
+            self.tests[key + (test_id,)] += sign
+
+    def remove(self, order, test_ids, status=None):
+        self.add(order, test_ids, status, sign=-1)
+
+    def change_status(self, order, test_ids, old_status, new_status):
+        if old_status != new_status:
+            self.remove(order, test_ids, old_status)
+            self.add(order, test_ids, new_status)
+
+    def flush(self):
+        _increment(OrderDailyStat, ORDER_KEY_FIELDS, self.orders)
+        _increment(TestDailyStat, TEST_KEY_FIELDS, self.tests)
+        self.orders.clear()
+        self.tests.clear()
+
+
+def _increment(model, key_fields, deltas):
+    rows = [(key, delta) for key, delta in deltas.items() if delta]
+    if not rows:
+        return
+    connection = connections[router.db_for_write(model)]
+    qn = connection.ops.quote_name
+    opts = model._meta
+    table = qn(opts.db_table)
+    key_columns = [qn(opts.get_field(name).column) for name in key_fields]
+    total = qn(opts.get_field('total').column)
+
+    params = []
+    for key, delta in rows:
+        params.append(connection.ops.adapt_datefield_value(key[0]))
+        params.extend(key[1:])
+        params.append(delta)
+    row_placeholder = '(' + ', '.join(['%s'] * (len(key_fields) + 1)) + ')'
+    sql = (
+        f"INSERT INTO {table} ({', '.join(key_columns)}, {total}) "
+        f"VALUES {', '.join([row_placeholder] * len(rows))} "
+        f"ON CONFLICT ({', '.join(key_columns)}) "
+        f"DO UPDATE SET {total} = {table}.{total} + EXCLUDED.{total}"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def record_created(orders_with_tests):
+    """Count newly created orders, given as (order, test_ids) pairs"""
+    delta = RollupDelta()
+    for order, test_ids in orders_with_tests:
+        delta.add(order, test_ids)
+    delta.flush()
+
+
+def rebuild_rollup(order_model=None, order_stat_model=OrderDailyStat, test_stat_model=TestDailyStat, batch_size=1000):
+    """
+    Recompute both rollup tables from the orders table. The models are parameters so the
+    migration that creates the tables can pass its historical models.
+    """
+    if order_model is None:
+        from .models import LabOrder as order_model
+    OrderTests = order_model.tests.through
+
+    order_rows = (order_model.objects
+                  .annotate(day=TruncDate('created_at'))
+                  .values('day', 'department', 'unit', 'ipop', 'status')
+                  .annotate(total=Count('id'))
+                  .order_by())
+    test_rows = (OrderTests.objects
+                 .annotate(day=TruncDate('laborder__created_at'))
+                 .values('day', 'laborder__department', 'laborder__unit', 'laborder__ipop',
+                         'laborder__status', 'labtest_id')
+                 .annotate(total=Count('id'))
+                 .order_by())
+
+    with transaction.atomic():
+        order_stat_model.objects.all().delete()
+        test_stat_model.objects.all().delete()
+        order_stat_model.objects.bulk_create(
+            (order_stat_model(**row) for row in order_rows.iterator()),
+            batch_size=batch_size
+        )
+        test_stat_model.objects.bulk_create(
+            (test_stat_model(
+                day=row['day'],
+                department=row['laborder__department'],
+                unit=row['laborder__unit'],
+                ipop=row['laborder__ipop'],
+                status=row['laborder__status'],
+                test_id=row['labtest_id'],
+                total=row['total']
+            ) for row in test_rows.iterator()),
+            batch_size=batch_size
+        )
+
+
+def rollup_stats(day_from=None, day_to=None):
+    """Stats payload for an inclusive range of creation days, read from the rollup tables"""
+    orders = OrderDailyStat.objects.all()
+    tests = TestDailyStat.objects.all()
+    if day_from:
+        orders = orders.filter(day__gte=day_from)
+        tests = tests.filter(day__gte=day_from)
+    if day_to:
+        orders = orders.filter(day__lte=day_to)
+        tests = tests.filter(day__lte=day_to)
+
+    counts = {
+        column: list(orders.values_list(column).annotate(count=Sum('total')).order_by())
+        for column in ('status', 'department', 'unit', 'ipop')
+    }
+    counts['test_name'] = list(tests.values_list('test__name').annotate(count=Sum('total')).order_by())
+    return stats_payload(sum(count for _, count in counts['status']), counts)
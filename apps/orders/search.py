@@ -0,0 +1,111 @@
+"""
+Substring and fuzzy search over lab orders.
+
+On PostgreSQL every `icontains` lookup used here compiles to
+`UPPER(col::text) LIKE UPPER('%term%')`, which is served by the pg_trgm GIN
+expression indexes created in migration 0024, and fuzzy matching uses the
+trigram `%` operator. On SQLite (the test database) the same lookups fall back
+to a LIKE scan, so results are identical, only unindexed.
+"""
+from django.db import connections
+from django.db.models import Exists, OuterRef, Q
+from .models import LabOrder
+
+# Columns covered by a trigram index and matched by the free-text `q` parameter
+TEXT_SEARCH_FIELDS = ('patient_name', 'ip_number', 'order_id', 'username')
+
+
+def supports_trigram(queryset):
+    return connections[queryset.db].vendor == 'postgresql'
+
+
+def search_text(queryset, term, fuzzy=False):
+    """
+    Orders where any of TEXT_SEARCH_FIELDS contains `term`.
+    With `fuzzy` on PostgreSQL, patient names that are only similar (typos,
+    transliteration differences) also match.
+    """
+    condition = Q()
+    for field in TEXT_SEARCH_FIELDS:
+        condition |= Q(**{f'{field}__icontains': term})
+    if fuzzy and supports_trigram(queryset):
+        condition |= Q(patient_name__trigram_similar=term)
+    return queryset.filter(condition)
+
+
+def with_test_name(queryset, term):
+    """
+    Orders that include a test whose name contains `term`.
+    Uses EXISTS rather than joining tests so an order matching several tests
+    is not duplicated and the search needs no DISTINCT.
+    """
+    OrderTests = LabOrder.tests.through
+    return queryset.filter(Exists(
+        OrderTests.objects.filter(laborder_id=OuterRef('pk'), labtest__name__icontains=term)
+    ))
+
+
+# Query parameters understood by filter_orders, shared by search and export
+SEARCH_PARAMS = (
+    'q', 'fuzzy', 'order_id', 'patient_name', 'ip_number', 'department', 'status',
+    'date_from', 'date_to', 'test_name', 'age_min', 'age_max', 'unit', 'created_by', 'ipop',
+)
+
+
+def filter_orders(queryset, params):
+    """Apply the search filters found in `params` (query params or a dict of strings) to `queryset`"""
+    patient_name = params.get('patient_name', '')
+    ip_number = params.get('ip_number', '')
+    department = params.get('department', '')
+    status = params.get('status', '')
+    date_from = params.get('date_from', '')
+    date_to = params.get('date_to', '')
+    test_name = params.get('test_name', '')
+    age_min = params.get('age_min', '')
+    age_max = params.get('age_max', '')
+    unit = params.get('unit', '')
+    created_by = params.get('created_by', '')
+    order_id = params.get('order_id', '')
+    ipop = params.get('ipop', '')
+    q = (params.get('q') or '').strip()
+    fuzzy = (params.get('fuzzy') or '').lower() in ('1', 'true', 'yes')
+
+    # Free-text search across patient name, IP number, order ID and creator
+    if q:
+        queryset = search_text(queryset, q, fuzzy=fuzzy)
+
+    # Filter by order_id if provided
+    if order_id:
+        queryset = queryset.filter(order_id__icontains=order_id)
+
+    # Optimize query by combining OR conditions
+    name_ip_filters = Q()
+    if patient_name:
+        name_ip_filters |= Q(patient_name__icontains=patient_name)
+    if ip_number:
+        name_ip_filters |= Q(ip_number__icontains=ip_number)
+    if name_ip_filters:
+        queryset = queryset.filter(name_ip_filters)
+
+    # Apply AND filters
+    if department:
+        queryset = queryset.filter(department__iexact=department)
+    if status:
+        queryset = queryset.filter(status__iexact=status)
+    if date_from:
+        queryset = queryset.filter(created_at__gte=date_from)
+    if date_to:
+        queryset = queryset.filter(created_at__lte=date_to)
+    if test_name:
+        queryset = with_test_name(queryset, test_name)
+    if age_min:
+        queryset = queryset.filter(age__gte=int(age_min))
+    if age_max:
+        queryset = queryset.filter(age__lte=int(age_max))
+    if unit:
+        queryset = queryset.filter(unit__iexact=unit)
+    if created_by:
+        queryset = queryset.filter(username__icontains=created_by)
+    if ipop:
+        queryset = queryset.filter(ipop__iexact=ipop)
+    return queryset
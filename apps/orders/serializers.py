@@ -1,14 +1,126 @@
+from types import SimpleNamespace
 from rest_framework import serializers
-from .models import LabOrder, LabTest, Privilege, TestStatus, LabComment
+from rest_framework.relations import MANY_RELATION_KWARGS
+from .models import LabOrder, LabTest, Privilege, TestStatus, LabComment, OrderIdSequence
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django.db import transaction
+from django.db.models import Prefetch
+from .changes import record_changes
+from .catalog import test_catalog
+from .rollup import ROLLUP_ORDER_FIELDS, RollupDelta, record_created
+from .tracking import tracked
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    PrimaryKeyRelatedField that resolves ids in bulk instead of one query per id.
+
+    With many=True the whole list is fetched with a single id__in query and every
+    missing id is reported in one error. Used as a single field inside a
+    PreloadingListSerializer, the ids of all items are fetched up front the same way.
+    """
+    preloaded = None
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
+
+    def to_pk(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if self.pk_field is not None:
+            data = self.pk_field.to_internal_value(data)
+        try:
+            return self.get_queryset().model._meta.pk.to_python(data)
+        except (TypeError, DjangoValidationError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+    def resolve(self, pks):
+        """Map pk -> object for the set `pks` with one query"""
+        return self.get_queryset().in_bulk(pks)
+
+    def load(self, values):
+        return self.resolve({self.to_pk(value) for value in values})
+
+    def to_internal_value(self, data):
+        if self.preloaded is None:
+            return super().to_internal_value(data)
+        try:
+            return self.preloaded[self.to_pk(data)]
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+
+class BulkManyRelatedField(serializers.ManyRelatedField):
+    default_error_messages = {
+        'does_not_exist_many': 'Invalid pks {pk_values} - objects do not exist.',
+    }
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        child = self.child_relation
+        pks = [child.to_pk(item) for item in data]
+        found = child.resolve(set(pks))
+        missing = [pk for pk in dict.fromkeys(pks) if pk not in found]
+        if missing:
+            self.fail('does_not_exist_many', pk_values=missing)
+        return [found[pk] for pk in pks]
+
+class CatalogTestField(BulkPrimaryKeyRelatedField):
+    """LabTest reference resolved from the in-memory catalog; only unknown ids trigger a reload"""
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('queryset', LabTest.objects.all())
+        super().__init__(**kwargs)
+
+    def resolve(self, pks):
+        found = test_catalog.snapshot().instances(pks)
+        if len(found) < len(pks):
+            # Possibly added by another process since our last check
+            test_catalog.invalidate()
+            found = test_catalog.snapshot().instances(pks)
+        return found
+
+class PreloadingListSerializer(serializers.ListSerializer):
+    """Resolves the BulkPrimaryKeyRelatedFields of every item with one query per field"""
+
+    def to_internal_value(self, data):
+        bulk_fields = [
+            field for field in self.child.fields.values()
+            if isinstance(field, BulkPrimaryKeyRelatedField) and not field.read_only
+        ]
+        if not isinstance(data, list) or not bulk_fields:
+            return super().to_internal_value(data)
+        try:
+            for field in bulk_fields:
+                values = [item[field.field_name] for item in data
+                          if isinstance(item, dict) and item.get(field.field_name) is not None]
+                try:
+                    field.preloaded = field.load(values)
+                except serializers.ValidationError:
+                    # Leave malformed ids to the per-item validation so errors line up with items
+                    field.preloaded = None
+            return super().to_internal_value(data)
+        finally:
+            for field in bulk_fields:
+                field.preloaded = None
 
 class TestStatusSerializer(serializers.ModelSerializer):
-    test_id = serializers.PrimaryKeyRelatedField(source='test', queryset=LabTest.objects.all())
-    test_name = serializers.StringRelatedField(source='test', read_only=True)
+    test_id = CatalogTestField(source='test')
+    test_name = serializers.SerializerMethodField()
     
     class Meta:
         model = TestStatus
         fields = ['test_id', 'test_name', 'status', 'updated_at']
+        list_serializer_class = PreloadingListSerializer
+
+    def get_test_name(self, obj):
+        return test_catalog.snapshot().name(obj.test_id) or str(obj.test)
 
 class LabCommentSerializer(serializers.ModelSerializer):
     order_id = serializers.CharField(write_only=True, required=False)
@@ -38,8 +150,54 @@ class LabCommentSerializer(serializers.ModelSerializer):
             
         return data
 
+class LabOrderListSerializer(serializers.ListSerializer):
+    """Creates a batch of orders with one bulk insert per table instead of per-order saves"""
+
+    @transaction.atomic
+    @tracked()
+    def create(self, validated_data):
+        built = [LabOrderSerializer.build_order(item) for item in validated_data]
+        orders = [lab_order for lab_order, _, _ in built]
+        
+        # Reserve the whole block of IDs with a single counter update
+        for lab_order, order_id in zip(orders, OrderIdSequence.reserve(count=len(orders))):
+            lab_order.order_id = order_id
+        LabOrder.objects.bulk_create(orders)
+        
+        if any(lab_order.pk is None for lab_order in orders):
+            # Backend can't return primary keys from a bulk insert
+            pks = dict(LabOrder.objects.filter(order_id__in=[o.order_id for o in orders])
+                                       .values_list('order_id', 'id'))
+            for lab_order in orders:
+                lab_order.pk = pks[lab_order.order_id]
+        
+        OrderTests = LabOrder.tests.through
+        order_tests = []
+        test_statuses = []
+        comments = []
+        for lab_order, tests, new_comment in built:
+            for test in tests:
+                order_tests.append(OrderTests(laborder_id=lab_order.pk, labtest_id=test.pk))
+                if lab_order.status != 'pending':
+                    test_statuses.append(TestStatus(order=lab_order, test=test, status=lab_order.status))
+            if new_comment:
+                comments.append(LabComment(
+                    order=lab_order,
+                    comment=new_comment,
+                    username=lab_order.username,
+                    role=lab_order.role
+                ))
+        
+        OrderTests.objects.bulk_create(order_tests, ignore_conflicts=True)
+        TestStatus.objects.bulk_create(test_statuses, ignore_conflicts=True)
+        LabComment.objects.bulk_create(comments)
+        record_created((lab_order, [test.pk for test in tests]) for lab_order, tests, _ in built)
+        record_changes(orders, 'created')
+        
+        return orders
+
 class LabOrderSerializer(serializers.ModelSerializer):
-    tests = serializers.PrimaryKeyRelatedField(queryset=LabTest.objects.all(), many=True)
+    tests = CatalogTestField(many=True)
     patient = serializers.JSONField(write_only=True)
     patient_details = serializers.SerializerMethodField(read_only=True)
     username = serializers.CharField()
@@ -56,6 +214,16 @@ class LabOrderSerializer(serializers.ModelSerializer):
         fields = ['order_id', 'patient', 'patient_details', 'tests', 'status', 'created_at', 
                   'username', 'role', 'clinical_history', 'comments', 'new_comment', 
                   'all_tests_status', 'test_statuses']  # Removed 'ipop' from here
+        list_serializer_class = LabOrderListSerializer
+    
+    def validate_tests(self, tests):
+        """Replace panels with their component tests, from the catalog's precomputed expansion"""
+        catalog = test_catalog.snapshot()
+        test_ids = catalog.expand([test.pk for test in tests])
+        if test_ids == [test.pk for test in tests]:
+            return tests
+        components = catalog.instances(test_ids)
+        return [components[test_id] for test_id in test_ids]
     
     def validate(self, data):
         if self.instance is None and ('tests' not in data or not data['tests']):
@@ -63,52 +231,60 @@ class LabOrderSerializer(serializers.ModelSerializer):
         return data
     
     @transaction.atomic
+    @tracked()
     def create(self, validated_data):
-        patient_data = validated_data.pop('patient')
-        tests = validated_data.pop('tests', [])
-        new_comment = validated_data.pop('new_comment', None)
-        
-        # Extract these values to use them later, but don't pass them twice
-        username = validated_data.get('username')
-        role = validated_data.get('role')
-        
-        # Create the order first without the tests
-        lab_order = LabOrder.objects.create(
-            patient_name=patient_data['name'],
-            ip_number=patient_data['ip_number'],
-            age=patient_data['age'],
-            ageunit=patient_data.get('ageunit', 'y'),
-            sex=patient_data.get('sex', 'M'),
-            department=patient_data['department'],
-            unit=patient_data['unit'],
-            ipop=patient_data.get('ipop', 'ip'),  # Default to 'ip' if not provided
-            **validated_data  # username and role are now included only once
-        )
+        lab_order, tests, new_comment = self.build_order(validated_data)
+        lab_order.save()
         
         # Set the tests after the order is created and has an ID
         lab_order.tests.set(tests)
+        record_created([(lab_order, [test.pk for test in tests])])
+        record_changes([lab_order], 'created')
         
         # If we're setting a status, let's also create test statuses for all tests
         if lab_order.status != 'pending':
-            for test in tests:
-                TestStatus.objects.create(
-                    order=lab_order,
-                    test=test,
-                    status=lab_order.status
-                )
+            TestStatus.objects.bulk_create([
+                TestStatus(order=lab_order, test=test, status=lab_order.status)
+                for test in tests
+            ])
         
         # Add a comment if provided
         if new_comment:
             LabComment.objects.create(
                 order=lab_order,
                 comment=new_comment,
-                username=username,
-                role=role
+                username=lab_order.username,
+                role=lab_order.role
             )
         
         return lab_order
     
+    @staticmethod
+    def build_order(validated_data):
+        """
+        Turn validated data into an unsaved LabOrder plus its tests and optional comment.
+        Shared by single and batch submission so both map the patient payload the same way.
+        """
+        validated_data = dict(validated_data)
+        patient_data = validated_data.pop('patient')
+        tests = validated_data.pop('tests', [])
+        new_comment = validated_data.pop('new_comment', None)
+        
+        lab_order = LabOrder(
+            patient_name=patient_data['name'],
+            ip_number=patient_data['ip_number'],
+            age=patient_data['age'],
+            ageunit=patient_data.get('ageunit', 'y'),
+            sex=patient_data.get('sex', 'M'),
+            department=patient_data['department'],
+            unit=patient_data['unit'],
+            ipop=patient_data.get('ipop', 'ip'),  # Default to 'ip' if not provided
+            **validated_data  # username and role are now included only once
+        )
+        return lab_order, tests, new_comment
+    
     @transaction.atomic
+    @tracked()
     def update(self, instance, validated_data):
         tests = validated_data.pop('tests', None)
         status = validated_data.get('status')
@@ -116,6 +292,9 @@ class LabOrderSerializer(serializers.ModelSerializer):
         new_comment = validated_data.pop('new_comment', None)
         username = validated_data.get('username')
         role = validated_data.get('role')
+        # Read the current rollup key under a row lock; a concurrent update may have moved it since `instance` was loaded
+        before = SimpleNamespace(**LabOrder.objects.select_for_update().values(*ROLLUP_ORDER_FIELDS).get(pk=instance.pk))
+        old_test_ids = list(instance.tests.values_list('id', flat=True))
         
         if tests is not None:
             instance.tests.set(tests)
@@ -123,17 +302,19 @@ class LabOrderSerializer(serializers.ModelSerializer):
         # Update the model with the remaining data
         instance = super().update(instance, validated_data)
         
+        # Move the order between rollup buckets if its status or tests changed
+        new_test_ids = [test.pk for test in tests] if tests is not None else old_test_ids
+        if RollupDelta.key(instance) != RollupDelta.key(before) or set(new_test_ids) != set(old_test_ids):
+            delta = RollupDelta()
+            delta.remove(before, old_test_ids)
+            delta.add(instance, new_test_ids)
+            delta.flush()
+        
         # Handle test statuses if status is updated
         if status and status != 'pending':
             # If status applies to all tests, update all test statuses
             if all_tests_status:
-                tests_to_update = instance.tests.all()
-                for test in tests_to_update:
-                    TestStatus.objects.update_or_create(
-                        order=instance,
-                        test=test,
-                        defaults={'status': status}
-                    )
+                TestStatus.upsert(((instance, test) for test in instance.tests.all()), status)
         
         # Add a comment if provided
         if new_comment:
@@ -144,8 +325,22 @@ class LabOrderSerializer(serializers.ModelSerializer):
                 role=role or instance.role
             )
         
+        record_changes([instance], 'updated')
         return instance
     
+    @staticmethod
+    def prefetch_for_read(queryset):
+        """
+        Prefetch the relations this serializer reads so a page of orders costs the
+        same number of queries whatever its size: the page itself plus one query each
+        for test ids, comments and test statuses. Test names come from the catalog.
+        """
+        return queryset.prefetch_related(
+            Prefetch('tests', queryset=LabTest.objects.only('id')),
+            'comments',
+            'test_statuses',
+        )
+    
     def get_patient_details(self, obj):
         return {
             'name': obj.patient_name,
@@ -164,4 +359,4 @@ class LabTestSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = LabTest
-        fields = '__all__'
\ No newline at end of file
+        exclude = ['updated_at']
\ No newline at end of file
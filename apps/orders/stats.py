@@ -0,0 +1,79 @@
+"""
+Order statistics computed in a single query.
+
+`live_stats` counts a filtered LabOrder queryset by every breakdown at once. The
+queryset is compiled by the ORM into a base select of (id, department, unit,
+ipop, status, test_name), LEFT JOINed to the order's tests, and every breakdown
+counts DISTINCT order ids over that base. An order with three tests is
+therefore still one order, while the per-test breakdown counts the orders
+containing each test. PostgreSQL evaluates all breakdowns in one scan with
+GROUPING SETS; other backends get the same rows from a UNION ALL over a CTE.
+"""
+from django.db import connections
+from django.db.models import F
+
+# Statuses reported as <status>_orders
+REPORTED_STATUSES = ('pending', 'accepted', 'rejected', 'flagged')
+
+# Breakdown column in the base select -> (payload key, row key)
+BREAKDOWNS = {
+    'department': ('departments', 'department'),
+    'unit': ('units', 'unit'),
+    'ipop': ('patient_types', 'ipop'),
+    'test_name': ('tests_ordered', 'tests__name'),
+}
+GROUPED_COLUMNS = ('status',) + tuple(BREAKDOWNS)
+
+
+def stats_payload(total, counts):
+    """
+    Shape counts into the stats response.
+    `counts` maps 'status' and each BREAKDOWNS column to a list of (value, count) pairs.
+    """
+    by_status = dict(counts.get('status', []))
+    stats = {'total_orders': total}
+    for status in REPORTED_STATUSES:
+        stats[f'{status}_orders'] = by_status.get(status, 0)
+    for column, (key, row_key) in BREAKDOWNS.items():
+        rows = sorted(counts.get(column, []), key=lambda pair: -pair[1])
+        stats[key] = [{row_key: value, 'count': count} for value, count in rows if count]
+    return stats
+
+
+def live_stats(queryset):
+    """Stats payload for `queryset` (a filtered LabOrder queryset) from one query"""
+    base = queryset.order_by().values('id', 'department', 'unit', 'ipop', 'status', test_name=F('tests__name'))
+    connection = connections[queryset.db]
+    base_sql, params = base.query.get_compiler(connection=connection).as_sql()
+    qn = connection.ops.quote_name
+
+    if connection.vendor == 'postgresql':
+        dimension = ' '.join(
+            f"WHEN GROUPING({qn(column)}) = 0 THEN '{column}'" for column in GROUPED_COLUMNS
+        )
+        value = ' '.join(
+            f"WHEN GROUPING({qn(column)}) = 0 THEN {qn(column)}" for column in GROUPED_COLUMNS
+        )
+        sets = ', '.join(f'({qn(column)})' for column in GROUPED_COLUMNS)
+        sql = (
+            f"SELECT CASE {dimension} ELSE 'total' END, CASE {value} END, COUNT(DISTINCT {qn('id')}) "
+            f"FROM ({base_sql}) base GROUP BY GROUPING SETS ((), {sets})"
+        )
+    else:
+        branches = [f"SELECT 'total', NULL, COUNT(DISTINCT {qn('id')}) FROM base"]
+        branches += [
+            f"SELECT '{column}', {qn(column)}, COUNT(DISTINCT {qn('id')}) FROM base GROUP BY {qn(column)}"
+            for column in GROUPED_COLUMNS
+        ]
+        sql = f"WITH base AS ({base_sql}) " + ' UNION ALL '.join(branches)
+
+    total = 0
+    counts = {}
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        for dimension, value, count in cursor.fetchall():
+            if dimension == 'total':
+                total = count
+            else:
+                counts.setdefault(dimension, []).append((value, count))
+    return stats_payload(total, counts)
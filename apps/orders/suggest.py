@@ -0,0 +1,173 @@
+"""
+Test-name autocomplete for the order form.
+
+A SuggestIndex is built in memory from a catalog snapshot and the number of
+orders each test appears in. It holds:
+
+- a sorted list of (word, test id) over every word of every test name, so the
+  tests with a word starting with a typed term are found by bisection;
+- trigram posting lists (pg_trgm style, over padded words) for typos and
+  mid-word matches when the prefix matches run short.
+
+Results rank whole-name prefix matches first, then names where every typed term
+starts some word, then trigram matches by similarity. Ties go to the most
+ordered test. The index is rebuilt when the catalog version changes, and its
+order counts are refreshed when they are older than SUGGEST_POPULARITY_SECONDS.
+Counting costs one GROUP BY over the order/test link table, so the refresh runs
+in a background thread while requests keep using the current index; only the
+first build and catalog changes count synchronously. Every other lookup is pure
+Python.
+"""
+import logging
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count
+from .catalog import test_catalog
+from .models import LabOrder
+
+DEFAULT_POPULARITY_SECONDS = 600
+DEFAULT_SUGGESTIONS = 10
+MAX_SUGGESTIONS = 50
+# Least trigram similarity for a fuzzy match
+MIN_SIMILARITY = 0.3
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r'[a-z0-9]+')
+
+
+def words(text):
+    return WORD_RE.findall(text.lower())
+
+
+def trigrams(text):
+    grams = set()
+    for word in words(text):
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class SuggestIndex:
+    def __init__(self, snapshot, popularity):
+        self.snapshot = snapshot
+        self.popularity = popularity
+        self.built_at = time.monotonic()
+        self.refreshing = False
+        self.names = {}
+        self.privileges = {}
+        self.word_index = []
+        self.trigram_index = {}
+        self.trigram_counts = {}
+        for test_id, name, privilege, *_ in snapshot.rows:
+            self.names[test_id] = ' '.join(words(name))
+            self.privileges[test_id] = privilege
+            self.word_index.extend((word, test_id) for word in set(words(name)))
+            grams = trigrams(name)
+            self.trigram_counts[test_id] = len(grams)
+            for gram in grams:
+                self.trigram_index.setdefault(gram, []).append(test_id)
+        self.word_index.sort()
+
+    def _prefixed(self, term):
+        """Ids of tests with a word starting with `term`"""
+        found = set()
+        i = bisect_left(self.word_index, (term,))
+        while i < len(self.word_index) and self.word_index[i][0].startswith(term):
+            found.add(self.word_index[i][1])
+            i += 1
+        return found
+
+    def _similar(self, query):
+        """(similarity, id) for tests sharing enough trigrams with `query`"""
+        grams = trigrams(query)
+        if not grams:
+            return []
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.trigram_index.get(gram, ()))
+        scored = (
+            (count / (len(grams) + self.trigram_counts[test_id] - count), test_id)
+            for test_id, count in shared.items()
+        )
+        return [(similarity, test_id) for similarity, test_id in scored if similarity >= MIN_SIMILARITY]
+
+    def suggest(self, query, max_privilege, limit=DEFAULT_SUGGESTIONS):
+        """Ids of the best `limit` tests for `query` that a caller with `max_privilege` may order"""
+        terms = words(query)
+        if not terms:
+            return []
+        allowed = lambda test_id: self.privileges[test_id] <= max_privilege
+        rank = lambda test_id: (-self.popularity.get(test_id, 0), self.names[test_id])
+
+        matched = set.intersection(*(self._prefixed(term) for term in terms))
+        phrase = ' '.join(terms)
+        ranked = sorted(
+            (test_id for test_id in matched if allowed(test_id)),
+            key=lambda test_id: (not self.names[test_id].startswith(phrase),) + rank(test_id)
+        )
+        if len(ranked) < limit:
+            similar = [
+                (similarity, test_id) for similarity, test_id in self._similar(query)
+                if test_id not in matched and allowed(test_id)
+            ]
+            similar.sort(key=lambda pair: (-pair[0],) + rank(pair[1]))
+            ranked += [test_id for _, test_id in similar]
+        return ranked[:limit]
+
+
+def order_counts():
+    """Map test id -> number of orders that include it"""
+    OrderTests = LabOrder.tests.through
+    return dict(OrderTests.objects.values_list('labtest_id').annotate(n=Count('id')).order_by())
+
+
+_index = None
+_lock = threading.Lock()
+
+
+def refresh_popularity(snapshot):
+    """Replace the index with one built from fresh order counts, unless the catalog moved on meanwhile"""
+    global _index
+    index = SuggestIndex(snapshot, order_counts())
+    with _lock:
+        if _index is None or _index.snapshot is snapshot:
+            _index = index
+
+
+def _refresh_in_background(snapshot):
+    try:
+        refresh_popularity(snapshot)
+    except Exception:
+        logger.exception('Refreshing the test suggestion index failed')
+        with _lock:
+            if _index is not None:
+                # Let a later request try again
+                _index.refreshing = False
+    finally:
+        # This thread's own connection, not a request's
+        connection.close()
+
+
+def suggest_index():
+    global _index
+    snapshot = test_catalog.snapshot()
+    ttl = getattr(settings, 'SUGGEST_POPULARITY_SECONDS', DEFAULT_POPULARITY_SECONDS)
+    index = _index
+    if index is not None and index.snapshot is snapshot:
+        if time.monotonic() - index.built_at >= ttl:
+            with _lock:
+                start = not index.refreshing
+                index.refreshing = True
+            if start:
+                threading.Thread(target=_refresh_in_background, args=(snapshot,), daemon=True).start()
+        return index
+    with _lock:
+        if _index is None or _index.snapshot is not snapshot:
+            _index = SuggestIndex(snapshot, order_counts())
+        return _index
@@ -1,7 +1,30 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import runpy
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock, skipUnless
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from rest_framework.test import APIClient
 from rest_framework import status
-from .models import LabOrder, LabTest
+from .models import LabOrder, LabTest, LabComment, OrderChange, OrderDailyStat, OrderIdSequence, TestStatus
+from .export import iter_order_rows
+from . import live
+from .live import OrderEventHub, PostgresEventBackend, event_stream, hub
+from .catalog import expand_panels, test_catalog
+from .serializers import LabOrderSerializer, TestStatusSerializer
+from .stats import live_stats
+from .suggest import refresh_popularity
 
 class LabOrderTests(TestCase):
     def setUp(self):
@@ -45,30 +68,995 @@ class LabOrderTests(TestCase):
         lab_order.refresh_from_db()
         self.assertEqual(lab_order.status, 'completed')
 
+class BatchSubmissionTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(username='ward', password='secret', role='intern')
+        self.client.force_authenticate(self.user)
+        self.cbc = LabTest.objects.create(name='CBC')
+        self.lft = LabTest.objects.create(name='LFT')
+
+    def order_payload(self, **overrides):
+        payload = {
+            'patient': {
+                'name': 'John Doe',
+                'ip_number': '123456',
+                'age': 45,
+                'department': 'Medicine',
+                'unit': 'GWH-MED-A'
+            },
+            'tests': [self.cbc.id, self.lft.id],
+        }
+        payload.update(overrides)
+        return payload
+
+    def test_submit_batch(self):
+        orders = [self.order_payload() for _ in range(20)]
+        orders[3] = self.order_payload(status='accepted', new_comment='Urgent')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/orders/submit-batch/', {'orders': orders}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 20)
+        self.assertEqual(LabOrder.objects.count(), 20)
+        self.assertEqual(LabOrder.tests.through.objects.count(), 40)
+        self.assertEqual(TestStatus.objects.filter(status='accepted').count(), 2)
+        self.assertEqual(LabComment.objects.get().username, 'ward')
+        order_ids = [result['order_id'] for result in response.data['results']]
+        self.assertEqual(len(set(order_ids)), 20)
+        # One insert per table (orders, tests, statuses, comments, two rollup tables,
+        # the change log, plus the new year's counter row), however many orders
+        inserts = [q for q in queries.captured_queries if q['sql'].startswith('INSERT')]
+        self.assertLessEqual(len(inserts), 8)
+
+    def test_submit_batch_reports_each_item(self):
+        orders = [self.order_payload(), self.order_payload(tests=[]), self.order_payload()]
+        response = self.client.post('/api/orders/submit-batch/', {'orders': orders}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual([r['status'] for r in response.data['results']], ['created', 'error', 'created'])
+        self.assertEqual(LabOrder.objects.count(), 2)
+
+    def test_submit_batch_rejects_empty(self):
+        response = self.client.post('/api/orders/submit-batch/', {'orders': []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class OrderSearchTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user(username='tech', password='secret', role='labtech'))
+        cbc = LabTest.objects.create(name='CBC')
+        cbc_esr = LabTest.objects.create(name='CBC with ESR')
+        self.ravi = LabOrder.objects.create(patient_name='Ravi Kumar', ip_number='IP1001', username='dr_rao')
+        self.ravi.tests.set([cbc, cbc_esr])
+        self.anita = LabOrder.objects.create(patient_name='Anita Shenoy', ip_number='IP2002', username='dr_pai')
+
+    def search(self, **params):
+        response = self.client.get('/api/orders/orders/search/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [order['order_id'] for order in response.data['results']]
+
+    def test_free_text_search(self):
+        self.assertEqual(self.search(q='kumar'), [self.ravi.order_id])
+        self.assertEqual(self.search(q='2002'), [self.anita.order_id])
+        self.assertEqual(self.search(q='dr_'), [self.anita.order_id, self.ravi.order_id])
+
+    def test_test_name_search_does_not_duplicate_orders(self):
+        self.assertEqual(self.search(test_name='cbc'), [self.ravi.order_id])
+
+
+class CursorPaginationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user(username='tech', password='secret', role='labtech'))
+        for i in range(25):
+            LabOrder.objects.create(patient_name=f'Patient {i % 7}', ip_number=f'IP{i}')
+
+    def walk(self, url, params):
+        order_ids = []
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            order_ids += [order['order_id'] for order in response.data['results']]
+            if not response.data['next']:
+                return order_ids, response
+            response = self.client.get(response.data['next'])
+
+    def test_list_pages_through_every_order_once(self):
+        order_ids, _ = self.walk('/api/orders/orders/', {'pagination': 'cursor', 'page_size': 10})
+        expected = list(LabOrder.objects.order_by('-created_at', '-id').values_list('order_id', flat=True))
+        self.assertEqual(order_ids, expected)
+
+    def test_search_orders_by_indexed_column_with_ties(self):
+        order_ids, last_page = self.walk('/api/orders/orders/search/', {'pagination': 'cursor', 'order_by': 'patient_name', 'page_size': 4})
+        expected = list(LabOrder.objects.order_by('patient_name', 'id').values_list('order_id', flat=True))
+        self.assertEqual(order_ids, expected)
+
+        previous = self.client.get(last_page.data['previous'])
+        self.assertEqual([order['order_id'] for order in previous.data['results']], expected[-5:-1])
+
+    def test_new_orders_do_not_shift_pages(self):
+        first = self.client.get('/api/orders/orders/', {'pagination': 'cursor', 'page_size': 10})
+        LabOrder.objects.create(patient_name='Late arrival', ip_number='IP99')
+        second = self.client.get(first.data['next'])
+        expected = list(LabOrder.objects.order_by('-created_at', '-id').values_list('order_id', flat=True))[11:21]
+        self.assertEqual([order['order_id'] for order in second.data['results']], expected)
+
+    def test_unindexed_sort_is_rejected(self):
+        response = self.client.get('/api/orders/orders/search/', {'pagination': 'cursor', 'order_by': 'clinical_history'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class OrderRollupTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user(username='tech', password='secret', role='labtech'))
+        self.cbc = LabTest.objects.create(name='CBC')
+        self.lft = LabTest.objects.create(name='LFT')
+
+    def submit(self, department, tests, **extra):
+        payload = {
+            'patient': {'name': 'John Doe', 'ip_number': '1', 'age': 45, 'department': department, 'unit': 'U1'},
+            'tests': tests,
+        }
+        payload.update(extra)
+        return payload
+
+    def stats(self, **params):
+        response = self.client.get('/api/orders/orders/stats/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = dict(response.data)
+        for key in ('departments', 'units', 'tests_ordered', 'patient_types'):
+            data[key] = sorted(data[key], key=lambda row: sorted(row.items()))
+        return data
+
+    def assertRollupMatchesOrders(self):
+        # A datetime bound forces the live query over LabOrder
+        self.assertEqual(self.stats(), self.stats(date_from='2000-01-01T00:00:00'))
+
+    def test_rollup_follows_order_changes(self):
+        self.client.post('/api/orders/submit-order/', self.submit('MED', [self.cbc.id, self.lft.id]), format='json')
+        self.client.post('/api/orders/submit-batch/', {'orders': [
+            self.submit('MED', [self.cbc.id]),
+            self.submit('SURG', [self.lft.id], status='accepted'),
+        ]}, format='json')
+        first, second, third = LabOrder.objects.order_by('id')
+        self.assertRollupMatchesOrders()
+
+        self.client.patch(f'/api/orders/orders/{first.order_id}/update-status/', {'status': 'rejected'}, format='json')
+        self.client.post(f'/api/orders/orders/{second.order_id}/update_test_status/',
+                         {'status': 'flagged', 'all_tests_status': True}, format='json')
+        self.client.patch(f'/api/orders/orders/{third.order_id}/', {'tests': [self.cbc.id, self.lft.id]}, format='json')
+        self.assertRollupMatchesOrders()
+
+        self.client.delete(f'/api/orders/orders/{first.order_id}/')
+        stats = self.stats()
+        self.assertEqual(stats['total_orders'], 2)
+        self.assertEqual(stats['rejected_orders'], 0)
+        self.assertRollupMatchesOrders()
+
+    def test_rollup_follows_writes_outside_the_api(self):
+        # As the admin or the shell would make them: plain saves, m2m edits and deletes
+        first = LabOrder.objects.create(patient_name='A', ip_number='1', department='MED', unit='U1')
+        first.tests.set([self.cbc, self.lft])
+        second = LabOrder.objects.create(patient_name='B', ip_number='2', department='SURG', unit='U2', status='accepted')
+        second.tests.add(self.cbc)
+        self.assertRollupMatchesOrders()
+
+        first.status = 'rejected'
+        first.department = 'SURG'
+        first.save()
+        first.tests.remove(self.cbc)
+        self.lft.orders.add(second)
+        self.assertRollupMatchesOrders()
+        self.assertEqual(self.stats()['rejected_orders'], 1)
+
+        second.tests.clear()
+        second.tests.add(self.lft)
+        LabOrder.objects.filter(pk=first.pk).delete()
+        self.assertRollupMatchesOrders()
+        self.assertEqual(self.stats()['total_orders'], 1)
+
+        second.tests.set([self.cbc, self.lft])
+        self.cbc.delete()
+        self.assertRollupMatchesOrders()
+
+    def test_day_range(self):
+        self.client.post('/api/orders/submit-order/', self.submit('MED', [self.cbc.id]), format='json')
+        today = timezone.localdate()
+        self.assertEqual(self.stats(date_from=today.isoformat(), date_to=today.isoformat())['total_orders'], 1)
+        self.assertEqual(self.stats(date_to=(today - timedelta(days=1)).isoformat())['total_orders'], 0)
+
+    def test_live_stats_single_query_counts_orders_once(self):
+        self.client.post('/api/orders/submit-batch/', {'orders': [
+            self.submit('MED', [self.cbc.id, self.lft.id]),
+            self.submit('MED', [self.cbc.id], status='accepted'),
+        ]}, format='json')
+        with self.assertNumQueries(1):
+            stats = live_stats(LabOrder.objects.all())
+        self.assertEqual(stats['total_orders'], 2)
+        self.assertEqual(stats['accepted_orders'], 1)
+        self.assertEqual(stats['departments'], [{'department': 'MED', 'count': 2}])
+        self.assertEqual(stats['tests_ordered'], [{'tests__name': 'CBC', 'count': 2}, {'tests__name': 'LFT', 'count': 1}])
+
+    def test_rebuild_command(self):
+        self.client.post('/api/orders/submit-batch/', {'orders': [
+            self.submit('MED', [self.cbc.id, self.lft.id]),
+            self.submit('SURG', [self.lft.id], status='accepted'),
+        ]}, format='json')
+        before = self.stats()
+        OrderDailyStat.objects.update(total=0)
+        call_command('rebuild_order_rollup', stdout=StringIO())
+        self.assertEqual(self.stats(), before)
+
+
+class OrderReadQueryCountTests(TestCase):
+    """Reading orders must cost a fixed number of queries, independent of page size"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user(username='tech', password='secret', role='labtech'))
+        tests = [LabTest.objects.create(name=f'Test {i}') for i in range(3)]
+        for i in range(30):
+            order = LabOrder.objects.create(patient_name=f'Patient {i}', ip_number=f'IP{i}', status='accepted')
+            order.tests.set(tests)
+            TestStatus.objects.bulk_create([TestStatus(order=order, test=test, status='accepted') for test in tests])
+            LabComment.objects.create(order=order, comment='Sample haemolysed', username='tech', role='labtech')
+        # Test names come from the catalog, which a running server has already loaded
+        test_catalog.snapshot()
+
+    def test_list_and_search(self):
+        for page_size in (1, 10, 30):
+            # ETag version, COUNT, page, then one query each for tests, comments and test statuses
+            with self.assertNumQueries(6):
+                response = self.client.get('/api/orders/orders/', {'page_size': page_size})
+            self.assertEqual(len(response.data['results']), page_size)
+            with self.assertNumQueries(6):
+                self.client.get('/api/orders/orders/search/', {'page_size': page_size, 'test_name': 'Test'})
+            with self.assertNumQueries(5):
+                self.client.get('/api/orders/orders/', {'page_size': page_size, 'pagination': 'cursor'})
+
+    def test_retrieve(self):
+        order = LabOrder.objects.first()
+        with self.assertNumQueries(5):
+            response = self.client.get(f'/api/orders/orders/{order.order_id}/')
+        self.assertEqual(response.data['test_statuses'][0]['test_name'], 'Test 0')
+        self.assertEqual(len(response.data['comments']), 1)
+
+
+class BulkPrimaryKeyValidationTests(TestCase):
+    def setUp(self):
+        self.tests = [LabTest.objects.create(name=f'Test {i}') for i in range(30)]
+        self.payload = {
+            'patient': {'name': 'John Doe', 'ip_number': '1', 'age': 45, 'department': 'MED', 'unit': 'U1'},
+            'tests': [test.id for test in self.tests],
+            'username': 'ward',
+            'role': 'intern',
+        }
+        test_catalog.snapshot()
+
+    def test_order_tests_resolved_from_catalog(self):
+        serializer = LabOrderSerializer(data=self.payload)
+        with self.assertNumQueries(0):
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+        self.assertEqual(serializer.validated_data['tests'], self.tests)
+
+    def test_every_missing_id_is_reported(self):
+        self.payload['tests'] += [9998, 9999]
+        serializer = LabOrderSerializer(data=self.payload)
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('9998', str(serializer.errors['tests']))
+        self.assertIn('9999', str(serializer.errors['tests']))
+
+    def test_test_status_list_resolved_in_one_query(self):
+        data = [{'test_id': test.id, 'status': 'accepted'} for test in self.tests] + [{'test_id': 9999, 'status': 'accepted'}]
+        serializer = TestStatusSerializer(data=data, many=True)
+        # The unknown id makes the catalog recheck its version once
+        with self.assertNumQueries(1):
+            self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors[:30], [{}] * 30)
+        self.assertIn('test_id', serializer.errors[30])
+
+
+class TestCatalogTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user(username='tech', password='secret', role='labtech'))
+        self.cbc = LabTest.objects.create(name='CBC', privilege=1, section='Haematology')
+        self.lft = LabTest.objects.create(name='LFT', privilege=3, comp=self.cbc)
+
+    def test_list_served_from_catalog(self):
+        self.client.get('/api/orders/tests/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/orders/tests/', {'privilege': 3})
+        self.assertEqual(response.data, [
+            {'id': self.lft.id, 'name': 'LFT', 'privilege': 3, 'vac_col': '', 'section': '', 'comp': self.cbc.id},
+        ])
+
+    def test_save_and_delete_invalidate(self):
+        self.assertEqual(test_catalog.snapshot().name(self.cbc.id), 'CBC')
+        self.cbc.name = 'Complete Blood Count'
+        self.cbc.save()
+        self.assertEqual(test_catalog.snapshot().name(self.cbc.id), 'Complete Blood Count')
+        self.lft.delete()
+        self.assertNotIn(self.lft.id, test_catalog.snapshot())
+
+    def test_changes_from_other_processes_seen_after_recheck(self):
+        version = test_catalog.snapshot().version
+        # update() sends no signals, like a write made by another worker
+        LabTest.objects.filter(pk=self.cbc.pk).update(name='Full Blood Count', updated_at=timezone.now() + timedelta(seconds=1))
+        with self.assertNumQueries(0):
+            self.assertEqual(test_catalog.snapshot().version, version)
+        with mock.patch('apps.orders.catalog.time.monotonic', return_value=time.monotonic() + 60):
+            self.assertEqual(test_catalog.snapshot().name(self.cbc.id), 'Full Blood Count')
+
+
+class PanelExpansionTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user(username='tech', password='secret', role='labtech'))
+        self.profile = LabTest.objects.create(name='Health check')
+        self.lft = LabTest.objects.create(name='LFT', comp=self.profile)
+        self.sgot = LabTest.objects.create(name='SGOT', comp=self.lft)
+        self.sgpt = LabTest.objects.create(name='SGPT', comp=self.lft)
+        self.cbc = LabTest.objects.create(name='CBC', comp=self.profile)
+
+    def test_panels_endpoint_expands_nested_panels(self):
+        response = self.client.get('/api/orders/tests/panels/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        panels = {panel['name']: [test['name'] for test in panel['components']] for panel in response.data}
+        self.assertEqual(panels, {'Health check': ['SGOT', 'SGPT', 'CBC'], 'LFT': ['SGOT', 'SGPT']})
+
+        response = self.client.get('/api/orders/tests/panels/', {'ids': self.lft.id})
+        self.assertEqual([panel['id'] for panel in response.data], [self.lft.id])
+        self.assertEqual(self.client.get('/api/orders/tests/panels/', {'ids': 'x'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_submitted_panels_become_their_components(self):
+        test_catalog.snapshot()
+        payload = {
+            'patient': {'name': 'John Doe', 'ip_number': '1', 'age': 45, 'department': 'MED', 'unit': 'U1'},
+            'tests': [self.sgpt.id, self.profile.id],
+            'username': 'ward',
+            'role': 'intern',
+        }
+        serializer = LabOrderSerializer(data=payload)
+        with self.assertNumQueries(0):
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+        self.assertEqual(serializer.validated_data['tests'], [self.sgpt, self.sgot, self.cbc])
+
+    def test_cycles_are_cut(self):
+        rows = [(1, 'A', 1, '', 2, ''), (2, 'B', 1, '', 1, ''), (3, 'C', 1, '', 2, '')]
+        self.assertEqual(expand_panels(rows), {1: (3,), 2: (3,)})
+
+
+class TestSuggestTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(username='doc', password='secret', role='postgraduate')
+        self.client.force_authenticate(self.user)
+        self.glucose = LabTest.objects.create(name='Glucose (Fasting)')
+        self.glucose_pp = LabTest.objects.create(name='Glucose Post Prandial')
+        self.hba1c = LabTest.objects.create(name='HbA1c', privilege=2)
+        self.gtt = LabTest.objects.create(name='Oral Glucose Tolerance Test', privilege=3)
+        order = LabOrder.objects.create(patient_name='Patient', ip_number='IP1')
+        order.tests.set([self.glucose_pp])
+
+    def suggest(self, q, **params):
+        response = self.client.get('/api/orders/tests/suggest/', {'q': q, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [test['name'] for test in response.data]
+
+    def test_ranks_prefix_then_popularity(self):
+        # Both start with the term, the more ordered one first; the staff-only test is hidden
+        self.assertEqual(self.suggest('glu'), ['Glucose Post Prandial', 'Glucose (Fasting)'])
+        self.assertEqual(self.suggest('glucose fast')[0], 'Glucose (Fasting)')
+        self.assertEqual(self.suggest('hba'), ['HbA1c'])
+        self.assertEqual(self.suggest('glu', limit=1), ['Glucose Post Prandial'])
+
+    def test_privilege_and_typos(self):
+        self.user.role = 'staff'
+        self.user.save()
+        self.assertEqual(self.suggest('tolerance'), ['Oral Glucose Tolerance Test'])
+        self.assertEqual(self.suggest('glucos tolerence')[0], 'Oral Glucose Tolerance Test')
+        self.assertEqual(self.suggest(''), [])
+
+    def test_lookups_run_no_queries(self):
+        self.suggest('glu')
+        with self.assertNumQueries(0):
+            self.suggest('hba')
+
+    def test_stale_counts_refresh_in_the_background(self):
+        self.assertEqual(self.suggest('glu'), ['Glucose Post Prandial', 'Glucose (Fasting)'])
+        for i in range(2):
+            LabOrder.objects.create(patient_name='Patient', ip_number=f'IP{i + 2}').tests.set([self.glucose])
+        with override_settings(SUGGEST_POPULARITY_SECONDS=0), mock.patch('apps.orders.suggest.threading.Thread') as thread:
+            # Expired counts start one refresh and keep serving the current index meanwhile
+            with self.assertNumQueries(0):
+                self.assertEqual(self.suggest('glu'), ['Glucose Post Prandial', 'Glucose (Fasting)'])
+                self.suggest('glu')
+            thread.assert_called_once()
+            # Run the refresh here rather than in a thread, which couldn't see this test's rows
+            refresh_popularity(*thread.call_args.kwargs['args'])
+        self.assertEqual(self.suggest('glu'), ['Glucose (Fasting)', 'Glucose Post Prandial'])
+
+
+class ImportLabTestsTests(TestCase):
+    header = 'id,name,privilege,vac_col,comp,section\n'
+
+    def write_csv(self, lines):
+        path = Path(self.tmpdir.name) / 'tests.csv'
+        path.write_text(self.header + ''.join(line + '\n' for line in lines))
+        return str(path)
+
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        LabTest.objects.create(id=1, name='Liver function', privilege=1)
+
+    def run_import(self, lines, *args):
+        out = StringIO()
+        call_command('import_labtests', self.write_csv(lines), *args, stdout=out)
+        return out.getvalue()
+
+    def test_creates_and_updates_in_one_pass(self):
+        # A component listed before its panel still resolves
+        lines = ['2,SGOT,1,Red,1,Biochemistry', '1,LFT,2,Red,,Biochemistry', '3,SGPT,1,Red,1,Biochemistry']
+        # Read the existing rows, then one upsert inside its savepoint
+        with self.assertNumQueries(4):
+            output = self.run_import(lines)
+        self.assertIn('2 new, 1 updated, 0 unchanged', output)
+        self.assertEqual(LabTest.objects.get(id=1).name, 'LFT')
+        self.assertEqual(set(LabTest.objects.get(id=1).related_tests.values_list('id', flat=True)), {2, 3})
+        self.assertIn('0 new, 0 updated, 3 unchanged', self.run_import(lines))
+        # The id sequence was moved past the imported ids
+        self.assertGreater(LabTest.objects.create(name='ESR').id, 3)
+
+    def test_dry_run_reports_without_writing(self):
+        output = self.run_import(['1,LFT,1,,,', '2,SGOT,1,,1,'], '--dry-run')
+        self.assertIn("~ 1 LFT: name: 'Liver function' -> 'LFT'", output)
+        self.assertIn('+ 2 SGOT', output)
+        self.assertEqual(list(LabTest.objects.values_list('name', flat=True)), ['Liver function'])
+
+    def test_blank_comp_keeps_existing_component(self):
+        LabTest.objects.create(id=2, name='SGOT', comp_id=1)
+        self.assertIn('1 new, 1 updated, 0 unchanged', self.run_import(['2,AST,1,,,', '3,SGPT,1,,,']))
+        self.assertEqual(LabTest.objects.get(id=2).comp_id, 1)
+        self.assertIsNone(LabTest.objects.get(id=3).comp_id)
+
+    def test_bad_references_abort_everything(self):
+        with self.assertRaisesMessage(CommandError, '2 -> 99, 3 -> 98'):
+            self.run_import(['2,SGOT,1,,99,', '3,SGPT,1,,98,', '4,ALP,1,,,'])
+        with self.assertRaisesMessage(CommandError, 'cycle'):
+            self.run_import(['2,A,1,,3,', '3,B,1,,2,'])
+        self.assertEqual(LabTest.objects.count(), 1)
+
+
+class OrderExportTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user(username='tech', password='secret', role='labtech'))
+        cbc = LabTest.objects.create(name='CBC')
+        lft = LabTest.objects.create(name='LFT')
+        for i in range(5):
+            order = LabOrder.objects.create(patient_name=f'Patient {i}', ip_number=f'IP{i}', department='MED' if i % 2 else 'SURG')
+            order.tests.set([cbc, lft] if i % 2 else [cbc])
+
+    def test_ndjson_export_streams_filtered_orders(self):
+        response = self.client.get('/api/orders/orders/export/', {'department': 'MED'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['patient_name'] for row in rows], ['Patient 1', 'Patient 3'])
+        self.assertEqual(rows[0]['tests'], ['CBC', 'LFT'])
+
+    def test_gzipped_csv_export(self):
+        response = self.client.get('/api/orders/orders/export/', {'output': 'csv', 'gzip': 'true'})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        self.assertEqual(len(lines), 6)
+        self.assertTrue(lines[0].startswith('order_id,patient_name'))
+
+    def test_export_reads_in_chunks(self):
+        # One cursor over the orders, plus one test-name query for each of the two chunks
+        with self.assertNumQueries(3):
+            rows = list(iter_order_rows(LabOrder.objects.all(), chunk_size=3))
+        self.assertEqual(len(rows), 5)
+
+    def test_export_command(self):
+        out = StringIO()
+        call_command('export_orders', '--department', 'SURG', '--output-format', 'csv', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 4)
+
+
+class TestStatusUpsertTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user(username='tech', password='secret', role='labtech'))
+        self.panel = [LabTest.objects.create(name=f'Test {i}') for i in range(40)]
+        self.order = LabOrder.objects.create(patient_name='John Doe', ip_number='IP1')
+        self.order.tests.set(self.panel)
+
+    def status_writes(self, queries):
+        return [q for q in queries.captured_queries if 'orders_teststatus' in q['sql'] and not q['sql'].startswith('SELECT')]
+
+    def test_accepting_a_panel_is_one_statement(self):
+        url = f'/api/orders/orders/{self.order.order_id}/update_test_status/'
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, {'status': 'accepted', 'all_tests_status': True}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(self.status_writes(queries)), 1)
+        self.assertEqual(TestStatus.objects.filter(order=self.order, status='accepted').count(), 40)
+
+        # Updating part of the panel overwrites existing rows and returns only those
+        response = self.client.post(url, {'status': 'rejected', 'test_ids': [self.panel[0].id, self.panel[1].id]}, format='json')
+        self.assertEqual([row['test_name'] for row in response.data['test_statuses']], ['Test 0', 'Test 1'])
+        self.assertEqual(TestStatus.objects.filter(order=self.order).count(), 40)
+        self.assertEqual(TestStatus.objects.filter(order=self.order, status='rejected').count(), 2)
+
+        # Tests already in the requested status are neither rewritten nor returned
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, {'status': 'rejected', 'test_ids': [self.panel[1].id, self.panel[2].id]}, format='json')
+        self.assertEqual([row['test_name'] for row in response.data['test_statuses']], ['Test 2'])
+        self.assertEqual(len(self.status_writes(queries)), 1)
+        response = self.client.post(url, {'status': 'rejected', 'test_ids': [self.panel[1].id]}, format='json')
+        self.assertEqual(response.data['test_statuses'], [])
+
+    def test_update_order_status_upserts_all_tests(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(f'/api/orders/orders/{self.order.order_id}/update-status/', {'status': 'accepted'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(self.status_writes(queries)), 1)
+        self.assertEqual(TestStatus.objects.filter(order=self.order, status='accepted').count(), 40)
+
+
+class BulkStatusTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user(username='tech', password='secret', role='labtech'))
+        self.cbc = LabTest.objects.create(name='CBC')
+        self.lft = LabTest.objects.create(name='LFT')
+        self.orders = []
+        for i in range(100):
+            order = LabOrder.objects.create(patient_name=f'Patient {i}', ip_number=f'IP{i}')
+            order.tests.set([self.cbc, self.lft])
+            self.orders.append(order)
+
+    def test_accept_batch_in_fixed_number_of_queries(self):
+        order_ids = [order.order_id for order in self.orders]
+        # Orders, their tests, one UPDATE, the current test statuses, the status upsert, two
+        # rollup upserts and the change log insert, inside a savepoint; the same for 100 orders as for one
+        with self.assertNumQueries(10):
+            response = self.client.post('/api/orders/bulk-status/', {'status': 'accepted', 'order_ids': order_ids}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['updated'], 100)
+        self.assertEqual(LabOrder.objects.filter(status='accepted').count(), 100)
+        self.assertEqual(TestStatus.objects.filter(status='accepted').count(), 200)
+        self.assertEqual(OrderDailyStat.objects.get(status='accepted').total, 100)
+
+    def test_per_order_tests_and_errors(self):
+        first, second = self.orders[:2]
+        other = LabTest.objects.create(name='Other')
+        response = self.client.post('/api/orders/bulk-status/', {'status': 'rejected', 'orders': [
+            {'order_id': first.order_id, 'test_ids': [self.cbc.id]},
+            {'order_id': second.order_id, 'test_ids': [other.id]},
+            {'order_id': 'OR00-999999'},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual([r['status'] for r in response.data['results']], ['updated', 'error', 'error'])
+        first.refresh_from_db()
+        self.assertEqual((first.status, first.all_tests_status), ('rejected', False))
+        self.assertEqual(list(TestStatus.objects.values_list('order_id', 'test_id')), [(first.pk, self.cbc.pk)])
+        self.assertEqual(LabOrder.objects.get(pk=second.pk).status, 'pending')
+
+    def test_malformed_bodies_are_rejected(self):
+        order_id = self.orders[0].order_id
+        for body in (
+            [{'status': 'accepted', 'order_ids': [order_id]}],
+            {'status': 'accepted', 'order_ids': order_id},
+            {'status': 'accepted', 'order_ids': [[order_id]]},
+            {'status': 'accepted', 'order_ids': [1]},
+            {'status': 'accepted', 'orders': {'order_id': order_id}},
+            {'status': 'accepted', 'orders': [{'order_id': [order_id]}]},
+            {'status': 'accepted', 'orders': [{'order_id': {'id': order_id}}]},
+            {'status': 'accepted', 'orders': [{'order_id': order_id, 'test_ids': str(self.cbc.id)}]},
+        ):
+            with self.subTest(body=body):
+                response = self.client.post('/api/orders/bulk-status/', body, format='json')
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post('/api/orders/bulk-status/', {'status': 'accepted', 'orders': [{'order_id': [order_id]}]}, format='json')
+        self.assertEqual(response.data['error'], 'Each entry in orders needs an order_id')
+        self.assertFalse(LabOrder.objects.filter(status='accepted').exists())
+
+
+@override_settings(ORDER_CHANGE_FEED_SETTLE_SECONDS=0)
+class ChangeFeedTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user(username='tech', password='secret', role='labtech'))
+        self.cbc = LabTest.objects.create(name='CBC')
+
+    def submit(self):
+        payload = {
+            'patient': {'name': 'John Doe', 'ip_number': '1', 'age': 45, 'department': 'MED', 'unit': 'U1'},
+            'tests': [self.cbc.id],
+        }
+        return self.client.post('/api/orders/submit-order/', payload, format='json').data['order_id']
+
+    def changes(self, **params):
+        response = self.client.get('/api/orders/changes/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_feed_lists_each_changed_order_once(self):
+        old = self.submit()
+        cursor = self.changes()['cursor']
+        first = self.submit()
+        second = self.submit()
+        self.client.patch(f'/api/orders/orders/{first}/update-status/', {'status': 'accepted'}, format='json')
+        self.client.post('/api/orders/comments/', {'order_id': second, 'comment': 'Recollect', 'username': 'tech', 'role': 'labtech'}, format='json')
+
+        feed = self.changes(since=cursor, include='orders')
+        self.assertEqual(feed['changes'], [
+            {'order_id': first, 'kinds': ['created', 'status']},
+            {'order_id': second, 'kinds': ['created', 'comment']},
+        ])
+        self.assertEqual({order['order_id'] for order in feed['orders']}, {first, second})
+        self.assertNotIn(old, [change['order_id'] for change in feed['changes']])
+
+        # Nothing new since the returned cursor
+        self.assertEqual(self.changes(since=feed['cursor'])['changes'], [])
+
+    def test_feed_pages_with_limit(self):
+        cursor = self.changes()['cursor']
+        created = [self.submit() for _ in range(3)]
+        feed = self.changes(since=cursor, limit=2)
+        self.assertTrue(feed['has_more'])
+        rest = self.changes(since=feed['cursor'], limit=2)
+        self.assertEqual([c['order_id'] for c in feed['changes'] + rest['changes']], created)
+
+    @override_settings(ORDER_CHANGE_FEED_SETTLE_SECONDS=60)
+    def test_recent_changes_wait_to_settle(self):
+        cursor = self.changes()['cursor']
+        self.submit()
+        self.assertEqual(self.changes(since=cursor)['changes'], [])
+
+
+class LiveOrderEventTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user(username='tech', password='secret', role='labtech'))
+        self.cbc = LabTest.objects.create(name='CBC', section='Haematology')
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def subscribe(self, **filters):
+        async def subscribe():
+            return hub.subscribe(**filters)
+        subscription = self.loop.run_until_complete(subscribe())
+        self.addCleanup(subscription.close)
+        return subscription
+
+    def received(self, subscription):
+        # Run the loop once so events handed over from this thread are queued
+        self.loop.run_until_complete(asyncio.sleep(0))
+        events = []
+        while not subscription.queue.empty():
+            events.append(subscription.queue.get_nowait())
+        return events
+
+    def submit(self, department):
+        payload = {
+            'patient': {'name': 'John Doe', 'ip_number': '1', 'age': 45, 'department': department, 'unit': 'U1'},
+            'tests': [self.cbc.id],
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/orders/submit-order/', payload, format='json').data['order_id']
+
+    def test_events_reach_matching_subscribers_after_commit(self):
+        ward = self.subscribe(departments=['MED'])
+        haematology = self.subscribe(sections=['Haematology'])
+        surgery = self.subscribe(departments=['SUR'])
+
+        order_id = self.submit('MED')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/orders/orders/{order_id}/update-status/', {'status': 'accepted'}, format='json')
+
+        events = self.received(ward)
+        self.assertEqual([event['event'] for event in events], ['order.created', 'order.status'])
+        self.assertEqual(events[1]['data']['status'], 'accepted')
+        self.assertEqual(events[0]['data']['sections'], ['Haematology'])
+        self.assertEqual(len(self.received(haematology)), 2)
+        self.assertEqual(self.received(surgery), [])
+
+    def test_no_work_without_subscribers(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.post('/api/orders/submit-order/', {
+                'patient': {'name': 'John Doe', 'ip_number': '1', 'age': 45, 'department': 'MED', 'unit': 'U1'},
+                'tests': [self.cbc.id],
+            }, format='json')
+        self.assertEqual(callbacks, [])
+
+    def test_stream_formats_events_as_sse(self):
+        subscription = self.subscribe()
+        order_id = self.submit('MED')
+        stream = event_stream(subscription, heartbeat=0.01)
+        chunks = [self.loop.run_until_complete(stream.__anext__()) for _ in range(3)]
+        self.loop.run_until_complete(stream.aclose())
+
+        self.assertEqual(chunks[0], 'retry: 3000\n\n')
+        lines = chunks[1].splitlines()
+        self.assertTrue(lines[0].startswith('id: '))
+        self.assertEqual(lines[1], 'event: order.created')
+        self.assertEqual(json.loads(lines[2][len('data: '):])['order_id'], order_id)
+        self.assertEqual(chunks[2], ': ping\n\n')
+        self.assertEqual(hub.subscriber_count, 0)
+
+    def test_stream_needs_asgi(self):
+        response = self.client.get('/api/orders/events/')
+        self.assertEqual(response.status_code, status.HTTP_501_NOT_IMPLEMENTED)
+
+    def test_stream_needs_credentials(self):
+        response = self.loop.run_until_complete(AsyncClient().get('/api/orders/events/'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_backend_shares_events_between_processes_on_postgres(self):
+        # Writes come in through WSGI and streams are served by a separate ASGI process
+        for vendor, backend in (('postgresql', live.PostgresEventBackend), ('sqlite', live.LocalEventBackend)):
+            with self.subTest(vendor=vendor), mock.patch.object(live, '_backend', None), \
+                    mock.patch.object(live, 'connection', mock.Mock(vendor=vendor)):
+                self.assertIsInstance(live.get_backend(), backend)
+        self.assertEqual(runpy.run_module('lab_requisition.settings_prod')['ORDER_EVENT_BACKEND'],
+                         'apps.orders.live.PostgresEventBackend')
+
+    def test_listener_closes_lost_connections_and_backs_off(self):
+        backend = PostgresEventBackend(OrderEventHub())
+        lost = [mock.Mock(), mock.Mock()]
+        for conn in lost:
+            conn.cursor.side_effect = OSError('connection lost')
+        database = mock.Mock(get_new_connection=mock.Mock(side_effect=lost))
+        waits = []
+
+        def wait(delay):
+            waits.append(delay)
+            return len(waits) == len(lost)
+
+        with mock.patch.object(live, 'connections', {'default': database}), \
+                mock.patch.object(backend._stopping, 'wait', side_effect=wait), \
+                self.assertLogs('apps.orders.live', 'WARNING'):
+            backend._listen()
+        for conn in lost:
+            conn.close.assert_called_once_with()
+        self.assertEqual(waits, [live.RECONNECT_DELAY, live.RECONNECT_DELAY * 2])
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user(username='tech', password='secret', role='labtech'))
+        self.cbc = LabTest.objects.create(name='CBC')
+        self.order_id = self.submit()
+
+    def submit(self):
+        payload = {
+            'patient': {'name': 'John Doe', 'ip_number': '1', 'age': 45, 'department': 'MED', 'unit': 'U1'},
+            'tests': [self.cbc.id],
+        }
+        return self.client.post('/api/orders/submit-order/', payload, format='json').data['order_id']
+
+    def assertNotModified(self, url, etag, queries=1):
+        with self.assertNumQueries(queries):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+    def assertModified(self, url, etag):
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        return response['ETag']
+
+    def test_order_detail(self):
+        url = f'/api/orders/orders/{self.order_id}/'
+        response = self.client.get(url)
+        self.assertIn('Last-Modified', response)
+        self.assertNotModified(url, response['ETag'])
+
+        # Another order doesn't touch this one's version, a status change does
+        self.submit()
+        self.assertNotModified(url, response['ETag'])
+        self.client.patch(f'/api/orders/orders/{self.order_id}/update-status/', {'status': 'accepted'}, format='json')
+        self.assertModified(url, response['ETag'])
+
+    def test_order_list_and_search(self):
+        for url in ('/api/orders/orders/?page=1', '/api/orders/orders/search/?q=john'):
+            etag = self.client.get(url)['ETag']
+            self.assertNotModified(url, etag)
+            self.client.post('/api/orders/comments/', {'order_id': self.order_id, 'comment': 'Haemolysed', 'username': 'tech', 'role': 'labtech'}, format='json')
+            self.assertModified(url, etag)
+
+        # Each filter gets its own tag
+        self.assertNotEqual(self.client.get('/api/orders/orders/?page=1')['ETag'],
+                            self.client.get('/api/orders/orders/?page_size=5')['ETag'])
+
+    def test_comment_edits_and_test_renames_change_the_order(self):
+        url = f'/api/orders/orders/{self.order_id}/'
+        comment = self.client.post('/api/orders/comments/', {'order_id': self.order_id, 'comment': 'Haemolysed', 'username': 'tech', 'role': 'labtech'}, format='json').data
+        etag = self.client.get(url)['ETag']
+        self.assertNotModified(url, etag)
+
+        self.client.patch(f"/api/orders/comments/{comment['id']}/", {'order_id': self.order_id, 'comment': 'Clotted'}, format='json')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual([c['comment'] for c in response.data['comments']], ['Clotted'])
+
+        etag = response['ETag']
+        self.client.delete(f"/api/orders/comments/{comment['id']}/")
+        etag = self.assertModified(url, etag)
+
+        # Test statuses embed the test name, so renaming a test in the catalog changes the order too
+        self.cbc.name = 'Complete Blood Count'
+        self.cbc.save()
+        self.assertModified(url, etag)
+
+    def test_writes_outside_the_api_change_the_order(self):
+        url = f'/api/orders/orders/{self.order_id}/'
+        order = LabOrder.objects.get(order_id=self.order_id)
+        other = LabTest.objects.create(name='LFT')
+        etag = self.client.get(url)['ETag']
+
+        # As the admin or the shell would make them
+        order.clinical_history = 'Fever'
+        order.save()
+        etag = self.assertModified(url, etag)
+        status_row = TestStatus.objects.create(order=order, test=self.cbc, status='accepted')
+        etag = self.assertModified(url, etag)
+        status_row.status = 'flagged'
+        status_row.save()
+        etag = self.assertModified(url, etag)
+        comment = LabComment.objects.create(order=order, comment='Haemolysed', username='tech', role='labtech')
+        etag = self.assertModified(url, etag)
+        comment.delete()
+        etag = self.assertModified(url, etag)
+        order.tests.add(other)
+        self.assertModified(url, etag)
+
+        # API writes are recorded once, and a deleted order's comments add nothing of their own
+        OrderChange.objects.all().delete()
+        self.client.post('/api/orders/comments/', {'order_id': self.order_id, 'comment': 'Recollect', 'username': 'tech', 'role': 'labtech'}, format='json')
+        self.assertEqual(list(OrderChange.objects.values_list('kind', flat=True)), ['comment'])
+        LabOrder.objects.filter(pk=order.pk).delete()
+        self.assertEqual(list(OrderChange.objects.values_list('kind', flat=True)), ['comment', 'deleted'])
+
+    def test_test_catalog_and_comments(self):
+        # The catalog list is checked against the in-memory version, without a query
+        url = '/api/orders/tests/'
+        etag = self.client.get(url)['ETag']
+        self.assertNotModified(url, etag, queries=0)
+        self.cbc.name = 'Complete Blood Count'
+        self.cbc.save()
+        etag = self.assertModified(url, etag)
+        self.assertNotModified(url, etag, queries=0)
+
+        url = f'/api/orders/comments/?order_id={self.order_id}'
+        etag = self.client.get(url)['ETag']
+        self.client.post('/api/orders/comments/', {'order_id': self.order_id, 'comment': 'Recollect', 'username': 'tech', 'role': 'labtech'}, format='json')
+        self.assertModified(url, etag)
+
+
 class OrderIDGenerationTestCase(TestCase):
+    def test_sequential_order_ids(self):
+        current_year = timezone.now().strftime('%y')
+        first = LabOrder.objects.create(patient_name="Test Patient", ip_number="IP123", age=25)
+        second = LabOrder.objects.create(patient_name="Test Patient", ip_number="IP124", age=25)
+        self.assertEqual(first.order_id, f'OR{current_year}-000001')
+        self.assertEqual(second.order_id, f'OR{current_year}-000002')
+
+    def test_counter_continues_from_existing_orders(self):
+        current_year = timezone.now().strftime('%y')
+        LabOrder(order_id=f'OR{current_year}-000041', patient_name="Legacy", ip_number="IP1").save()
+        order = LabOrder.objects.create(patient_name="Test Patient", ip_number="IP123", age=25)
+        self.assertEqual(order.order_id, f'OR{current_year}-000042')
+
+    def test_year_rollover_restarts_numbering(self):
+        OrderIdSequence.reserve(count=3, year='25')
+        self.assertEqual(OrderIdSequence.reserve(year='26'), ['OR26-000001'])
+        self.assertEqual(OrderIdSequence.reserve(year='25'), ['OR25-000004'])
+
+    def test_reserve_block(self):
+        current_year = timezone.now().strftime('%y')
+        block = OrderIdSequence.reserve(count=5)
+        self.assertEqual(block, [f'OR{current_year}-{n:06d}' for n in range(1, 6)])
+        order = LabOrder.objects.create(patient_name="Test Patient", ip_number="IP123", age=25)
+        self.assertEqual(order.order_id, f'OR{current_year}-000006')
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentOrderIDGenerationTestCase(TransactionTestCase):
+    """Needs real row locks, so it only runs against PostgreSQL"""
+
     def test_concurrent_order_generation(self):
-        from concurrent.futures import ThreadPoolExecutor
-        from functools import partial
-        import threading
-        
-        def create_order():
-            order = LabOrder(
-                patient_name="Test Patient",
-                ip_number="IP123",
-                age=25
-            )
-            order.save()
-            return order.order_id
-        
+        def create_order(_):
+            try:
+                order = LabOrder(
+                    patient_name="Test Patient",
+                    ip_number="IP123",
+                    age=25
+                )
+                order.save()
+                return order.order_id
+            finally:
+                connection.close()
+
         # Test concurrent order creation
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            order_ids = list(executor.map(lambda x: create_order(), range(20)))
-            
-        # Verify uniqueness
-        self.assertEqual(len(order_ids), len(set(order_ids)), "Duplicate order IDs were generated")
-        
-        # Verify format
+        with ThreadPoolExecutor(max_workers=50) as executor:
+            order_ids = list(executor.map(create_order, range(300)))
+
+        # Verify uniqueness and that no numbers were skipped
         current_year = timezone.now().strftime('%y')
-        for order_id in order_ids:
-            self.assertTrue(order_id.startswith(f'OR{current_year}'), f"Invalid order ID format: {order_id}")
-            self.assertTrue(order_id[4:].isdigit(), f"Invalid order ID number part: {order_id}")
\ No newline at end of file
+        self.assertEqual(len(order_ids), len(set(order_ids)), "Duplicate order IDs were generated")
+        self.assertEqual(sorted(order_ids), [f'OR{current_year}-{n:06d}' for n in range(1, 301)])
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentStatusUpdateTestCase(TransactionTestCase):
+    """Needs real row locks, so it only runs against PostgreSQL"""
+
+    def test_concurrent_transitions_keep_rollup_in_step(self):
+        user = get_user_model().objects.create_user(username='tech', password='secret', role='labtech')
+        cbc = LabTest.objects.create(name='CBC')
+        order = LabOrder.objects.create(patient_name='Patient', ip_number='IP1', department='MED', unit='U1')
+        order.tests.set([cbc])
+        call_command('rebuild_order_rollup', stdout=StringIO())
+        statuses = ['accepted', 'rejected', 'flagged', 'billing']
+
+        def transition(n):
+            try:
+                client = APIClient()
+                client.force_authenticate(user)
+                new_status = statuses[n % len(statuses)]
+                if n % 2:
+                    client.patch(f'/api/orders/orders/{order.order_id}/update-status/', {'status': new_status}, format='json')
+                else:
+                    client.post(f'/api/orders/orders/{order.order_id}/update_test_status/',
+                                {'status': new_status, 'all_tests_status': True}, format='json')
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            list(executor.map(transition, range(100)))
+
+        # Exactly one order, counted once, under the status it ended up with
+        order.refresh_from_db()
+        rollup = dict(OrderDailyStat.objects.exclude(total=0).values_list('status', 'total'))
+        self.assertEqual(rollup, {order.status: 1})
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Needs PostgreSQL LISTEN/NOTIFY')
+class PostgresEventBackendTestCase(TransactionTestCase):
+    def test_event_published_by_one_process_reaches_another(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        sender = PostgresEventBackend(OrderEventHub())
+        receiving_hub = OrderEventHub()
+        receiver = PostgresEventBackend(receiving_hub)
+        receiver.start()
+        self.addCleanup(receiver.stop)
+
+        async def subscribe():
+            return receiving_hub.subscribe()
+        subscription = loop.run_until_complete(subscribe())
+        self.addCleanup(subscription.close)
+
+        event = {'id': 1, 'event': 'order.created', 'data': {'order_id': 'OR25-000001', 'department': 'MED', 'sections': []}}
+        # A NOTIFY sent before the listener's LISTEN is lost, so keep sending until one arrives
+        for _ in range(50):
+            sender.publish([event])
+            try:
+                received = loop.run_until_complete(subscription.get(0.2))
+                break
+            except asyncio.TimeoutError:
+                continue
+        else:
+            self.fail('The event never reached the other hub')
+        self.assertEqual(received, event)
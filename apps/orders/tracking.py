@@ -0,0 +1,148 @@
+"""
+Keeps the daily rollup and the change feed right for order writes made outside
+the API views.
+
+The API write paths describe what they did to a RollupDelta and call
+`record_changes` themselves, in bulk, and run inside `tracked()`. Any other
+save, delete or test change of a LabOrder, or save or delete of one of its test
+statuses or comments (the Django admin, the shell, management commands), goes
+through the receivers here, which do the same one row at a time. The change
+feed versions the order list's ETag, so these writes also invalidate it. LabTest
+deletes need nothing: the link rows and the test's TestDailyStat rows cascade
+together, and the catalog version covers the orders that embedded the test.
+
+Writes that send no signals (QuerySet.update(), bulk_create(), raw SQL) outside
+the API paths still need `manage.py rebuild_order_rollup`, and don't show up
+in the change feed.
+"""
+import threading
+from contextlib import contextmanager
+from types import SimpleNamespace
+from django.db.models import QuerySet
+from .changes import record_changes
+from .models import LabComment, LabOrder, TestStatus
+from .rollup import ROLLUP_ORDER_FIELDS, RollupDelta
+
+# Change feed kind for a write to each of the rows embedded in an order
+PART_KINDS = {
+    TestStatus: 'test_status',
+    LabComment: 'comment',
+}
+
+_state = threading.local()
+
+
+@contextmanager
+def tracked():
+    """Mark writes in this block as already counted by the caller"""
+    _state.depth = getattr(_state, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _state.depth -= 1
+
+
+def is_tracked():
+    return getattr(_state, 'depth', 0) > 0
+
+
+def _test_ids(order):
+    return list(LabOrder.tests.through.objects.filter(laborder_id=order.pk).values_list('labtest_id', flat=True))
+
+
+def remember_order(sender, instance, raw=False, **kwargs):
+    """pre_save receiver for LabOrder: keep the stored row to diff against"""
+    if raw or is_tracked() or instance._state.adding:
+        return
+    instance._rollup_before = LabOrder.objects.filter(pk=instance.pk).values(*ROLLUP_ORDER_FIELDS).first()
+
+
+def count_order(sender, instance, created, raw=False, **kwargs):
+    """post_save receiver for LabOrder"""
+    if raw or is_tracked():
+        return
+    record_changes([instance], 'created' if created else 'updated')
+    delta = RollupDelta()
+    if created:
+        # Its tests are counted as they are added
+        delta.add(instance, [])
+    else:
+        before = instance.__dict__.pop('_rollup_before', None)
+        if before is None:
+            return
+        before = SimpleNamespace(**before)
+        if RollupDelta.key(before) == RollupDelta.key(instance):
+            return
+        test_ids = _test_ids(instance)
+        delta.remove(before, test_ids)
+        delta.add(instance, test_ids)
+    delta.flush()
+
+
+def remember_tests(sender, instance, **kwargs):
+    """pre_delete receiver for LabOrder; the link rows are gone by post_delete"""
+    if not is_tracked():
+        instance._rollup_tests = _test_ids(instance)
+
+
+def uncount_order(sender, instance, **kwargs):
+    """post_delete receiver for LabOrder"""
+    test_ids = instance.__dict__.pop('_rollup_tests', None)
+    if is_tracked():
+        return
+    record_changes([instance], 'deleted')
+    if test_ids is None:
+        return
+    delta = RollupDelta()
+    delta.remove(instance, test_ids)
+    delta.flush()
+
+
+def count_tests(sender, instance, action, reverse, pk_set, **kwargs):
+    """m2m_changed receiver for LabOrder.tests, from either side"""
+    if is_tracked():
+        return
+    OrderTests = LabOrder.tests.through
+    # (order id, test id) pairs about to be removed; pk_set may name pairs that don't exist
+    if action in ('pre_remove', 'pre_clear'):
+        links = OrderTests.objects.filter(**{'labtest_id' if reverse else 'laborder_id': instance.pk})
+        if action == 'pre_remove':
+            links = links.filter(**{'laborder_id__in' if reverse else 'labtest_id__in': pk_set})
+        instance._rollup_removed = list(links.values_list('laborder_id', 'labtest_id'))
+        return
+    if action == 'post_add':
+        sign, pairs = 1, [(pk, instance.pk) if reverse else (instance.pk, pk) for pk in pk_set]
+    elif action in ('post_remove', 'post_clear'):
+        sign, pairs = -1, instance.__dict__.pop('_rollup_removed', [])
+    else:
+        return
+    if not pairs:
+        return
+    orders = {instance.pk: instance} if not reverse else LabOrder.objects.in_bulk({order_id for order_id, _ in pairs})
+    delta = RollupDelta()
+    for order_id, test_id in pairs:
+        delta.add_tests(orders[order_id], [test_id], sign)
+    delta.flush()
+    record_changes([orders[order_id] for order_id in {order_id for order_id, _ in pairs}], 'updated')
+
+
+def _deleted_with_order(origin):
+    model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    return model is LabOrder
+
+
+def remember_part_order(sender, instance, raw=False, **kwargs):
+    """pre_save receiver for TestStatus and LabComment: a row moved to another order changes both"""
+    if raw or is_tracked() or instance._state.adding:
+        return
+    instance._previous_order_id = sender.objects.filter(pk=instance.pk).values_list('order_id', flat=True).first()
+
+
+def record_part_change(sender, instance, raw=False, origin=None, **kwargs):
+    """post_save and post_delete receiver for TestStatus and LabComment"""
+    previous = instance.__dict__.pop('_previous_order_id', None)
+    # Rows cascading from an order delete are covered by the order's own change
+    if raw or is_tracked() or (origin is not None and _deleted_with_order(origin)):
+        return
+    orders = LabOrder.objects.filter(pk__in={instance.order_id, previous} - {None}).only('order_id')
+    record_changes(list(orders), PART_KINDS[sender])
@@ -10,5 +10,9 @@ router.register(r'comments', views.LabCommentViewSet, basename='comments')
 urlpatterns = [
     path('', include(router.urls)),
     path('submit-order/', views.submit_order, name='submit-order'),
+    path('submit-batch/', views.submit_batch, name='submit-batch'),
+    path('bulk-status/', views.bulk_update_status, name='bulk-status'),
+    path('changes/', views.order_changes, name='order-changes'),
+    path('events/', views.order_events, name='order-events'),
     path('orders/<str:order_id>/update-status/', views.update_order_status, name='update-order-status'),
 ]
\ No newline at end of file
@@ -5,87 +5,99 @@ from rest_framework import serializers
 from django.db.models import Q, Count, F
 from django.db.models.functions import ExtractYear
 from django.db import transaction
+from django.http import HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from asgiref.sync import sync_to_async
+from custom_auth.authentication import token_user
+from custom_auth.roles import privilege_for
 from django.shortcuts import get_object_or_404
+from django.utils.dateparse import parse_date
 from .models import LabOrder, LabTest, TestStatus, LabComment
 from .serializers import LabOrderSerializer, LabTestSerializer, TestStatusSerializer, LabCommentSerializer
+from .search import filter_orders
+from .export import EXPORT_FORMATS, export_orders
+from .rollup import RollupDelta, rollup_stats
+from .tracking import tracked
+from .stats import live_stats
+from .changes import MAX_CHANGES, changes_since, latest_cursor, record_changes
+from .live import event_stream, get_backend, hub
+from .conditional import ConditionalGetMixin, order_version
+from .catalog import test_catalog
+from .suggest import DEFAULT_SUGGESTIONS, MAX_SUGGESTIONS, suggest_index
 import logging
 from rest_framework.pagination import PageNumberPagination
+from lab_requisition.pagination import KeysetPagination
 
 # Configure query logging for development
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+# Upper bound on orders accepted by a single submit-batch request
+MAX_BATCH_SIZE = 100
+
 class LabOrderPagination(PageNumberPagination):
     page_size = 10
     page_size_query_param = 'page_size'
     max_page_size = 100
 
-class LabOrderViewSet(viewsets.ModelViewSet):
+class LabOrderCursorPagination(KeysetPagination):
+    default_ordering = '-created_at'
+
+class LabOrderViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     serializer_class = LabOrderSerializer
     lookup_field = 'order_id'
     pagination_class = LabOrderPagination
 
+    @property
+    def paginator(self):
+        """Keyset pagination when the client opts in with ?pagination=cursor, page numbers otherwise"""
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params
+            if params.get('pagination') == 'cursor' or 'cursor' in params:
+                self._paginator = LabOrderCursorPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
     def get_queryset(self):
-        return LabOrder.objects.prefetch_related('tests', 'teststatus').all()
+        queryset = LabOrder.objects.all()
+        if self.action in ('list', 'retrieve', 'search'):
+            # Load everything LabOrderSerializer reads in a fixed number of queries per page
+            queryset = LabOrderSerializer.prefetch_for_read(queryset)
+        return queryset
+
+    def get_version(self):
+        # Every order write path appends to the change feed, so its newest entry versions the orders
+        if self.action == 'retrieve':
+            version = order_version(self.kwargs['order_id'])
+        else:
+            version = order_version()
+        if version is None:
+            return None
+        # Orders embed test names, so a catalog edit (e.g. a rename) must change the tag too
+        catalog = test_catalog.snapshot()
+        change_id, last_modified = version
+        if catalog.last_modified and catalog.last_modified > last_modified:
+            last_modified = catalog.last_modified
+        return f'{change_id}:{catalog.version}', last_modified
+
+    def perform_destroy(self, instance):
+        with transaction.atomic(), tracked():
+            delta = RollupDelta()
+            delta.remove(instance, instance.tests.values_list('id', flat=True))
+            delta.flush()
+            record_changes([instance], 'deleted')
+            instance.delete()
 
     @action(detail=False, methods=['get'])
     def search(self, request):
-        patient_name = request.query_params.get('patient_name', '')
-        ip_number = request.query_params.get('ip_number', '')
-        department = request.query_params.get('department', '')
-        status = request.query_params.get('status', '')
-        date_from = request.query_params.get('date_from', '')
-        date_to = request.query_params.get('date_to', '')
-        test_name = request.query_params.get('test_name', '')
-        age_min = request.query_params.get('age_min', '')
-        age_max = request.query_params.get('age_max', '')
-        unit = request.query_params.get('unit', '')
-        created_by = request.query_params.get('created_by', '')
+        return self.conditional_response(request, lambda: self._search(request))
+
+    def _search(self, request):
         order_by = request.query_params.get('order_by', '-created_at')
-        order_id = request.query_params.get('order_id', '')
-        ipop = request.query_params.get('ipop', '')
+        queryset = filter_orders(self.get_queryset(), request.query_params)
 
-        queryset = self.get_queryset()
-        
-        # Filter by order_id if provided
-        if order_id:
-            queryset = queryset.filter(order_id__icontains=order_id)
-        
-        # Optimize query by combining OR conditions
-        name_ip_filters = Q()
-        if patient_name:
-            name_ip_filters |= Q(patient_name__icontains=patient_name)
-        if ip_number:
-            name_ip_filters |= Q(ip_number__icontains=ip_number)
-        if name_ip_filters:
-            queryset = queryset.filter(name_ip_filters)
-
-        # Apply AND filters
-        if department:
-            queryset = queryset.filter(department__iexact=department)
-        if status:
-            queryset = queryset.filter(status__iexact=status)
-        if date_from:
-            queryset = queryset.filter(created_at__gte=date_from)
-        if date_to:
-            queryset = queryset.filter(created_at__lte=date_to)
-        if test_name:
-            queryset = queryset.filter(tests__name__icontains=test_name)
-        if age_min:
-            queryset = queryset.filter(age__gte=int(age_min))
-        if age_max:
-            queryset = queryset.filter(age__lte=int(age_max))
-        if unit:
-            queryset = queryset.filter(unit__iexact=unit)
-        if created_by:
-            queryset = queryset.filter(username__icontains=created_by)
-        if ipop:
-            queryset = queryset.filter(ipop__iexact=ipop)
-
-        # Apply distinct and ordering after all filters
-        queryset = queryset.distinct()
-        
-        # Optimize ordering
+        # Optimize ordering (no filter joins a to-many relation, so no DISTINCT is needed)
         if order_by.startswith('-'):
             field = order_by[1:]
             queryset = queryset.order_by(F(field).desc(nulls_last=True))
@@ -101,55 +113,49 @@ class LabOrderViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Stream every order matching the search filters as NDJSON (default) or CSV, optionally gzipped"""
+        output_format = request.query_params.get('output', 'ndjson')
+        if output_format not in EXPORT_FORMATS:
+            return Response({'error': f"output must be one of: {', '.join(EXPORT_FORMATS)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        gzip = request.query_params.get('gzip', '').lower() in ('1', 'true', 'yes')
+        
+        queryset = filter_orders(LabOrder.objects.all(), request.query_params)
+        content_type, extension = EXPORT_FORMATS[output_format]
+        filename = f'orders.{extension}'
+        if gzip:
+            content_type = 'application/gzip'
+            filename += '.gz'
+        
+        response = StreamingHttpResponse(export_orders(queryset, output_format, gzip), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
     @action(detail=False, methods=['get'])
     def stats(self, request):
         """Get statistics about orders"""
         date_from = request.query_params.get('date_from', '')
         date_to = request.query_params.get('date_to', '')
         
-        # Base queryset with date filters
-        queryset = self.get_queryset()
+        # Whole-day ranges (YYYY-MM-DD bounds, both inclusive) are answered from the daily rollup
+        try:
+            day_from = parse_date(date_from) if date_from else None
+            day_to = parse_date(date_to) if date_to else None
+        except ValueError:
+            return Response({'error': 'Invalid date'}, status=status.HTTP_400_BAD_REQUEST)
+        if (day_from or not date_from) and (day_to or not date_to):
+            return Response(rollup_stats(day_from, day_to))
+        
+        # Otherwise count the matching orders directly, all breakdowns in one query
+        queryset = LabOrder.objects.all()
         if date_from:
             queryset = queryset.filter(created_at__gte=date_from)
         if date_to:
             queryset = queryset.filter(created_at__lte=date_to)
-
-        # Use annotations for efficient counting
-        stats = queryset.aggregate(
-            total_orders=Count('id'),
-            pending_orders=Count('id', filter=Q(status='pending')),
-            accepted_orders=Count('id', filter=Q(status='accepted')),
-            rejected_orders=Count('id', filter=Q(status='rejected')),
-            flagged_orders=Count('id', filter=Q(status='flagged'))
-        )
         
-        # Efficient department and unit counts using values and annotation
-        stats['departments'] = list(
-            queryset.values('department')
-                   .annotate(count=Count('id'))
-                   .order_by('-count')
-        )
-        
-        stats['units'] = list(
-            queryset.values('unit')
-                   .annotate(count=Count('id'))
-                   .order_by('-count')
-        )
-        
-        stats['tests_ordered'] = list(
-            queryset.values('tests__name')
-                   .annotate(count=Count('id'))
-                   .order_by('-count')
-        )
-        
-        # Add patient type statistics (inpatient vs outpatient)
-        stats['patient_types'] = list(
-            queryset.values('ipop')
-                   .annotate(count=Count('id'))
-                   .order_by('-count')
-        )
-        
-        return Response(stats)
+        return Response(live_stats(queryset))
 
     @action(detail=True, methods=['post'])
     def update_test_status(self, request, order_id=None):
@@ -170,33 +176,32 @@ class LabOrderViewSet(viewsets.ModelViewSet):
         if new_status not in dict(TestStatus._meta.get_field('status').choices).keys():
             return Response({'error': 'Invalid status'}, status=status.HTTP_400_BAD_REQUEST)
         
-        with transaction.atomic():
+        with transaction.atomic(), tracked():
+            # Lock the row so concurrent transitions each move the rollup from the status they saw
+            order = LabOrder.objects.select_for_update().get(pk=order.pk)
+            old_status = order.status
+            order_tests = list(order.tests.all())
+            
             # Update the order's overall status
             order.status = new_status
             order.all_tests_status = all_tests
-            order.save()
+            order.save(update_fields=['status', 'all_tests_status'])
+            
+            delta = RollupDelta()
+            delta.change_status(order, [test.pk for test in order_tests], old_status, new_status)
+            delta.flush()
             
-            # If applying to all tests
+            # Apply to all tests, or only the requested ones, with a single upsert
             if all_tests:
-                tests = order.tests.all()
-                for test in tests:
-                    TestStatus.objects.update_or_create(
-                        order=order,
-                        test=test,
-                        defaults={'status': new_status}
-                    )
-            # If applying to specific tests
+                tests = order_tests
             elif test_ids:
-                tests = LabTest.objects.filter(id__in=test_ids)
-                for test in tests:
-                    TestStatus.objects.update_or_create(
-                        order=order,
-                        test=test,
-                        defaults={'status': new_status}
-                    )
-                    
-            # Return updated test statuses
-            test_statuses = TestStatus.objects.filter(order=order)
+                tests = LabTest.objects.filter(id__in=test_ids).order_by('id')
+            else:
+                tests = []
+            test_statuses = TestStatus.upsert(((order, test) for test in tests), new_status)
+            record_changes([order], 'test_status')
+            
+            # Return only the test statuses this request changed
             serializer = TestStatusSerializer(test_statuses, many=True)
             
             return Response({
@@ -223,13 +228,153 @@ def submit_order(request):
     except Exception as e:
         raise serializers.ValidationError(str(e))
 
+@api_view(['POST'])
+def submit_batch(request):
+    """
+    Submit several orders in one request. Every order is validated on its own;
+    the valid ones are created together with bulk inserts and each item gets
+    its own result so the desk can resubmit only the ones that failed.
+    """
+    items = request.data.get('orders') if isinstance(request.data, dict) else request.data
+    if not isinstance(items, list) or not items:
+        return Response({'error': 'A non-empty list of orders is required'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(items) > MAX_BATCH_SIZE:
+        return Response({'error': f'At most {MAX_BATCH_SIZE} orders can be submitted at once'},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    results = []
+    valid_items = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results.append({'index': index, 'status': 'error', 'errors': {'non_field_errors': ['Expected an order object']}})
+            continue
+        data = dict(item)
+        data['username'] = request.user.username
+        data['role'] = request.user.role
+        serializer = LabOrderSerializer(data=data)
+        if serializer.is_valid():
+            valid_items.append((index, serializer.validated_data))
+        else:
+            results.append({'index': index, 'status': 'error', 'errors': serializer.errors})
+
+    if valid_items:
+        orders = LabOrderSerializer(many=True).create([data for _, data in valid_items])
+        for (index, _), order in zip(valid_items, orders):
+            results.append({'index': index, 'status': 'created', 'order_id': order.order_id})
+    results.sort(key=lambda result: result['index'])
+
+    created = len(valid_items)
+    if created == len(items):
+        response_status = status.HTTP_201_CREATED
+    elif created:
+        response_status = status.HTTP_207_MULTI_STATUS
+    else:
+        response_status = status.HTTP_400_BAD_REQUEST
+    return Response({
+        'created': created,
+        'failed': len(items) - created,
+        'results': results
+    }, status=response_status)
+
+@api_view(['POST'])
+def bulk_update_status(request):
+    """
+    Move many orders to one status at once. Orders listed without test_ids get the
+    status on all of their tests; with test_ids only those tests change. Everything is
+    applied in one transaction with set-based UPDATEs and a single test status upsert.
+    """
+    if not isinstance(request.data, dict):
+        return Response({'error': 'Expected a JSON object'}, status=status.HTTP_400_BAD_REQUEST)
+    new_status = request.data.get('status')
+    if new_status not in dict(TestStatus._meta.get_field('status').choices):
+        return Response({'error': 'Invalid status'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    order_ids = request.data.get('order_ids') or []
+    if not isinstance(order_ids, list) or not all(isinstance(order_id, str) for order_id in order_ids):
+        return Response({'error': 'order_ids must be a list of order ids'}, status=status.HTTP_400_BAD_REQUEST)
+    items = request.data.get('orders') or []
+    if not isinstance(items, list):
+        return Response({'error': 'orders must be a list'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    # Requested test ids per order_id, None meaning all of the order's tests
+    requested = {order_id: None for order_id in order_ids}
+    for item in items:
+        if not isinstance(item, dict) or not isinstance(item.get('order_id'), str) or not item['order_id']:
+            return Response({'error': 'Each entry in orders needs an order_id'}, status=status.HTTP_400_BAD_REQUEST)
+        test_ids = item.get('test_ids')
+        if test_ids is not None and not isinstance(test_ids, list):
+            return Response({'error': 'test_ids must be a list of test ids'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            requested[item['order_id']] = {int(test_id) for test_id in test_ids} if test_ids else None
+        except (TypeError, ValueError):
+            return Response({'error': 'test_ids must be a list of test ids'}, status=status.HTTP_400_BAD_REQUEST)
+    if not requested:
+        return Response({'error': 'order_ids or orders is required'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(requested) > MAX_BATCH_SIZE:
+        return Response({'error': f'At most {MAX_BATCH_SIZE} orders can be updated at once'},
+                        status=status.HTTP_400_BAD_REQUEST)
+    
+    results = {}
+    with transaction.atomic(), tracked():
+        orders = {
+            order.order_id: order
+            for order in LabOrder.objects.select_for_update().filter(order_id__in=list(requested))
+        }
+        tests_by_order = {}
+        for link in LabOrder.tests.through.objects.filter(laborder__in=orders.values()).select_related('labtest'):
+            tests_by_order.setdefault(link.laborder_id, []).append(link.labtest)
+        
+        whole_orders = []
+        partial_orders = []
+        order_tests = []
+        updated_orders = []
+        delta = RollupDelta()
+        for order_id, test_ids in requested.items():
+            order = orders.get(order_id)
+            if order is None:
+                results[order_id] = {'order_id': order_id, 'status': 'error', 'error': 'Order not found'}
+                continue
+            tests = tests_by_order.get(order.pk, [])
+            if test_ids is not None:
+                unknown = test_ids - {test.pk for test in tests}
+                if unknown:
+                    results[order_id] = {'order_id': order_id, 'status': 'error',
+                                         'error': f'Tests {sorted(unknown)} are not part of this order'}
+                    continue
+                selected = [test for test in tests if test.pk in test_ids]
+                partial_orders.append(order.pk)
+            else:
+                selected = tests
+                whole_orders.append(order.pk)
+            delta.change_status(order, [test.pk for test in tests], order.status, new_status)
+            order_tests.extend((order, test) for test in selected)
+            updated_orders.append(order)
+            results[order_id] = {'order_id': order_id, 'status': 'updated', 'tests_updated': len(selected)}
+        
+        if whole_orders:
+            LabOrder.objects.filter(pk__in=whole_orders).update(status=new_status, all_tests_status=True)
+        if partial_orders:
+            LabOrder.objects.filter(pk__in=partial_orders).update(status=new_status, all_tests_status=False)
+        TestStatus.upsert(order_tests, new_status)
+        delta.flush()
+        record_changes(updated_orders, 'status')
+    
+    updated = len(updated_orders)
+    if updated == len(requested):
+        response_status = status.HTTP_200_OK
+    elif updated:
+        response_status = status.HTTP_207_MULTI_STATUS
+    else:
+        response_status = status.HTTP_400_BAD_REQUEST
+    return Response({
+        'status': new_status,
+        'updated': updated,
+        'failed': len(requested) - updated,
+        'results': list(results.values())
+    }, status=response_status)
+
 @api_view(['PATCH'])
 def update_order_status(request, order_id):
-    try:
-        order = LabOrder.objects.get(order_id=order_id)
-    except LabOrder.DoesNotExist:
-        return Response({'error': 'Order not found'}, status=status.HTTP_404_NOT_FOUND)
-    
     new_status = request.data.get('status')
     lab_note = request.data.get('lab_note', '')
     all_tests_status = request.data.get('all_tests_status', True)
@@ -237,19 +382,29 @@ def update_order_status(request, order_id):
     if new_status not in ['pending', 'accepted', 'rejected', 'flagged', 'billing', 'rejected_from_lab']:
         return Response({'error': 'Invalid status'}, status=status.HTTP_400_BAD_REQUEST)
     
-    order.status = new_status
-    order.lab_note = lab_note
-    order.all_tests_status = all_tests_status
-    order.save()
-    
-    # If all tests status is true, update all test statuses
-    if all_tests_status and new_status != 'pending':
-        for test in order.tests.all():
-            TestStatus.objects.update_or_create(
-                order=order,
-                test=test,
-                defaults={'status': new_status}
-            )
+    with transaction.atomic(), tracked():
+        # Lock the row so concurrent transitions each move the rollup from the status they saw
+        try:
+            order = LabOrder.objects.select_for_update().get(order_id=order_id)
+        except LabOrder.DoesNotExist:
+            return Response({'error': 'Order not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        old_status = order.status
+        order.status = new_status
+        order.lab_note = lab_note
+        order.all_tests_status = all_tests_status
+        order.save(update_fields=['status', 'lab_note', 'all_tests_status'])
+        order_tests = list(order.tests.all())
+        
+        if old_status != new_status:
+            delta = RollupDelta()
+            delta.change_status(order, [test.pk for test in order_tests], old_status, new_status)
+            delta.flush()
+        
+        # If all tests status is true, update all test statuses with a single upsert
+        if all_tests_status and new_status != 'pending':
+            TestStatus.upsert(((order, test) for test in order_tests), new_status)
+        record_changes([order], 'status')
     
     return Response({
         'status': 'Order status updated', 
@@ -257,13 +412,76 @@ def update_order_status(request, order_id):
         'all_tests_status': order.all_tests_status
     }, status=status.HTTP_200_OK)
 
+@api_view(['GET'])
+def order_changes(request):
+    """
+    Orders created or modified after the `since` cursor. Without `since`, returns the
+    current cursor to start polling from. With include=orders the full order payloads
+    are returned too (deleted orders are only listed in changes).
+    """
+    since = request.query_params.get('since')
+    if since is None:
+        return Response({'cursor': latest_cursor(), 'has_more': False, 'changes': []})
+    try:
+        since = int(since)
+        limit = min(int(request.query_params.get('limit', MAX_CHANGES)), MAX_CHANGES)
+    except ValueError:
+        return Response({'error': 'since and limit must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    cursor, has_more, changes = changes_since(since, limit=max(limit, 1))
+    data = {'cursor': cursor, 'has_more': has_more, 'changes': changes}
+    if request.query_params.get('include') == 'orders':
+        orders = LabOrderSerializer.prefetch_for_read(
+            LabOrder.objects.filter(order_id__in=[change['order_id'] for change in changes])
+        )
+        data['orders'] = LabOrderSerializer(orders, many=True).data
+    return Response(data)
+
+async def _stream_user(request):
+    """
+    User for an event stream request. EventSource can't send headers, so besides the
+    session cookie and `Authorization: Token ...` the token may be passed as ?token=.
+    """
+    key = request.GET.get('token')
+    header = request.headers.get('Authorization', '')
+    if not key and header.startswith('Token '):
+        key = header[len('Token '):].strip()
+    if key:
+        return await sync_to_async(token_user)(key)
+    user = await sync_to_async(lambda: request.user if request.user.is_authenticated else None)()
+    return user
+
+async def order_events(request):
+    """
+    Server-Sent Events stream of order.created and order.status events, optionally
+    limited to some departments and/or test sections (comma separated). Event ids are
+    change feed cursors, so a client that drops can catch up with /changes/?since=<id>.
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'error': 'The event stream is only served by the ASGI application'}, status=501)
+    if await _stream_user(request) is None:
+        return JsonResponse({'error': 'Authentication credentials were not provided'}, status=401)
+
+    def split(param):
+        return [value.strip() for value in request.GET.get(param, '').split(',') if value.strip()]
+
+    get_backend().start()
+    subscription = hub.subscribe(departments=split('department'), sections=split('section'))
+    response = StreamingHttpResponse(event_stream(subscription), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 @api_view(['GET'])
 def get_orders(request):
     orders = LabOrder.objects.all()
     serializer = LabOrderSerializer(orders, many=True)
     return Response(serializer.data)
 
-class LabTestViewSet(viewsets.ModelViewSet):
+class LabTestViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     serializer_class = LabTestSerializer
 
     def get_queryset(self):
@@ -274,9 +492,44 @@ class LabTestViewSet(viewsets.ModelViewSet):
             privileges = [int(p) for p in privileges]
             queryset = queryset.filter(privilege__in=privileges)  # Fixed missing closing parenthesis
         
-        return queryset.only('id', 'name', 'privilege', 'vac_col')
+        return queryset
 
-class LabCommentViewSet(viewsets.ModelViewSet):
+    def get_version(self):
+        if self.action in ('list', 'panels'):
+            # Served from the in-memory catalog, so its version is the ETag source
+            catalog = test_catalog.snapshot()
+            return catalog.version, catalog.last_modified
+        return super().get_version()
+
+    def list(self, request, *args, **kwargs):
+        """The whole catalog (optionally filtered by privilege), without touching the database"""
+        privileges = {int(p) for p in request.query_params.getlist('privilege')}
+        return self.conditional_response(request, lambda: Response(test_catalog.snapshot().serialized(privileges)))
+
+    @action(detail=False, methods=['get'])
+    def panels(self, request):
+        """Panels (tests other tests point to with comp) with their components fully expanded"""
+        try:
+            panel_ids = {int(value) for value in request.query_params.get('ids', '').split(',') if value.strip()}
+        except ValueError:
+            return Response({'error': 'ids must be a comma separated list of test ids'}, status=status.HTTP_400_BAD_REQUEST)
+        return self.conditional_response(request, lambda: Response(test_catalog.snapshot().panels(panel_ids)))
+
+    @action(detail=False, methods=['get'])
+    def suggest(self, request):
+        """Autocomplete test names for the order form, limited to tests the caller may order"""
+        query = request.query_params.get('q', '')
+        try:
+            limit = min(int(request.query_params.get('limit', DEFAULT_SUGGESTIONS)), MAX_SUGGESTIONS)
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        index = suggest_index()
+        tests = index.snapshot.serialized_by_id()
+        test_ids = index.suggest(query, privilege_for(request.user), limit=max(limit, 1))
+        return Response([tests[test_id] for test_id in test_ids])
+
+class LabCommentViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing lab comments
     """
@@ -309,11 +562,27 @@ class LabCommentViewSet(viewsets.ModelViewSet):
         
         serializer = self.get_serializer(data=data)
         serializer.is_valid(raise_exception=True)
-        self.perform_create(serializer)
+        with transaction.atomic(), tracked():
+            self.perform_create(serializer)
+            record_changes([order], 'comment')
         
         headers = self.get_success_headers(serializer.data)
         return Response(
             serializer.data, 
             status=status.HTTP_201_CREATED, 
             headers=headers
-        )
\ No newline at end of file
+        )
+
+    def perform_update(self, serializer):
+        # Orders embed their comments, so edits and deletes bump the order's version like new comments
+        old_order = serializer.instance.order
+        with transaction.atomic(), tracked():
+            comment = serializer.save()
+            # A comment moved to another order changes both
+            orders = [old_order] if comment.order_id == old_order.pk else [old_order, comment.order]
+            record_changes(orders, 'comment')
+
+    def perform_destroy(self, instance):
+        with transaction.atomic(), tracked():
+            record_changes([instance.order], 'comment')
+            instance.delete()
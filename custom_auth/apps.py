@@ -0,0 +1,19 @@
+from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
+
+
+class CustomAuthConfig(AppConfig):
+    name = 'custom_auth'
+    default_auto_field = 'django.db.models.BigAutoField'
+
+    def ready(self):
+        from django.contrib.auth import get_user_model
+        from rest_framework.authtoken.models import Token
+        from .authentication import forget_token, forget_user
+        from .directory import invalidate_summary
+
+        post_save.connect(forget_user, sender=get_user_model(), dispatch_uid='custom_auth.user.save')
+        post_delete.connect(forget_user, sender=get_user_model(), dispatch_uid='custom_auth.user.delete')
+        post_save.connect(invalidate_summary, sender=get_user_model(), dispatch_uid='custom_auth.directory.save')
+        post_delete.connect(invalidate_summary, sender=get_user_model(), dispatch_uid='custom_auth.directory.delete')
+        post_delete.connect(forget_token, sender=Token, dispatch_uid='custom_auth.token.delete')
@@ -0,0 +1,154 @@
+"""
+Authentication classes that skip the database for known tokens and sessions.
+
+DRF's TokenAuthentication joins authtoken_token to the user table on every
+request, and SessionAuthentication loads the user again after the session has
+been read. Here each user is cached by id (role included, as it is a field on
+the model), and each token key maps to its user id, both for AUTH_CACHE_SECONDS
+in the AUTH_CACHE cache alias. A request with a known token or session then
+reaches the view without an authentication query.
+
+Every cached entry must go when what it vouches for changes:
+
+- `revoke_tokens(user)` deletes a user's tokens and drops their cache entries; the
+  password and deactivation views use it instead of deleting tokens directly, and
+  logout uses `revoke_token(key)` for the token the request came with;
+- deleting a Token any other way (admin, shell) drops its key through post_delete;
+- saving a user (deactivation, role change, new password) drops the cached user,
+  so the next request re-reads it and re-checks is_active. Bulk writes that skip
+  signals call `evict_users()` themselves.
+
+Entries are dropped when the writing transaction commits (at once outside one).
+Dropped any earlier, a concurrent request could read the old rows and cache them
+again before the change became visible.
+"""
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils.crypto import constant_time_compare
+from rest_framework import exceptions
+from rest_framework.authentication import SessionAuthentication, TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+DEFAULT_CACHE_SECONDS = 300
+
+
+def _cache():
+    return caches[getattr(settings, 'AUTH_CACHE', 'default')]
+
+
+def _timeout():
+    return getattr(settings, 'AUTH_CACHE_SECONDS', DEFAULT_CACHE_SECONDS)
+
+
+def _user_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def _token_key(key):
+    return f'auth:token:{key}'
+
+
+def cached_user(user_id):
+    """Active user with `user_id`, from the cache or one query; None if there is none"""
+    cache = _cache()
+    user = cache.get(_user_key(user_id))
+    if user is None:
+        user = get_user_model()._default_manager.filter(pk=user_id).first()
+        if user is None or not user.is_active:
+            return None
+        cache.set(_user_key(user_id), user, _timeout())
+    return user
+
+
+def token_user(key):
+    """Active user owning token `key`, or None if the token doesn't exist"""
+    cache = _cache()
+    user_id = cache.get(_token_key(key))
+    if user_id is not None:
+        user = cache.get(_user_key(user_id))
+        if user is not None:
+            return user
+    # Unknown key, or the user was evicted: check the token itself is still there
+    token = Token.objects.select_related('user').filter(key=key).first()
+    if token is None or not token.user.is_active:
+        return None
+    cache.set_many({_token_key(key): token.user_id, _user_key(token.user_id): token.user}, _timeout())
+    return token.user
+
+
+def _delete_on_commit(keys):
+    transaction.on_commit(lambda: _cache().delete_many(keys))
+
+
+def evict_user(user_id):
+    _delete_on_commit([_user_key(user_id)])
+
+
+def evict_users(user_ids):
+    """Forget cached users after writes that skip post_save (update(), bulk_update())"""
+    _delete_on_commit([_user_key(user_id) for user_id in user_ids])
+
+
+def evict_token(key):
+    _delete_on_commit([_token_key(key)])
+
+
+def revoke_token(key):
+    """Delete the token `key`; post_delete drops its cache entry"""
+    Token.objects.filter(key=key).delete()
+
+
+def revoke_tokens(user):
+    """Delete every token of `user` and forget the cached user; post_delete drops the token keys"""
+    Token.objects.filter(user=user).delete()
+    evict_user(user.pk)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication that answers known tokens from the cache"""
+
+    def authenticate_credentials(self, key):
+        user = token_user(key)
+        if user is None:
+            raise exceptions.AuthenticationFailed('Invalid token.')
+        # The token object itself isn't cached; views only need to know a token was used
+        return (user, key)
+
+
+class CachedSessionAuthentication(SessionAuthentication):
+    """
+    SessionAuthentication that takes the user from the cache instead of letting
+    AuthenticationMiddleware load it, with the same checks as django.contrib.auth.get_user
+    """
+
+    def authenticate(self, request):
+        session = request._request.session
+        user_id = session.get(SESSION_KEY)
+        if user_id is None or session.get(BACKEND_SESSION_KEY) not in settings.AUTHENTICATION_BACKENDS:
+            return None
+        try:
+            user_id = get_user_model()._meta.pk.to_python(user_id)
+        except (ValidationError, TypeError, ValueError):
+            return None
+        user = cached_user(user_id)
+        if user is None:
+            return None
+        # A password change invalidates sessions started before it
+        if not constant_time_compare(session.get(HASH_SESSION_KEY) or '', user.get_session_auth_hash()):
+            session.flush()
+            return None
+        self.enforce_csrf(request)
+        return (user, None)
+
+
+def forget_token(sender, instance, **kwargs):
+    """post_delete receiver for Token"""
+    evict_token(instance.key)
+
+
+def forget_user(sender, instance, **kwargs):
+    """post_save receiver for the user model"""
+    evict_user(instance.pk)
@@ -0,0 +1,51 @@
+"""
+Password hashing for bulk user commands.
+
+PBKDF2 at Django's default iteration count takes a few hundred milliseconds per
+password, all of it CPU, so hashing thousands of passwords one after another
+takes minutes. `hash_passwords` spreads the work over a process pool (one
+worker per core by default) and returns the hashes in input order.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from django.contrib.auth.hashers import make_password
+
+
+def _init_worker(settings_module):
+    # Workers started with spawn (the default on Windows) begin without Django configured
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+
+def hash_passwords(passwords, workers=None, progress=None):
+    """
+    Hash `passwords` with make_password over `workers` processes (default: CPU count).
+    `progress(done, total)` is called as results come in, about every 5%.
+    """
+    passwords = list(passwords)
+    total = len(passwords)
+    if not total:
+        return []
+    workers = max(1, min(workers or os.cpu_count() or 1, total))
+    step = max(1, total // 20)
+
+    if workers == 1:
+        hashes = []
+        for password in passwords:
+            hashes.append(make_password(password))
+            if progress and (len(hashes) % step == 0 or len(hashes) == total):
+                progress(len(hashes), total)
+        return hashes
+
+    hashes = []
+    chunksize = max(1, total // (workers * 8))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(os.environ.get('DJANGO_SETTINGS_MODULE', 'lab_requisition.settings'),)) as pool:
+        for hashed in pool.map(make_password, passwords, chunksize=chunksize):
+            hashes.append(hashed)
+            if progress and (len(hashes) % step == 0 or len(hashes) == total):
+                progress(len(hashes), total)
+    return hashes
@@ -0,0 +1,56 @@
+import time
+from types import SimpleNamespace
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from rest_framework.throttling import UserRateThrottle
+from custom_auth.throttling import UserSlidingWindowThrottle
+
+
+class CountingCache:
+    """Cache wrapper counting the calls made through it"""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.calls = 0
+
+    def __getattr__(self, name):
+        method = getattr(self.cache, name)
+
+        def counted(*args, **kwargs):
+            self.calls += 1
+            return method(*args, **kwargs)
+        return counted
+
+
+class Command(BaseCommand):
+    help = "Compare the per-request cost of DRF's UserRateThrottle with UserSlidingWindowThrottle"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=20000, help='Requests to throttle per class')
+        parser.add_argument('--clients', type=int, default=20, help='Distinct users the requests come from')
+        parser.add_argument('--rate', default='2000/hour', help='Rate applied to both throttles')
+        parser.add_argument('--cache', default='default', help='Cache alias the throttles use')
+
+    def handle(self, *args, **options):
+        users = [SimpleNamespace(pk=f'bench-{n}-{time.time_ns()}', is_authenticated=True) for n in range(options['clients'])]
+        requests = [SimpleNamespace(user=user, META={}) for user in users]
+        self.stdout.write(f"{options['requests']} requests from {options['clients']} users at {options['rate']}, "
+                          f"cache '{options['cache']}' ({type(caches[options['cache']]).__name__})")
+
+        for throttle_class in (UserRateThrottle, UserSlidingWindowThrottle):
+            cache = CountingCache(caches[options['cache']])
+            allowed = 0
+            elapsed = 0
+            for n in range(options['requests']):
+                throttle = throttle_class()
+                throttle.cache = cache
+                throttle.rate = options['rate']
+                throttle.num_requests, throttle.duration = throttle.parse_rate(options['rate'])
+                request = requests[n % len(requests)]
+                start = time.perf_counter()
+                allowed += throttle.allow_request(request, None)
+                elapsed += time.perf_counter() - start
+            self.stdout.write(
+                f'{throttle_class.__name__:>26}: {elapsed / options["requests"] * 1e6:8.1f} us/request, '
+                f'{cache.calls / options["requests"]:.2f} cache calls/request, {allowed} allowed'
+            )
@@ -4,7 +4,10 @@ from django.core.management.base import BaseCommand
 from django.contrib.auth import get_user_model
 from django.utils.dateparse import parse_date
 from django.db import transaction
-from django.contrib.auth.hashers import make_password
+from custom_auth.authentication import evict_users
+from custom_auth.directory import invalidate_summary
+from custom_auth.hashing import hash_passwords
+from custom_auth.roles import apply_designation_roles
 
 User = get_user_model()
 
@@ -15,6 +18,11 @@ class Command(BaseCommand):
         parser.add_argument('csv_file', type=str, help='Path to the CSV file')
         parser.add_argument('--update-passwords', action='store_true', 
                             help='Update passwords for existing users instead of skipping them')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Processes used to hash passwords (default: number of CPUs)')
+        parser.add_argument('--batch-size', type=int, default=500, help='Users written per statement')
+        parser.add_argument('--skip-roles', action='store_true',
+                            help='Leave roles as imported instead of applying settings.DESIGNATION_ROLES')
 
     def handle(self, *args, **options):
         csv_file_path = options['csv_file']
@@ -34,109 +42,147 @@ class Command(BaseCommand):
         users_updated = 0
         errors = []
         users_to_create = []
+        users_to_update = []
+        # Plain passwords, in the same order as users_to_create + users_to_update
+        passwords_to_create = []
+        passwords_to_update = []
+        seen_usernames = set()
         
         try:
             with open(csv_file_path, mode='r', encoding='utf-8-sig') as file:
-                reader = csv.DictReader(file)
-                
-                for row in reader:
-                    try:
-                        # Extract data from CSV row
-                        reg_no = row.get('Reg_No', '').strip()
-                        name = row.get('Name', '').strip()
-                        department = row.get('Department', '').strip()
-                        designation = row.get('Designation', '').strip()
-                        year = row.get('Year', '').strip()
-                        location = row.get('Location', '').strip()
-                        dob = row.get('DOB', '').strip()
-                        phone_number = row.get('Phone No.', '').strip()
-                        password = row.get('Password', '').strip()
-                        username = row.get('Username', '').strip()
-                        
-                        # Skip if username is empty
-                        if not username:
-                            self.stdout.write(self.style.WARNING(f"Skipping row: Missing username"))
-                            users_skipped += 1
-                            continue
-                        
-                        # Process name field - split into first and last name
-                        name_parts = name.split()
-                        if len(name_parts) > 0:
-                            first_name = name_parts[0]
-                            last_name = ' '.join(name_parts[1:]) if len(name_parts) > 1 else ''
+                rows = list(csv.DictReader(file))
+            
+            # Look up every existing user in the file with one query
+            existing_users = User.objects.in_bulk(
+                {row.get('Username', '').strip() for row in rows} - {''}, field_name='username'
+            )
+            
+            for row in rows:
+                try:
+                    # Extract data from CSV row
+                    reg_no = row.get('Reg_No', '').strip()
+                    name = row.get('Name', '').strip()
+                    department = row.get('Department', '').strip()
+                    designation = row.get('Designation', '').strip()
+                    year = row.get('Year', '').strip()
+                    location = row.get('Location', '').strip()
+                    dob = row.get('DOB', '').strip()
+                    phone_number = row.get('Phone No.', '').strip()
+                    password = row.get('Password', '').strip()
+                    username = row.get('Username', '').strip()
+                    
+                    # Skip if username is empty
+                    if not username:
+                        self.stdout.write(self.style.WARNING(f"Skipping row: Missing username"))
+                        users_skipped += 1
+                        continue
+                    
+                    # Process name field - split into first and last name
+                    name_parts = name.split()
+                    if len(name_parts) > 0:
+                        first_name = name_parts[0]
+                        last_name = ' '.join(name_parts[1:]) if len(name_parts) > 1 else ''
+                    else:
+                        first_name = ''
+                        last_name = ''
+                    
+                    # Generate password if not provided
+                    if not password and first_name and last_name:
+                        # Use firstname.initialoflastname as password
+                        last_initial = last_name[0] if last_name else ''
+                        password = f"{first_name.lower()}.{last_initial.lower()}" if last_initial else first_name.lower()
+                    
+                    if username in seen_usernames:
+                        self.stdout.write(self.style.WARNING(f"User {username} appears more than once. Skipping the repeat."))
+                        users_skipped += 1
+                        continue
+                    seen_usernames.add(username)
+                    
+                    # Check if user already exists
+                    existing_user = existing_users.get(username)
+                    if existing_user:
+                        if update_passwords:
+                            # Hashed with the rest below and saved in bulk
+                            users_to_update.append(existing_user)
+                            passwords_to_update.append(password)
+                            users_updated += 1
                         else:
-                            first_name = ''
-                            last_name = ''
-                        
-                        # Generate password if not provided
-                        if not password and first_name and last_name:
-                            # Use firstname.initialoflastname as password
-                            last_initial = last_name[0] if last_name else ''
-                            password = f"{first_name.lower()}.{last_initial.lower()}" if last_initial else first_name.lower()
-                        
-                        # Check if user already exists
-                        existing_user = User.objects.filter(username=username).first()
-                        if existing_user:
-                            if update_passwords:
-                                # Update the password for existing user
-                                existing_user.password = make_password(password)
-                                existing_user.save(update_fields=['password'])
-                                users_updated += 1
-                                self.stdout.write(self.style.SUCCESS(f"Updated password for user: {username}"))
-                            else:
-                                self.stdout.write(self.style.WARNING(f"User {username} already exists. Skipping."))
-                                users_skipped += 1
-                            continue
-                        
-                        # Convert year to integer if possible
+                            self.stdout.write(self.style.WARNING(f"User {username} already exists. Skipping."))
+                            users_skipped += 1
+                        continue
+                    
+                    # Convert year to integer if possible
+                    try:
+                        year_int = int(year) if year else None
+                    except ValueError:
+                        year_int = None
+                    
+                    # Convert date string to date object
+                    parsed_dob = None
+                    if dob:
                         try:
-                            year_int = int(year) if year else None
+                            parsed_dob = parse_date(dob)
                         except ValueError:
-                            year_int = None
-                        
-                        # Convert date string to date object
-                        parsed_dob = None
-                        if dob:
-                            try:
-                                parsed_dob = parse_date(dob)
-                            except ValueError:
-                                self.stdout.write(self.style.WARNING(f"Invalid date format for {username}: {dob}"))
-                        
-                        # Create the user with hashed password
-                        user = User(
-                            username=username,
-                            first_name=first_name,
-                            last_name=last_name,
-                            email='',  # Email not provided in CSV
-                            reg_no=reg_no,
-                            department=department,
-                            designation=designation,
-                            year=year_int,
-                            location=location,
-                            dob=parsed_dob,
-                            phone_number=phone_number,
-                            role='staff',  # Default role, adjust as needed
-                            password=make_password(password)  # Use make_password instead of set_password
-                        )
-                        
-                        users_to_create.append(user)
-                        users_created += 1
-                        
-                    except Exception as e:
-                        error_msg = f"Error processing row for {row.get('Username', 'unknown')}: {str(e)}"
-                        self.stdout.write(self.style.ERROR(error_msg))
-                        errors.append(error_msg)
-                        continue
+                            self.stdout.write(self.style.WARNING(f"Invalid date format for {username}: {dob}"))
+                    
+                    # Create the user with hashed password
+                    user = User(
+                        username=username,
+                        first_name=first_name,
+                        last_name=last_name,
+                        email='',  # Email not provided in CSV
+                        reg_no=reg_no,
+                        department=department,
+                        designation=designation,
+                        year=year_int,
+                        location=location,
+                        dob=parsed_dob,
+                        phone_number=phone_number,
+                        role='staff',  # Default role, adjust as needed
+                    )
+                    
+                    users_to_create.append(user)
+                    passwords_to_create.append(password)
+                    users_created += 1
+                    
+                except Exception as e:
+                    error_msg = f"Error processing row for {row.get('Username', 'unknown')}: {str(e)}"
+                    self.stdout.write(self.style.ERROR(error_msg))
+                    errors.append(error_msg)
+                    continue
+        
+            # Hash every password in parallel; this is where nearly all the time goes
+            hashes = hash_passwords(
+                passwords_to_create + passwords_to_update,
+                workers=options['workers'],
+                progress=lambda done, total: self.stdout.write(f"Hashed {done}/{total} passwords"),
+            )
+            for user, hashed in zip(users_to_create + users_to_update, hashes):
+                user.password = hashed
             
-            # Use bulk_create to save all users at once
+            batch_size = options['batch_size']
             with transaction.atomic():
-                if users_to_create:
-                    # Create users in batches of 100 to avoid memory issues with large imports
-                    batch_size = 100
-                    for i in range(0, len(users_to_create), batch_size):
-                        batch = users_to_create[i:i+batch_size]
-                        User.objects.bulk_create(batch)
-                        self.stdout.write(self.style.SUCCESS(f"Created batch of {len(batch)} users"))
+                for i in range(0, len(users_to_create), batch_size):
+                    batch = users_to_create[i:i+batch_size]
+                    User.objects.bulk_create(batch)
+                    self.stdout.write(self.style.SUCCESS(f"Created batch of {len(batch)} users"))
+                if users_to_update:
+                    User.objects.bulk_update(users_to_update, ['password'], batch_size=batch_size)
+                    evict_users(user.pk for user in users_to_update)
+                    self.stdout.write(self.style.SUCCESS(f"Updated passwords for {len(users_to_update)} users"))
+                
+                # New users are created as staff; give them the role their designation maps to
+                if users_to_create and not options['skip_roles']:
+                    updated, unmapped = apply_designation_roles(
+                        users=User.objects.filter(username__in=[user.username for user in users_to_create])
+                    )
+                    self.stdout.write(self.style.SUCCESS(
+                        f"Assigned roles from designation to {sum(updated.values())} new users"
+                        + (f" ({sum(unmapped.values())} with unmapped designations kept 'staff')" if unmapped else "")
+                    ))
+            if users_to_create:
+                # bulk_create sends no post_save
+                invalidate_summary()
             
             # Print summary
             summary = f"Import completed. Users created: {users_created}, "
@@ -0,0 +1,48 @@
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+# Session engines that keep sessions in django_session
+DB_SESSION_ENGINES = ('django.contrib.sessions.backends.db', 'django.contrib.sessions.backends.cached_db')
+
+class Command(BaseCommand):
+    help = 'Delete expired sessions and the tokens of users who have not logged in recently'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--token-days', type=int, default=30,
+                            help='Delete tokens of users whose last login is older than N days')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows deleted per statement')
+        parser.add_argument('--pause', type=float, default=0.1, help='Seconds to wait between batches')
+
+    def handle(self, *args, **options):
+        if settings.SESSION_ENGINE in DB_SESSION_ENGINES:
+            sessions = self.prune(Session.objects.filter(expire_date__lt=timezone.now()), 'session_key', options)
+            self.stdout.write(self.style.SUCCESS(f'Deleted {sessions} expired sessions'))
+
+        cutoff = timezone.now() - timedelta(days=options['token_days'])
+        stale = Token.objects.filter(
+            Q(user__is_active=False)
+            | Q(user__last_login__lt=cutoff)
+            | Q(user__last_login__isnull=True, created__lt=cutoff)
+        )
+        tokens = self.prune(stale, 'key', options)
+        self.stdout.write(self.style.SUCCESS(f'Deleted {tokens} stale tokens (no login in {options["token_days"]} days)'))
+
+    def prune(self, queryset, key, options):
+        """Delete `queryset` a batch of primary keys at a time, so no statement holds locks for long"""
+        model = queryset.model
+        deleted = 0
+        while True:
+            keys = list(queryset.order_by(key).values_list(key, flat=True)[:options['batch_size']])
+            if not keys:
+                return deleted
+            # Token deletes send post_delete, which drops the key from the authentication cache
+            deleted += model.objects.filter(pk__in=keys).delete()[0]
+            if len(keys) < options['batch_size']:
+                return deleted
+            time.sleep(options['pause'])
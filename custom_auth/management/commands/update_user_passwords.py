@@ -2,8 +2,9 @@ import csv
 import os
 from django.core.management.base import BaseCommand
 from django.contrib.auth import get_user_model
-from django.contrib.auth.hashers import make_password
 from django.db import transaction
+from custom_auth.authentication import evict_users
+from custom_auth.hashing import hash_passwords
 
 User = get_user_model()
 
@@ -12,6 +13,9 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('csv_file', type=str, help='Path to the CSV file')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Processes used to hash passwords (default: number of CPUs)')
+        parser.add_argument('--batch-size', type=int, default=500, help='Users written per statement')
 
     def handle(self, *args, **options):
         csv_file_path = options['csv_file']
@@ -29,49 +33,71 @@ class Command(BaseCommand):
         
         try:
             with open(csv_file_path, mode='r', encoding='utf-8-sig') as file:
-                reader = csv.DictReader(file)
-                
-                with transaction.atomic():
-                    for row in reader:
-                        try:
-                            username = row.get('Username', '').strip()
-                            password = row.get('Password', '').strip()
-                            
-                            # Skip if username is empty
-                            if not username:
-                                self.stdout.write(self.style.WARNING("Skipping row: Missing username"))
-                                continue
-                            
-                            # Find the user
-                            try:
-                                user = User.objects.get(username=username)
-                            except User.DoesNotExist:
-                                self.stdout.write(self.style.WARNING(f"User {username} not found. Skipping."))
-                                users_not_found += 1
-                                continue
-                            
-                            # Generate password if not provided
-                            if not password:
-                                name_parts = user.get_full_name().split()
-                                if name_parts:
-                                    first_name = name_parts[0].lower()
-                                    last_initial = name_parts[-1][0].lower() if len(name_parts) > 1 else ''
-                                    password = f"{first_name}.{last_initial}" if last_initial else first_name
-                                else:
-                                    password = username  # Fallback to username
-                            
-                            # Update the password
-                            user.password = make_password(password)
-                            user.save(update_fields=['password'])
-                            
-                            users_updated += 1
-                            self.stdout.write(self.style.SUCCESS(f"Updated password for user: {username}"))
-                            
-                        except Exception as e:
-                            error_msg = f"Error updating password for {row.get('Username', 'unknown')}: {str(e)}"
-                            self.stdout.write(self.style.ERROR(error_msg))
-                            errors.append(error_msg)
-                            continue
+                rows = list(csv.DictReader(file))
+            
+            # Fetch every user named in the file with one query
+            users = User.objects.in_bulk(
+                {row.get('Username', '').strip() for row in rows} - {''}, field_name='username'
+            )
+            users_to_update = []
+            passwords = []
+            # username -> position in users_to_update
+            positions = {}
+            
+            for row in rows:
+                try:
+                    username = row.get('Username', '').strip()
+                    password = row.get('Password', '').strip()
+                    
+                    # Skip if username is empty
+                    if not username:
+                        self.stdout.write(self.style.WARNING("Skipping row: Missing username"))
+                        continue
+                    
+                    # Find the user
+                    user = users.get(username)
+                    if user is None:
+                        self.stdout.write(self.style.WARNING(f"User {username} not found. Skipping."))
+                        users_not_found += 1
+                        continue
+                    
+                    # Generate password if not provided
+                    if not password:
+                        name_parts = user.get_full_name().split()
+                        if name_parts:
+                            first_name = name_parts[0].lower()
+                            last_initial = name_parts[-1][0].lower() if len(name_parts) > 1 else ''
+                            password = f"{first_name}.{last_initial}" if last_initial else first_name
+                        else:
+                            password = username  # Fallback to username
+                    
+                    # A repeated username keeps the last password given for it
+                    if username in positions:
+                        passwords[positions[username]] = password
+                        continue
+                    positions[username] = len(users_to_update)
+                    users_to_update.append(user)
+                    passwords.append(password)
+                    
+                except Exception as e:
+                    error_msg = f"Error updating password for {row.get('Username', 'unknown')}: {str(e)}"
+                    self.stdout.write(self.style.ERROR(error_msg))
+                    errors.append(error_msg)
+                    continue
+            
+            # Hash in parallel, then write every password in bulk
+            hashes = hash_passwords(
+                passwords,
+                workers=options['workers'],
+                progress=lambda done, total: self.stdout.write(f"Hashed {done}/{total} passwords"),
+            )
+            for user, hashed in zip(users_to_update, hashes):
+                user.password = hashed
+            with transaction.atomic():
+                User.objects.bulk_update(users_to_update, ['password'], batch_size=options['batch_size'])
+            # Cached users still hold the old password hash, which keeps their sessions valid
+            evict_users(user.pk for user in users_to_update)
+            users_updated = len(users_to_update)
             
             # Print summary
             self.stdout.write(self.style.SUCCESS(f"Password update completed. Users updated: {users_updated}, "
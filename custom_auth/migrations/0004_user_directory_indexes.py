@@ -0,0 +1,50 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:15
+
+from django.db import migrations, models
+
+# (index name, indexed expression) on custom_auth_customuser
+# The UPPER(col::text) expressions match what Django emits for icontains on
+# PostgreSQL, so the directory's `q` search can use them.
+TRIGRAM_INDEXES = [
+    ('custom_auth_username_upper_trgm', 'UPPER(username::text)'),
+    ('custom_auth_first_name_upper_trgm', 'UPPER(first_name::text)'),
+    ('custom_auth_last_name_upper_trgm', 'UPPER(last_name::text)'),
+    ('custom_auth_reg_no_upper_trgm', 'UPPER(reg_no::text)'),
+    ('custom_auth_department_upper_trgm', 'UPPER(department::text)'),
+]
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, expression in TRIGRAM_INDEXES:
+        # CONCURRENTLY keeps the users table writable while the index builds
+        schema_editor.execute(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON custom_auth_customuser USING gin ({expression} gin_trgm_ops)'
+        )
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _ in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('custom_auth', '0003_customuser_department_customuser_dob_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(fields=['role', 'username'], name='custom_auth_role_username_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(fields=['department', 'username'], name='custom_auth_dept_username_idx'),
+        ),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
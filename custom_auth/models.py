@@ -19,6 +19,13 @@ class CustomUser(AbstractUser):
     year = models.PositiveIntegerField(blank=True, null=True)
     location = models.CharField(max_length=100, blank=True, null=True)
     dob = models.DateField(blank=True, null=True, verbose_name="Date of Birth")
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Serve the directory's role / department filters in username order
+            models.Index(fields=['role', 'username'], name='custom_auth_role_username_idx'),
+            models.Index(fields=['department', 'username'], name='custom_auth_dept_username_idx'),
+        ]
     
     @property
     def name(self):
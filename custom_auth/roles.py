@@ -0,0 +1,85 @@
+"""
+What each role may do, and the designation -> role mapping applied to users in bulk.
+
+ROLE_PRIVILEGE is the one place that ties roles to LabTest.privilege;
+`privilege_for` reads it for anything that filters tests by who is ordering.
+
+The mapping is data: settings.DESIGNATION_ROLES by default, or any dict passed
+in (e.g. loaded from a JSON file). The whole mapping is applied with a single
+UPDATE ... SET role = CASE ... touching only the users whose role actually
+differs, so the work is one statement whatever the number of users or
+designations.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Case, CharField, Count, F, Value, When
+from django.db.models.functions import Trim
+from django.db.models.lookups import Exact
+from .authentication import evict_users
+from .directory import invalidate_summary
+
+# Highest LabTest.privilege each role may order; superusers and unknown roles are handled in privilege_for
+ROLE_PRIVILEGE = {
+    'intern': 1,
+    'postgraduate': 2,
+    'staff': 3,
+    'labtech': 3,
+}
+
+
+def privilege_for(user):
+    """Highest test privilege `user` may order"""
+    if user.is_superuser:
+        return max(ROLE_PRIVILEGE.values())
+    return ROLE_PRIVILEGE.get(getattr(user, 'role', None), 1)
+
+
+def designation_roles():
+    """settings.DESIGNATION_ROLES; without it no designation maps to a role"""
+    return getattr(settings, 'DESIGNATION_ROLES', {})
+
+
+def validate_mapping(mapping):
+    """Raise ValueError if `mapping` assigns a role the user model doesn't have"""
+    User = get_user_model()
+    roles = dict(User._meta.get_field('role').choices)
+    invalid = {designation: role for designation, role in mapping.items() if role not in roles}
+    if invalid:
+        raise ValueError(f"Unknown roles in designation mapping: {invalid}. Valid roles: {', '.join(roles)}")
+
+
+def apply_designation_roles(mapping=None, users=None):
+    """
+    Set each user's role from their (whitespace-trimmed) designation.
+    Returns (updated per designation, user count per unmapped designation).
+    """
+    User = get_user_model()
+    mapping = designation_roles() if mapping is None else mapping
+    validate_mapping(mapping)
+    users = User.objects.all() if users is None else users
+    users = users.exclude(designation__isnull=True).exclude(designation='')
+
+    updated = dict.fromkeys(mapping, 0)
+    if mapping:
+        new_role = Case(
+            *(When(Exact(Trim('designation'), designation), then=Value(role)) for designation, role in mapping.items()),
+            output_field=CharField(),
+        )
+        changing = users.alias(new_role=new_role).filter(new_role__isnull=False).exclude(role=F('new_role'))
+        with transaction.atomic():
+            # The rows about to change, for the per-designation counts and the cache eviction
+            changed = list(changing.select_for_update().annotate(trimmed=Trim('designation')).values_list('pk', 'trimmed'))
+            if changed:
+                changing.update(role=new_role)
+        for _, designation in changed:
+            updated[designation] += 1
+        if changed:
+            # update() sends no post_save; drop the cached users that carry the old role
+            evict_users(pk for pk, _ in changed)
+            invalidate_summary()
+    unmapped = users.annotate(trimmed=Trim('designation'))
+    if mapping:
+        unmapped = unmapped.exclude(trimmed__in=list(mapping))
+    unmapped = dict(unmapped.values_list('trimmed').annotate(count=Count('id')).order_by('trimmed'))
+    return updated, unmapped
@@ -0,0 +1,330 @@
+import os
+import runpy
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from types import SimpleNamespace
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from apps.orders.models import LabTest
+from custom_auth.roles import apply_designation_roles
+from custom_auth.throttling import UserSlidingWindowThrottle
+
+User = get_user_model()
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class UserCsvCommandTests(TestCase):
+    header = 'Reg_No,Name,Department,Designation,Year,Location,DOB,Phone No.,Password,Username\n'
+
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.existing = User.objects.create_user(username='rao', password='old', first_name='Ravi', last_name='Rao', role='staff')
+
+    def write_csv(self, lines):
+        path = Path(self.tmpdir.name) / 'users.csv'
+        path.write_text(self.header + ''.join(line + '\n' for line in lines))
+        return str(path)
+
+    def run_command(self, name, lines, *args):
+        out = StringIO()
+        call_command(name, self.write_csv(lines), *args, stdout=out)
+        return out.getvalue()
+
+    def test_import_creates_users_over_worker_processes(self):
+        output = self.run_command('import_users', [
+            'R1,Anita Shenoy,Medicine,PG,2,Ward 3,1990-04-01,999,secret1,anita',
+            'R2,Kiran Pai,Surgery,Intern,1,Ward 5,,,,kiran',
+            'R3,Ravi Rao,Medicine,Faculty,,,,,new,rao',
+        ], '--workers', '2')
+        self.assertIn('Users created: 2, Users skipped: 1, Errors: 0', output)
+        anita = User.objects.get(username='anita')
+        self.assertTrue(anita.check_password('secret1'))
+        self.assertEqual((anita.role, anita.department, anita.year), ('postgraduate', 'Medicine', 2))
+        # No password in the file: first name and last initial
+        self.assertTrue(User.objects.get(username='kiran').check_password('kiran.p'))
+        # Existing users are left alone without --update-passwords
+        self.existing.refresh_from_db()
+        self.assertTrue(self.existing.check_password('old'))
+
+    def test_import_updates_existing_users_in_one_process(self):
+        output = self.run_command('import_users', [
+            'R3,Ravi Rao,Medicine,Faculty,,,,,new,rao',
+            'R3,Ravi Rao,Medicine,Faculty,,,,,newer,rao',
+        ], '--update-passwords', '--workers', '1')
+        self.assertIn('Users created: 0, Users updated: 1, Users skipped: 1', output)
+        self.assertEqual(User.objects.filter(username='rao').count(), 1)
+        self.existing.refresh_from_db()
+        self.assertTrue(self.existing.check_password('new'))
+
+    def test_update_user_passwords(self):
+        User.objects.create_user(username='anita', password='old', first_name='Anita', last_name='Shenoy')
+        lines = [',,,,,,,,first,rao', ',,,,,,,,,anita', ',,,,,,,,x,nobody', ',,,,,,,,second,rao']
+        for workers in ('1', '2'):
+            output = self.run_command('update_user_passwords', lines, '--workers', workers)
+            self.assertIn('Users updated: 2, Users not found: 1, Errors: 0', output)
+            # A repeated username keeps its last password; a blank one is generated from the name
+            self.assertTrue(User.objects.get(username='rao').check_password('second'))
+            self.assertTrue(User.objects.get(username='anita').check_password('anita.s'))
+        self.assertEqual(User.objects.count(), 2)
+
+
+class DesignationRoleTests(TestCase):
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        for username, designation, role in [('pg', ' PG ', 'staff'), ('intern', 'Intern', 'intern'),
+                                            ('faculty', 'Faculty', 'intern'), ('nurse', 'Nurse', 'staff'),
+                                            ('lower', 'pg', 'staff'), ('none', '', 'staff')]:
+            User.objects.create(username=username, designation=designation, role=role)
+
+    def roles(self):
+        return dict(User.objects.values_list('username', 'role'))
+
+    def test_one_update_for_the_whole_mapping(self):
+        # The rows to change, then one UPDATE, inside a savepoint; then the unmapped designations
+        with self.assertNumQueries(5):
+            updated, unmapped = apply_designation_roles()
+        self.assertEqual(updated, {'Faculty': 1, 'PG': 1, 'Intern': 0})
+        # Designations are trimmed but matched case-sensitively
+        self.assertEqual(unmapped, {'Nurse': 1, 'pg': 1})
+        self.assertEqual(self.roles(), {'pg': 'postgraduate', 'intern': 'intern', 'faculty': 'staff',
+                                        'nurse': 'staff', 'lower': 'staff', 'none': 'staff'})
+        # Nothing left to change: no UPDATE at all
+        with self.assertNumQueries(4):
+            self.assertEqual(apply_designation_roles()[0], {'Faculty': 0, 'PG': 0, 'Intern': 0})
+
+    def write_mapping(self, text):
+        path = Path(self.tmpdir.name) / 'mapping.json'
+        path.write_text(text)
+        return str(path)
+
+    def test_command_mapping_file(self):
+        out = StringIO()
+        call_command('update_roles_from_designation', '--mapping', self.write_mapping('{"Nurse": "labtech", "pg": "postgraduate"}'), stdout=out)
+        self.assertIn('2 users updated', out.getvalue())
+        self.assertEqual(self.roles()['nurse'], 'labtech')
+        self.assertEqual(self.roles()['lower'], 'postgraduate')
+
+        for text, message in [('{"Nurse": ', 'Could not read mapping file'), ('["labtech"]', 'must contain a JSON object'),
+                              ('{"Nurse": "matron"}', 'Unknown roles in designation mapping')]:
+            with self.assertRaisesMessage(CommandError, message):
+                call_command('update_roles_from_designation', '--mapping', self.write_mapping(text), stdout=StringIO())
+        self.assertEqual(self.roles()['nurse'], 'labtech')
+
+
+class CachedAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='doc', password='secret', role='postgraduate')
+        self.token = Token.objects.create(user=self.user)
+        LabTest.objects.create(name='Glucose (Fasting)')
+
+    def suggest(self):
+        # Session authentication comes first and sends no WWW-Authenticate, so failures are 403s
+        return self.client.get('/api/orders/tests/suggest/', {'q': 'glu'})
+
+    def test_known_token_needs_no_queries(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.assertEqual(self.suggest().status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.suggest().status_code, status.HTTP_200_OK)
+
+    def test_known_session_needs_no_user_query(self):
+        self.client.login(username='doc', password='secret')
+        self.suggest()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.suggest().status_code, status.HTTP_200_OK)
+        self.assertFalse([query for query in queries if 'custom_auth_customuser' in query['sql']])
+
+    def test_password_change_and_logout_revoke_cached_token(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.suggest()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/auth/change-password/', {'old_password': 'secret', 'new_password': 'n3w-Secret'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.suggest().status_code, status.HTTP_403_FORBIDDEN)
+
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.suggest()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/auth/logout/')
+        self.assertFalse(Token.objects.filter(key=token.key).exists())
+        self.assertEqual(self.suggest().status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_session_logout_keeps_the_token(self):
+        # Logging out of the browser session doesn't sign out clients using the token
+        session = APIClient()
+        session.login(username='doc', password='secret')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(session.post('/api/auth/logout/').status_code, status.HTTP_200_OK)
+        self.assertTrue(Token.objects.filter(key=self.token.key).exists())
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.assertEqual(self.suggest().status_code, status.HTTP_200_OK)
+        self.assertEqual(session.get('/api/orders/tests/suggest/', {'q': 'glu'}).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_deactivation_revokes_cached_user(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.suggest()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+            # Kept until the deactivation commits, so no other request can cache the old row again
+            self.assertIsNotNone(cache.get(f'auth:user:{self.user.pk}'))
+        self.assertEqual(self.suggest().status_code, status.HTTP_403_FORBIDDEN)
+
+
+class PruneAuthTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        for i in range(5):
+            Session.objects.create(session_key=f'expired{i}', session_data='', expire_date=now - timedelta(hours=i + 1))
+        for i in range(2):
+            Session.objects.create(session_key=f'live{i}', session_data='', expire_date=now + timedelta(hours=1))
+
+        self.kept = set()
+        for username, last_login, active, token_age, kept in [
+            ('recent', now - timedelta(days=1), True, 90, True),
+            ('new', None, True, 1, True),
+            ('away', now - timedelta(days=31), True, 90, False),
+            ('never', None, True, 31, False),
+            ('inactive', now, False, 1, False),
+        ]:
+            user = User.objects.create_user(username=username, last_login=last_login, is_active=active)
+            token = Token.objects.create(user=user)
+            Token.objects.filter(pk=token.pk).update(created=now - timedelta(days=token_age))
+            if kept:
+                self.kept.add(token.key)
+
+    def prune(self):
+        out = StringIO()
+        call_command('prune_auth', '--batch-size', '2', '--pause', '0', stdout=out)
+        return out.getvalue()
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cached_db')
+    def test_deletes_only_expired_sessions_and_stale_tokens(self):
+        output = self.prune()
+        self.assertIn('Deleted 5 expired sessions', output)
+        self.assertIn('Deleted 3 stale tokens', output)
+        self.assertEqual(set(Session.objects.values_list('session_key', flat=True)), {'live0', 'live1'})
+        self.assertEqual(set(Token.objects.values_list('key', flat=True)), self.kept)
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies')
+    def test_leaves_the_session_table_alone_without_a_database_engine(self):
+        self.assertNotIn('sessions', self.prune())
+        self.assertEqual(Session.objects.count(), 7)
+
+
+class SessionBackendSettingTests(SimpleTestCase):
+    def load_settings(self, **environ):
+        with mock.patch.dict(os.environ, environ):
+            return runpy.run_module('lab_requisition.settings_prod')
+
+    def test_session_backend_from_environment(self):
+        with mock.patch.dict(os.environ):
+            os.environ.pop('SESSION_BACKEND', None)
+            self.assertEqual(runpy.run_module('lab_requisition.settings_prod')['SESSION_ENGINE'],
+                             'django.contrib.sessions.backends.cached_db')
+        self.assertEqual(self.load_settings(SESSION_BACKEND='signed_cookies')['SESSION_ENGINE'],
+                         'django.contrib.sessions.backends.signed_cookies')
+        with self.assertRaises(ImproperlyConfigured):
+            self.load_settings(SESSION_BACKEND='file')
+
+
+class UserDirectoryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.tech = User.objects.create_user(username='tech', password='secret', role='labtech', department='Lab')
+        self.client.force_authenticate(self.tech)
+        User.objects.bulk_create([
+            User(username=f'user{i:02d}', first_name='Ravi' if i % 2 else 'Anita', last_name='Kumar',
+                 role='intern' if i % 3 else 'staff', department='Medicine' if i < 6 else 'Surgery', reg_no=f'R{i}')
+            for i in range(12)
+        ])
+
+    def walk(self, url, params):
+        usernames = []
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            usernames += [user['username'] for user in response.data['results']]
+            if not response.data['next']:
+                return usernames
+            response = self.client.get(response.data['next'])
+
+    def test_pages_through_every_user_once_in_one_query_each(self):
+        with self.assertNumQueries(1):
+            self.client.get('/api/auth/all-users/', {'page_size': 5})
+        usernames = self.walk('/api/auth/all-users/', {'page_size': 5})
+        self.assertEqual(usernames, sorted(User.objects.values_list('username', flat=True)))
+        self.assertEqual(len(self.walk('/api/auth/users/', {'page_size': 4})), 13)
+
+    def test_search_and_filters(self):
+        self.assertEqual(self.walk('/api/auth/users/', {'q': 'ravi kumar', 'department': 'Surgery'}),
+                         ['user07', 'user09', 'user11'])
+        self.assertEqual(self.walk('/api/auth/all-users/', {'q': 'r10'}), ['user10'])
+        self.assertEqual(self.walk('/api/auth/users/', {'role': 'staff'}), ['user00', 'user03', 'user06', 'user09'])
+
+    def test_summary_is_cached_until_a_user_changes(self):
+        response = self.client.get('/api/auth/users/summary/')
+        self.assertEqual(response.data['total'], 13)
+        self.assertEqual(response.data['roles'], [
+            {'role': 'intern', 'count': 8}, {'role': 'labtech', 'count': 1}, {'role': 'staff', 'count': 4},
+        ])
+        with self.assertNumQueries(0):
+            self.client.get('/api/auth/users/summary/')
+        user = User.objects.get(username='user01')
+        user.is_active = False
+        user.save()
+        self.assertEqual(self.client.get('/api/auth/users/summary/').data['total'], 12)
+
+
+class SlidingWindowThrottleTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.now = 1_000_000 * 60
+        self.request = SimpleNamespace(user=SimpleNamespace(pk=7, is_authenticated=True), META={})
+
+    def allow(self):
+        throttle = UserSlidingWindowThrottle()
+        throttle.timer = lambda: self.now
+        throttle.num_requests, throttle.duration = throttle.parse_rate('10/min')
+        throttle.rate = '10/min'
+        return throttle, throttle.allow_request(self.request, None)
+
+    def test_limits_within_a_window_in_one_cache_call(self):
+        with mock.patch.object(cache, 'incr', wraps=cache.incr) as incr, mock.patch.object(cache, 'get', wraps=cache.get) as get:
+            self.assertEqual([self.allow()[1] for _ in range(10)], [True] * 10)
+        # At most one get of the previous window for the whole window, one incr per request otherwise
+        self.assertLessEqual(get.call_count, 1)
+        self.assertEqual(incr.call_count, 10)
+        throttle, allowed = self.allow()
+        self.assertFalse(allowed)
+        self.assertEqual(cache.get(throttle.window_key(int(self.now // 60))), 10)
+        self.assertAlmostEqual(throttle.wait(), 60 + 6)
+
+    def test_previous_window_decays(self):
+        for _ in range(10):
+            self.allow()
+        # A quarter into the next window, 7.5 of the previous 10 still count
+        self.now += 75
+        self.assertEqual([self.allow()[1] for _ in range(3)], [True, True, False])
+        throttle, _ = self.allow()
+        # 10 * (1 - 0.3) + 2 leaves room for one more 30% into the window
+        self.assertAlmostEqual(throttle.wait(), 3)
@@ -0,0 +1,100 @@
+"""
+Rate throttles that cost one cache round trip per request.
+
+DRF's SimpleRateThrottle keeps a list of every request timestamp in the window.
+It reads the whole list and writes it back on each request, so one call costs
+O(requests in the window), and the get-then-set loses updates when several
+workers share a cache. These throttles keep one integer per client per window
+instead, and estimate a sliding window from it (the approach nginx and
+Cloudflare use):
+
+    estimate = previous window count * (share of the window still to come) + current count
+
+The current window is counted with the cache's atomic incr(). The previous
+window's count can no longer change much once its window is over, so each
+process reads it once per window and keeps it in memory. In the steady state
+a request therefore costs a single incr. Rejected requests are taken back
+out of the count with decr(), so a client hammering a throttled endpoint
+recovers on the same schedule as with DRF's throttles.
+
+They read the same scopes and DEFAULT_THROTTLE_RATES, so they drop in for
+AnonRateThrottle / UserRateThrottle.
+"""
+import threading
+from rest_framework.throttling import AnonRateThrottle, UserRateThrottle
+
+# Previous-window counts kept per process; emptied when it grows past this
+MAX_REMEMBERED_WINDOWS = 10000
+
+_previous_counts = {}
+_previous_lock = threading.Lock()
+
+
+class SlidingWindowThrottleMixin:
+    """allow_request / wait for SimpleRateThrottle subclasses, using window counters instead of histories"""
+
+    def window_key(self, window):
+        return f'{self.key}:{window}'
+
+    def count_request(self, key):
+        """Atomically add this request to the counter at `key`, creating it if needed"""
+        try:
+            return self.cache.incr(key)
+        except ValueError:
+            # Kept for two windows so it can still be read as the previous window
+            if self.cache.add(key, 1, self.duration * 2):
+                return 1
+            return self.cache.incr(key)
+
+    def previous_count(self, window):
+        key = self.window_key(window - 1)
+        count = _previous_counts.get(key)
+        if count is None:
+            count = self.cache.get(key, 0)
+            with _previous_lock:
+                if len(_previous_counts) >= MAX_REMEMBERED_WINDOWS:
+                    _previous_counts.clear()
+                _previous_counts[key] = count
+        return count
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        self.now = self.timer()
+        window, offset = divmod(self.now, self.duration)
+        self.elapsed = offset / self.duration
+        self.current = self.count_request(self.window_key(int(window)))
+        self.previous = self.previous_count(int(window))
+        if self.previous * (1 - self.elapsed) + self.current > self.num_requests:
+            self.cache.decr(self.window_key(int(window)))
+            self.current -= 1
+            return self.throttle_failure()
+        return self.throttle_success()
+
+    def throttle_success(self):
+        return True
+
+    def wait(self):
+        """Seconds until the estimate leaves room for one more request"""
+        remaining = (1 - self.elapsed) * self.duration
+        room = self.num_requests - 1 - self.current
+        if room < 0:
+            # This window alone is full: wait for the next one, then until this count has decayed enough
+            return remaining + max(0, 1 - (self.num_requests - 1) / max(self.current, 1)) * self.duration
+        if not self.previous:
+            return 0
+        # Wait until previous * (1 - elapsed) has decayed to `room`
+        needed = 1 - room / self.previous
+        return max(0, (needed - self.elapsed) * self.duration)
+
+
+class AnonSlidingWindowThrottle(SlidingWindowThrottleMixin, AnonRateThrottle):
+    pass
+
+
+class UserSlidingWindowThrottle(SlidingWindowThrottleMixin, UserRateThrottle):
+    pass
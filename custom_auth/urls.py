@@ -5,7 +5,7 @@ from .views import (
     admin_reset_password, request_password_reset,
     confirm_password_reset, change_password,
     direct_reset_password, get_user_details_view,
-    list_all_users
+    list_all_users, user_summary_view
 )
 
 urlpatterns = [
@@ -13,6 +13,7 @@ urlpatterns = [
     path('logout/', logout_view, name='logout'),
     path('user/', user_view, name='user'),
     path('users/', UserListCreateView.as_view(), name='user-list-create'),
+    path('users/summary/', user_summary_view, name='user-summary'),
     path('users/<int:pk>/', UserRetrieveUpdateDestroyView.as_view(), name='user-retrieve-update-destroy'),
     path('reset-password/', admin_reset_password, name='admin-reset-password'),
     path('request-password-reset/', request_password_reset, name='request-password-reset'),
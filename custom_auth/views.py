@@ -9,6 +9,8 @@ from rest_framework import generics
 from django.contrib.auth import get_user_model
 from .serializers import CustomUserSerializer, UserDetailsSerializer
 from rest_framework.authtoken.models import Token
+from .authentication import revoke_token, revoke_tokens
+from .directory import UserDirectoryPagination, filter_users, user_summary
 from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from django.contrib.auth.hashers import make_password
 from django.contrib.auth.tokens import default_token_generator
@@ -22,6 +24,10 @@ CustomUser = get_user_model()
 class UserListCreateView(generics.ListCreateAPIView):
     queryset = CustomUser.objects.all()
     serializer_class = CustomUserSerializer
+    pagination_class = UserDirectoryPagination
+
+    def get_queryset(self):
+        return filter_users(super().get_queryset(), self.request.query_params)
 
 class UserRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
     queryset = CustomUser.objects.all()
@@ -48,6 +54,10 @@ def login_view(request):
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def logout_view(request):
+    # Only the credentials this request came with; password changes and deactivation revoke them all
+    key = getattr(request.auth, 'key', request.auth)
+    if isinstance(key, str):
+        revoke_token(key)
     logout(request)
     return Response({'message': 'Logout successful'}, status=status.HTTP_200_OK)
 
@@ -81,7 +91,7 @@ def admin_reset_password(request):
         user.save()
         
         # Invalidate any existing tokens for the user
-        Token.objects.filter(user=user).delete()
+        revoke_tokens(user)
         
         return Response(
             {'message': f'Password reset successful for user {username}'},
@@ -172,7 +182,7 @@ def confirm_password_reset(request, uidb64, token):
             user.save()
             
             # Invalidate existing tokens
-            Token.objects.filter(user=user).delete()
+            revoke_tokens(user)
             
             return Response(
                 {'message': 'Password reset successful. You can now login with your new password.'},
@@ -223,7 +233,7 @@ def change_password(request):
     user.save()
     
     # Invalidate existing tokens
-    Token.objects.filter(user=user).delete()
+    revoke_tokens(user)
     
     return Response(
         {'message': 'Password changed successfully. Please login with your new password.'},
@@ -259,7 +269,7 @@ def direct_reset_password(request):
         user.save()
         
         # Invalidate any existing tokens for the user
-        Token.objects.filter(user=user).delete()
+        revoke_tokens(user)
         
         return Response(
             {'message': 'Password has been reset successfully. Please login with your new password.'},
@@ -303,7 +313,7 @@ def get_user_details_view(request, user_id=None):
 @permission_classes([IsAuthenticated])
 def list_all_users(request):
     """
-    Get a list of all users with their details
+    Get a page of users with their details, filtered by q, role, department and is_active
     Accessible by admins and lab technicians
     """
     # Check if user is admin or lab technician
@@ -313,6 +323,22 @@ def list_all_users(request):
             status=status.HTTP_403_FORBIDDEN
         )
     
-    users = CustomUser.objects.all()
-    serializer = UserDetailsSerializer(users, many=True)
-    return Response(serializer.data)
\ No newline at end of file
+    users = filter_users(CustomUser.objects.all(), request.query_params)
+    paginator = UserDirectoryPagination()
+    page = paginator.paginate_queryset(users, request)
+    serializer = UserDetailsSerializer(page, many=True)
+    return paginator.get_paginated_response(serializer.data)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def user_summary_view(request):
+    """
+    Active user counts per role and per department, for the user picker filters
+    Accessible by admins and lab technicians
+    """
+    if not (request.user.is_staff or request.user.role == 'labtech'):
+        return Response(
+            {'error': 'You do not have permission to view all users'},
+            status=status.HTTP_403_FORBIDDEN
+        )
+    return Response(user_summary())
\ No newline at end of file
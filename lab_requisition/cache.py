@@ -0,0 +1,359 @@
+"""
+Cache backends for running several worker processes on one machine.
+
+LocMemCache gives each waitress/gunicorn worker its own cache, so a token
+revoked in one worker stays cached in the others and every throttle counter is
+per process. These two backends share one cache between the workers instead:
+
+SQLiteCache
+    One SQLite file (WAL mode) shared by every process on the box. incr() is
+    atomic across processes, add() treats expired rows as absent, and the table
+    is culled back under MAX_ENTRIES as it grows.
+
+TieredCache
+    An in-process LRU (L1), bounded by the pickled size of its values
+    (MAX_BYTES), in front of another cache alias (L2, e.g. a SQLiteCache).
+    Reads are served from L1 when possible, for at most L1_TIMEOUT seconds and
+    never past the entry's own expiry in L2. Writes go to L2 and the local L1.
+    Other workers learn about deletes through an invalidation log kept in L2:
+    delete(), delete_many() and incr() advance a counter and record each key
+    they touched under its position. Every worker reads the counter at most
+    every SYNC_INTERVAL seconds and, when it moved, drops just the logged keys
+    from its L1. So an invalidation reaches every worker within SYNC_INTERVAL
+    without costing them the rest of their L1. Only a worker that fell more than
+    MAX_INVALIDATIONS entries behind, or finds part of the log gone (after
+    clear(), or once INVALIDATION_TIMEOUT has passed), empties its L1 instead.
+    A set() that overwrites a value isn't logged; L1_TIMEOUT bounds how long
+    other workers may serve the previous value, so code that must invalidate
+    everywhere deletes. Keys starting with one of L2_ONLY_PREFIXES (throttle
+    histories, sessions) skip L1 altogether.
+"""
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+DEFAULT_L1_TIMEOUT = 30
+DEFAULT_SYNC_INTERVAL = 1
+DEFAULT_L2_ONLY_PREFIXES = ('throttle_', 'django.contrib.sessions')
+GENERATION_KEY = 'tiered-cache:generation'
+# Log entry n holds the key of the n-th invalidation
+INVALIDATED_KEY = 'tiered-cache:invalidated:%d'
+# A worker further behind than this empties its L1 rather than reading the log
+MAX_INVALIDATIONS = 1000
+INVALIDATION_TIMEOUT = 300
+
+
+class SQLiteCache(BaseCache):
+    """Cache in a SQLite file, safe to share between processes. LOCATION is the file path"""
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._path = location
+        self._local = threading.local()
+        self._sets = 0
+
+    @property
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            Path(self._path).parent.mkdir(parents=True, exist_ok=True)
+            # Autocommit: each statement is its own short transaction
+            db = sqlite3.connect(self._path, timeout=5, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, expires REAL)')
+            db.execute('CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)')
+            self._local.db = db
+        return db
+
+    def _expiry(self, timeout):
+        expires = self.get_backend_timeout(timeout)
+        # None means never; store it as far in the future so expiry comparisons stay simple
+        return float('inf') if expires is None else expires
+
+    @staticmethod
+    def _dump(value):
+        # Integers are stored as SQLite integers so incr() can add to them in place
+        if isinstance(value, int) and not isinstance(value, bool):
+            return value
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def _load(value):
+        return value if isinstance(value, int) else pickle.loads(value)
+
+    def get(self, key, default=None, version=None):
+        return self.get_with_expiry(key, default, version)[0]
+
+    def get_with_expiry(self, key, default=None, version=None):
+        """(value, Unix time it expires at or None for never), or (default, None) if it isn't there"""
+        key = self.make_and_validate_key(key, version=version)
+        row = self._db.execute('SELECT value, expires FROM cache WHERE key = ? AND expires > ?', (key, time.time())).fetchone()
+        if row is None:
+            return default, None
+        return self._load(row[0]), None if row[1] == float('inf') else row[1]
+
+    def get_many(self, keys, version=None):
+        made = {self.make_and_validate_key(key, version=version): key for key in keys}
+        if not made:
+            return {}
+        placeholders = ','.join('?' * len(made))
+        rows = self._db.execute(
+            f'SELECT key, value FROM cache WHERE key IN ({placeholders}) AND expires > ?', (*made, time.time())
+        )
+        return {made[key]: self._load(value) for key, value in rows}
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        self._db.execute('INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)',
+                         (key, self._dump(value), self._expiry(timeout)))
+        self._maybe_cull()
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        # An expired row counts as absent, so it may be overwritten
+        cursor = self._db.execute(
+            'INSERT INTO cache (key, value, expires) VALUES (?, ?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires = excluded.expires WHERE expires <= ?',
+            (key, self._dump(value), self._expiry(timeout), time.time())
+        )
+        self._maybe_cull()
+        return cursor.rowcount > 0
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        cursor = self._db.execute('UPDATE cache SET expires = ? WHERE key = ? AND expires > ?',
+                                  (self._expiry(timeout), key, time.time()))
+        return cursor.rowcount > 0
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        db = self._db
+        # BEGIN IMMEDIATE takes the write lock up front, so no other process can slip in between
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            row = db.execute('SELECT value FROM cache WHERE key = ? AND expires > ?', (key, time.time())).fetchone()
+            if row is None:
+                raise ValueError("Key '%s' not found" % key)
+            value = self._load(row[0]) + delta
+            db.execute('UPDATE cache SET value = ? WHERE key = ?', (self._dump(value), key))
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+        return value
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return self._db.execute('DELETE FROM cache WHERE key = ?', (key,)).rowcount > 0
+
+    def delete_many(self, keys, version=None):
+        keys = [self.make_and_validate_key(key, version=version) for key in keys]
+        if keys:
+            self._db.execute(f'DELETE FROM cache WHERE key IN ({",".join("?" * len(keys))})', keys)
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return self._db.execute('SELECT 1 FROM cache WHERE key = ? AND expires > ?', (key, time.time())).fetchone() is not None
+
+    def clear(self):
+        self._db.execute('DELETE FROM cache')
+
+    def _maybe_cull(self):
+        # Checking the size on every write would cost a COUNT each time; every 100th is plenty
+        self._sets += 1
+        if self._sets % 100:
+            return
+        db = self._db
+        db.execute('DELETE FROM cache WHERE expires <= ?', (time.time(),))
+        count = db.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        if count > self._max_entries:
+            # Drop the entries closest to expiring, like the other backends' cull
+            db.execute('DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY expires LIMIT ?)',
+                       (max(count // self._cull_frequency, count - self._max_entries),))
+
+
+class TieredCache(BaseCache):
+    """In-process LRU in front of a shared cache alias; see the module docstring"""
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._l2_alias = options.get('L2', 'shared')
+        self._max_bytes = options.get('MAX_BYTES', DEFAULT_MAX_BYTES)
+        self._l1_timeout = options.get('L1_TIMEOUT', DEFAULT_L1_TIMEOUT)
+        self._sync_interval = options.get('SYNC_INTERVAL', DEFAULT_SYNC_INTERVAL)
+        self._l2_only = tuple(options.get('L2_ONLY_PREFIXES', DEFAULT_L2_ONLY_PREFIXES))
+        # key -> (pickled value, expires at); most recently used last
+        self._l1 = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._generation = None
+        self._next_sync = 0
+
+    @property
+    def l2(self):
+        return caches[self._l2_alias]
+
+    def _bypass(self, key):
+        return key.startswith(self._l2_only)
+
+    def _sync(self):
+        """Drop from L1 whatever other processes invalidated since the last check"""
+        now = time.monotonic()
+        if now < self._next_sync:
+            return
+        generation = self.l2.get(GENERATION_KEY, 0)
+        last = self._generation
+        if generation != last:
+            keys = self._invalidated(last, generation)
+            with self._lock:
+                if keys is None:
+                    self._l1.clear()
+                    self._bytes = 0
+                else:
+                    for key in keys:
+                        self._l1_drop(key)
+                self._generation = generation
+        self._next_sync = now + self._sync_interval
+
+    def _invalidated(self, last, generation):
+        """Keys logged after position `last` up to `generation`, or None if they can't all be known"""
+        if last is None or not 0 < generation - last <= MAX_INVALIDATIONS:
+            return None
+        log_keys = [INVALIDATED_KEY % n for n in range(last + 1, generation + 1)]
+        logged = self.l2.get_many(log_keys)
+        if len(logged) < len(log_keys):
+            return None
+        return logged.values()
+
+    def _log_invalidations(self, keys):
+        """Tell the other processes to drop `keys` (made keys) from their L1"""
+        try:
+            generation = self.l2.incr(GENERATION_KEY, len(keys))
+        except ValueError:
+            # Start from the clock, so a counter lost to clear() or eviction can't repeat an old value
+            self.l2.add(GENERATION_KEY, time.time_ns() // 1000, None)
+            generation = self.l2.incr(GENERATION_KEY, len(keys))
+        first = generation - len(keys) + 1
+        self.l2.set_many({INVALIDATED_KEY % (first + i): key for i, key in enumerate(keys)}, INVALIDATION_TIMEOUT)
+        # Our own L1 is up to date, unless another process logged something in between
+        if self._generation is not None and first == self._generation + 1:
+            self._generation = generation
+
+    def _l1_get(self, key):
+        with self._lock:
+            entry = self._l1.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                self._l1_drop(key)
+                return None
+            self._l1.move_to_end(key)
+            return entry[0]
+
+    def _l1_put(self, key, value, expires):
+        """Keep `value` in L1 for L1_TIMEOUT, or until `expires` (Unix time, None for never) if sooner"""
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        lifetime = self._l1_timeout if expires is None else min(expires - time.time(), self._l1_timeout)
+        if len(pickled) > self._max_bytes // 8 or lifetime <= 0:
+            # One value must not be able to flush most of L1
+            self._l1_delete(key)
+            return
+        with self._lock:
+            self._l1_drop(key)
+            self._l1[key] = (pickled, time.monotonic() + lifetime)
+            self._bytes += len(pickled)
+            while self._bytes > self._max_bytes:
+                _, (evicted, _) = self._l1.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def _l1_drop(self, key):
+        entry = self._l1.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[0])
+
+    def _l1_delete(self, key):
+        with self._lock:
+            self._l1_drop(key)
+
+    def get(self, key, default=None, version=None):
+        made = self.make_and_validate_key(key, version=version)
+        if self._bypass(key):
+            return self.l2.get(key, default, version=version)
+        self._sync()
+        pickled = self._l1_get(made)
+        if pickled is not None:
+            return pickle.loads(pickled)
+        get_with_expiry = getattr(self.l2, 'get_with_expiry', None)
+        if get_with_expiry is not None:
+            value, expires = get_with_expiry(key, self._missing_key, version=version)
+        else:
+            # This L2 can't tell how long the value has left; L1_TIMEOUT alone bounds it
+            value, expires = self.l2.get(key, self._missing_key, version=version), None
+        if value is self._missing_key:
+            return default
+        self._l1_put(made, value, expires)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        made = self.make_and_validate_key(key, version=version)
+        self.l2.set(key, value, timeout, version=version)
+        if not self._bypass(key):
+            self._l1_put(made, value, self.get_backend_timeout(timeout))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        made = self.make_and_validate_key(key, version=version)
+        added = self.l2.add(key, value, timeout, version=version)
+        if added and not self._bypass(key):
+            self._l1_put(made, value, self.get_backend_timeout(timeout))
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self._l1_delete(self.make_and_validate_key(key, version=version))
+        return self.l2.touch(key, timeout, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        made = self.make_and_validate_key(key, version=version)
+        value = self.l2.incr(key, delta, version=version)
+        if not self._bypass(key):
+            self._l1_delete(made)
+            self._log_invalidations([made])
+        return value
+
+    def delete(self, key, version=None):
+        made = self.make_and_validate_key(key, version=version)
+        self._l1_delete(made)
+        deleted = self.l2.delete(key, version=version)
+        if not self._bypass(key):
+            self._log_invalidations([made])
+        return deleted
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        if not keys:
+            return
+        made = [self.make_and_validate_key(key, version=version) for key in keys]
+        for key in made:
+            self._l1_delete(key)
+        self.l2.delete_many(keys, version=version)
+        cached = [key for key, original in zip(made, keys) if not self._bypass(original)]
+        if cached:
+            self._log_invalidations(cached)
+
+    def has_key(self, key, version=None):
+        return self.get(key, self._missing_key, version=version) is not self._missing_key
+
+    def clear(self):
+        with self._lock:
+            self._l1.clear()
+            self._bytes = 0
+        self.l2.clear()
+        # The log went with everything else; a new counter makes every other process empty its L1
+        self.l2.add(GENERATION_KEY, time.time_ns() // 1000, None)
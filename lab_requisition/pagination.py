@@ -0,0 +1,133 @@
+import base64
+import binascii
+import json
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def indexed_fields(model):
+    """Names of concrete fields that have a btree index behind them (db_index, unique or primary key)"""
+    return {
+        field.name for field in model._meta.concrete_fields
+        if field.db_index or field.unique or field.primary_key
+    }
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination keyed on (sort column, id).
+
+    Each page is fetched with `WHERE (col, id) < (last col, last id) ORDER BY col, id
+    LIMIT n`, so deep pages cost the same as the first one and no COUNT(*) is run.
+    Rows inserted while a client is paging don't shift the pages it has not read yet.
+    Only indexed columns can be sorted on; anything else would need a full sort
+    and is rejected with a 400.
+    """
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'order_by'
+    default_ordering = '-id'
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_ordering(self, request, queryset):
+        """Validated (field name, descending) pair for the requested ordering"""
+        ordering = request.query_params.get(self.ordering_query_param) or self.default_ordering
+        descending = ordering.startswith('-')
+        field_name = ordering.lstrip('-')
+        if field_name == 'pk':
+            field_name = 'id'
+        sortable = indexed_fields(queryset.model)
+        if field_name not in sortable:
+            raise ValidationError({
+                self.ordering_query_param: f"Cannot page on '{field_name}'. Sort by one of: {', '.join(sorted(sortable))}"
+            })
+        return field_name, descending
+
+    def encode_cursor(self, ordering, obj, field, reverse):
+        payload = {
+            'o': ordering,
+            'v': field.value_to_string(obj),
+            'id': obj.pk,
+            'r': reverse,
+        }
+        encoded = base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request, ordering, field):
+        """Return (value, id, reverse) from the cursor parameter, or None on the first page"""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            if payload['o'] != ordering:
+                raise ValidationError({self.cursor_query_param: 'Cursor was issued for a different order_by'})
+            return field.to_python(payload['v']), int(payload['id']), bool(payload['r'])
+        except (binascii.Error, ValueError, KeyError, TypeError, DjangoValidationError):
+            raise ValidationError({self.cursor_query_param: 'Invalid cursor'})
+
+    def paginate_queryset(self, queryset, request, view=None):
+        field_name, descending = self.get_ordering(request, queryset)
+        ordering = f"{'-' if descending else ''}{field_name}"
+        field = queryset.model._meta.get_field(field_name)
+        page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        cursor = self.decode_cursor(request, ordering, field)
+        reverse = bool(cursor and cursor[2])
+
+        # Walking backwards flips the scan direction; the page is re-reversed below
+        scan_descending = descending != reverse
+        if cursor:
+            value, pk, _ = cursor
+            op = 'lt' if scan_descending else 'gt'
+            if field_name == 'id':
+                queryset = queryset.filter(**{f'id__{op}': pk})
+            else:
+                queryset = queryset.filter(
+                    Q(**{f'{field_name}__{op}': value}) | Q(**{field_name: value, f'id__{op}': pk})
+                )
+        prefix = '-' if scan_descending else ''
+        order_fields = [f'{prefix}{field_name}'] if field_name == 'id' else [f'{prefix}{field_name}', f'{prefix}id']
+        results = list(queryset.order_by(*order_fields)[:page_size + 1])
+
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, cursor is not None
+
+        self.next_link = self.encode_cursor(ordering, results[-1], field, False) if results and has_next else None
+        self.previous_link = self.encode_cursor(ordering, results[0], field, True) if results and has_previous else None
+        return results
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.next_link,
+            'previous': self.previous_link,
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -48,6 +48,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'corsheaders',
@@ -170,17 +171,24 @@ CSRF_TRUSTED_ORIGINS = [
 
 AUTH_USER_MODEL = 'custom_auth.CustomUser'
 
+# Role given to users by designation, applied by update_roles_from_designation and after import_users
+DESIGNATION_ROLES = {
+    'Faculty': 'staff',
+    'PG': 'postgraduate',
+    'Intern': 'intern',
+}
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.TokenAuthentication',
+        'custom_auth.authentication.CachedSessionAuthentication',
+        'custom_auth.authentication.CachedTokenAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
     'DEFAULT_THROTTLE_CLASSES': [
-        'rest_framework.throttling.AnonRateThrottle',
-        'rest_framework.throttling.UserRateThrottle',
+        'custom_auth.throttling.AnonSlidingWindowThrottle',
+        'custom_auth.throttling.UserSlidingWindowThrottle',
     ],
     'DEFAULT_THROTTLE_RATES': {
         'anon': '150/minute',
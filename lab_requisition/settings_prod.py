@@ -3,6 +3,7 @@ Production settings for lab_requisition project.
 """
 from .settings import *
 import os
+from django.core.exceptions import ImproperlyConfigured
 
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = os.environ.get('SECRET_KEY', SECRET_KEY)
@@ -36,13 +37,30 @@ DATABASES = {
 }
 
 # Cache configuration
+# Every worker process shares one SQLite cache file ('shared'). 'default' keeps a small
+# in-process LRU in front of it, and deletes made by one worker reach the others' LRU
+# within SYNC_INTERVAL seconds. See lab_requisition/cache.py.
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
-    }
+        'BACKEND': 'lab_requisition.cache.TieredCache',
+        'OPTIONS': {
+            'L2': 'shared',
+            'MAX_BYTES': 32 * 1024 * 1024,
+            'SYNC_INTERVAL': 1,
+        },
+    },
+    'shared': {
+        'BACKEND': 'lab_requisition.cache.SQLiteCache',
+        'LOCATION': os.environ.get('CACHE_FILE', os.path.join(BASE_DIR, 'cache', 'shared.sqlite3')),
+        'OPTIONS': {'MAX_ENTRIES': 200000},
+    },
 }
 
+# Live order events
+# Writes are served by the WSGI process and the event streams by a separate ASGI one, so
+# events have to travel through PostgreSQL LISTEN/NOTIFY. See apps/orders/live.py.
+ORDER_EVENT_BACKEND = 'apps.orders.live.PostgresEventBackend'
+
 # Static files configuration
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 STATIC_URL = '/static/'
@@ -82,16 +100,16 @@ REST_FRAMEWORK = {
         'rest_framework.renderers.JSONRenderer',
     ),
     'DEFAULT_THROTTLE_CLASSES': (
-        'rest_framework.throttling.AnonRateThrottle',
-        'rest_framework.throttling.UserRateThrottle',
+        'custom_auth.throttling.AnonSlidingWindowThrottle',
+        'custom_auth.throttling.UserSlidingWindowThrottle',
     ),
     'DEFAULT_THROTTLE_RATES': {
         'anon': '100/day',
         'user': '1000/day',
     },
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.TokenAuthentication',
+        'custom_auth.authentication.CachedSessionAuthentication',
+        'custom_auth.authentication.CachedTokenAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
@@ -153,7 +171,13 @@ FILE_UPLOAD_MAX_MEMORY_SIZE = 5242880  # 5 MB
 DATA_UPLOAD_MAX_MEMORY_SIZE = 5242880  # 5 MB
 
 # Session settings
-SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+# SESSION_BACKEND=cached_db (default) reads sessions from the cache, falling back to the
+# table; signed_cookies keeps them in the cookie itself; db is the plain table.
+# Expired rows are cleared by `manage.py prune_auth`.
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'cached_db')
+if SESSION_BACKEND not in ('cached_db', 'signed_cookies', 'db'):
+    raise ImproperlyConfigured(f'Unknown SESSION_BACKEND {SESSION_BACKEND!r}')
+SESSION_ENGINE = f'django.contrib.sessions.backends.{SESSION_BACKEND}'
 SESSION_COOKIE_AGE = 86400  # 1 day in seconds
 SESSION_EXPIRE_AT_BROWSER_CLOSE = False
 SESSION_COOKIE_PATH = '/'
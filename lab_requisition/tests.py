@@ -0,0 +1,98 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
+from django.core.cache import caches
+from django.test import SimpleTestCase, override_settings
+from .cache import TieredCache
+
+
+class SharedCacheTests(SimpleTestCase):
+    """Two TieredCache instances over one SQLite file stand in for two worker processes"""
+
+    def setUp(self):
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        overrides = override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'shared': {'BACKEND': 'lab_requisition.cache.SQLiteCache', 'LOCATION': str(Path(directory.name) / 'cache.sqlite3')},
+        })
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.shared = caches['shared']
+        options = {'OPTIONS': {'L2': 'shared', 'MAX_BYTES': 8000, 'SYNC_INTERVAL': 0}}
+        self.worker_a = TieredCache('', options)
+        self.worker_b = TieredCache('', options)
+
+    def test_sqlite_cache(self):
+        self.assertTrue(self.shared.add('n', 1, 60))
+        self.assertFalse(self.shared.add('n', 5, 60))
+        self.assertEqual(self.shared.incr('n', 2), 3)
+        self.shared.set('gone', {'a': 1}, -1)
+        self.assertIsNone(self.shared.get('gone'))
+        self.assertTrue(self.shared.add('gone', 'again'))
+        self.assertEqual(self.shared.get_many(['n', 'gone', 'missing']), {'n': 3, 'gone': 'again'})
+        with self.assertRaises(ValueError):
+            self.shared.incr('missing')
+
+    def test_incr_is_atomic_across_connections(self):
+        self.shared.set('hits', 0, 60)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(lambda _: self.shared.incr('hits'), range(200)))
+        self.assertEqual(self.shared.get('hits'), 200)
+
+    def test_delete_reaches_other_workers(self):
+        self.worker_a.set('user', 'old', 60)
+        self.assertEqual(self.worker_b.get('user'), 'old')
+        self.worker_a.delete('user')
+        self.assertIsNone(self.worker_b.get('user'))
+        self.worker_b.set('user', 'new', 60)
+        self.assertEqual(self.worker_a.get('user'), 'new')
+
+    def test_l1_is_bounded_and_serves_without_l2(self):
+        self.worker_a.get('first-sync')
+        for i in range(20):
+            self.worker_a.set(f'k{i}', 'x' * 900, 60)
+        self.assertLessEqual(self.worker_a._bytes, 8000)
+        self.assertIn(self.worker_a.make_key('k19'), self.worker_a._l1)
+        self.assertNotIn(self.worker_a.make_key('k0'), self.worker_a._l1)
+        self.shared.delete('k19')
+        # Deleted behind its back: L1 still answers until a delete goes through the tiered cache
+        self.assertEqual(self.worker_a.get('k19'), 'x' * 900)
+        self.assertEqual(self.worker_b.get('k0'), 'x' * 900)
+
+    def test_l1_keeps_values_no_longer_than_l2(self):
+        self.worker_a.get('first-sync')
+        self.shared.set('short', 'v', 2)
+        self.shared.set('forever', 'v', None)
+        self.assertEqual(self.shared.get_with_expiry('forever'), ('v', None))
+        self.assertEqual(self.worker_a.get('short'), 'v')
+        self.assertEqual(self.worker_a.get('forever'), 'v')
+        self.assertLessEqual(self.worker_a._l1[self.worker_a.make_key('short')][1] - time.monotonic(), 2)
+        self.assertGreater(self.worker_a._l1[self.worker_a.make_key('forever')][1] - time.monotonic(), 25)
+
+    def test_delete_drops_only_that_key_elsewhere(self):
+        # The log starts with the first delete; a worker that synced before then starts over once
+        self.worker_a.delete('first-delete')
+        self.worker_b.get('first-sync')
+        for key in ('user:1', 'user:2'):
+            self.worker_a.set(key, 'old', 60)
+            self.worker_b.get(key)
+        self.worker_a.delete('user:1')
+        self.shared.set('user:1', 'new', 60)
+        self.shared.set('user:2', 'new', 60)
+        self.assertEqual(self.worker_b.get('user:1'), 'new')
+        # Still answered from worker B's L1
+        self.assertEqual(self.worker_b.get('user:2'), 'old')
+
+    def test_a_worker_too_far_behind_empties_its_l1(self):
+        self.worker_a.delete('first-delete')
+        self.worker_b.get('first-sync')
+        self.worker_a.set('user:2', 'old', 60)
+        self.worker_b.get('user:2')
+        self.shared.set('user:2', 'new', 60)
+        with mock.patch('lab_requisition.cache.MAX_INVALIDATIONS', 2):
+            self.worker_a.delete_many(['user:1', 'user:3', 'user:4'])
+            self.assertEqual(self.worker_b.get('user:2'), 'new')
+